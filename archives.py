@@ -0,0 +1,353 @@
+"""Shared, memory-mapped access to the .pptx archives of the library.
+
+The thumbnailer, the text extractor and the viewer all open the same
+decks, often at the same time. Each archive is mapped once and its
+central directory parsed once; every open of that file hands out a
+handle on the same MappedZip. Stored members (the pictures, mostly) are
+read as memoryviews of the mapping without copying, deflated members are
+inflated as they are read. A few recently used archives stay mapped;
+older ones are unmapped once their last handle is closed.
+
+Library files are replaced by renaming (see updates.py), never rewritten
+in place, so a mapping never sees its file shrink under it; a file whose
+size, mtime or inode changed is simply mapped again on the next open.
+"""
+import io
+import mmap
+import os
+import struct
+import zipfile
+import zlib
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+MAX_OPEN = 16  # archives kept mapped while nothing uses them; each holds a file descriptor
+CHUNK_SIZE = 64 * 1024  # compressed bytes inflated at a time
+
+STORED, DEFLATED = 0, 8
+ENCRYPTED_FLAG, UTF8_FLAG = 0x1, 0x800
+
+END = struct.Struct("<4s4H2LH")
+END_SIGNATURE = b"PK\x05\x06"
+END_SEARCH = END.size + 0xFFFF  # the end record is followed by at most a 64 KB comment
+ZIP64_LOCATOR = struct.Struct("<4sLQL")
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+ZIP64_END = struct.Struct("<4sQ2H2L4Q")
+ZIP64_END_SIGNATURE = b"PK\x06\x06"
+CENTRAL = struct.Struct("<4s6H3L5H2L")
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+LOCAL = struct.Struct("<4s5H3L2H")
+LOCAL_SIGNATURE = b"PK\x03\x04"
+ZIP64_EXTRA = 0x0001
+
+Member = namedtuple("Member", ["method", "flags", "crc", "compressed_size", "size", "header_offset"])
+
+
+def _zip64_sizes(extra, size, compressed_size, header_offset):
+    """Fill in the fields the central directory left at 0xFFFFFFFF from the zip64 extra field."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, length = struct.unpack_from("<2H", extra, pos)
+        if tag == ZIP64_EXTRA:
+            values = list(struct.unpack_from(f"<{length // 8}Q", extra, pos + 4))
+            if size == 0xFFFFFFFF:
+                size = values.pop(0)
+            if compressed_size == 0xFFFFFFFF:
+                compressed_size = values.pop(0)
+            if header_offset == 0xFFFFFFFF:
+                header_offset = values.pop(0)
+            break
+        pos += 4 + length
+    return size, compressed_size, header_offset
+
+
+def read_directory(data):
+    """Member name -> Member for the zip archive in the buffer `data`, in archive order."""
+    tail_start = max(0, len(data) - END_SEARCH)
+    end = data.rfind(END_SIGNATURE, tail_start)
+    if end == -1 or end + END.size > len(data):
+        raise zipfile.BadZipFile("File is not a zip file")
+    _, _, _, _, count, directory_size, directory_offset, _ = END.unpack_from(data, end)
+    directory_end = end
+    if count == 0xFFFF or directory_offset == 0xFFFFFFFF or directory_size == 0xFFFFFFFF:
+        locator = end - ZIP64_LOCATOR.size
+        if locator >= 0 and data[locator:locator + 4] == ZIP64_LOCATOR_SIGNATURE:
+            _, _, zip64_end, _ = ZIP64_LOCATOR.unpack_from(data, locator)
+            if data[zip64_end:zip64_end + 4] != ZIP64_END_SIGNATURE:
+                raise zipfile.BadZipFile("Corrupt zip64 end of central directory")
+            _, _, _, _, _, _, _, count, directory_size, directory_offset = ZIP64_END.unpack_from(data, zip64_end)
+            directory_end = zip64_end
+    # Anything prepended to the archive (a self-extractor stub) shifts every offset
+    shift = directory_end - directory_size - directory_offset
+    if shift < 0:
+        raise zipfile.BadZipFile("Central directory is past the end of the file")
+
+    members = {}
+    pos = directory_offset + shift
+    for _ in range(count):
+        if data[pos:pos + 4] != CENTRAL_SIGNATURE:
+            raise zipfile.BadZipFile("Bad magic number for central directory")
+        (_, _, _, flags, method, _, _, crc, compressed_size, size,
+         name_length, extra_length, comment_length, _, _, _, header_offset) = CENTRAL.unpack_from(data, pos)
+        pos += CENTRAL.size
+        raw_name = bytes(data[pos:pos + name_length])
+        name = raw_name.decode("utf-8" if flags & UTF8_FLAG else "cp437")
+        extra = bytes(data[pos + name_length:pos + name_length + extra_length])
+        size, compressed_size, header_offset = _zip64_sizes(extra, size, compressed_size, header_offset)
+        pos += name_length + extra_length + comment_length
+        members[name] = Member(method, flags, crc, compressed_size, size, header_offset + shift)
+    return members
+
+
+class StoredMember(io.RawIOBase):
+    """A seekable file over a stored member's bytes in the mapping; reads copy only what they return."""
+
+    def __init__(self, view):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), len(self._view) - self._pos))
+        buffer[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+        data = bytes(self._view[self._pos:end])
+        self._pos = max(self._pos, end)
+        return data
+
+    readall = read
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = (0, self._pos, len(self._view))[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view = memoryview(b"")
+        super().close()
+
+
+class DeflatedMember(io.RawIOBase):
+    """Inflates a deflated member a chunk at a time as it is read, checking its CRC at the end."""
+
+    def __init__(self, name, view, member):
+        super().__init__()
+        self._name = name
+        self._view = view
+        self._member = member
+        self._pos = 0
+        self._inflater = zlib.decompressobj(-15)
+        self._crc = 0
+        self._produced = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._inflater.eof:
+            return 0
+        while True:
+            data = self._inflater.unconsumed_tail
+            if not data:
+                data = self._view[self._pos:self._pos + CHUNK_SIZE]
+                self._pos += len(data)
+            try:
+                out = self._inflater.decompress(data, len(buffer))
+            except zlib.error as e:
+                raise zipfile.BadZipFile(f"Corrupt member {self._name!r}: {e}")
+            if out or self._inflater.eof:
+                break
+            if not data:
+                raise zipfile.BadZipFile(f"Member {self._name!r} is truncated")
+        buffer[:len(out)] = out
+        self._crc = zlib.crc32(out, self._crc)
+        self._produced += len(out)
+        if self._inflater.eof and (self._crc != self._member.crc or self._produced != self._member.size):
+            raise zipfile.BadZipFile(f"Bad CRC-32 for member {self._name!r}")
+        return len(out)
+
+    def close(self):
+        self._view = memoryview(b"")
+        super().close()
+
+
+class MappedZip:
+    """One mapped archive and its central directory, shared by every handle on the file."""
+
+    def __init__(self, path, stamp):
+        self.path = path
+        self.stamp = stamp
+        self.size = stamp[0]
+        self.users = 0
+        self.retired = False  # out of the cache; unmapped when the last handle closes
+        with open(path, "rb") as fh:
+            try:
+                # The mapping keeps its own descriptor, so the file can be closed now
+                self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise zipfile.BadZipFile("File is not a zip file")  # empty
+        try:
+            self.members = read_directory(self._map)
+        except (zipfile.BadZipFile, struct.error) as e:
+            self._map.close()
+            raise zipfile.BadZipFile(str(e))
+        self._starts = {}  # name -> offset of the member's data, read from its local header on first use
+
+    def _raw(self, name):
+        """(Member, memoryview of its bytes as stored in the archive)."""
+        member = self.members.get(name)
+        if member is None:
+            raise KeyError(f"There is no item named {name!r} in the archive")
+        if member.flags & ENCRYPTED_FLAG:
+            raise zipfile.BadZipFile(f"Member {name!r} is encrypted")
+        start = self._starts.get(name)
+        if start is None:
+            offset = member.header_offset
+            if self._map[offset:offset + 4] != LOCAL_SIGNATURE:
+                raise zipfile.BadZipFile(f"Bad magic number for member {name!r}")
+            name_length, extra_length = struct.unpack_from("<2H", self._map, offset + LOCAL.size - 4)
+            start = self._starts[name] = offset + LOCAL.size + name_length + extra_length
+        if start + member.compressed_size > len(self._map):
+            raise zipfile.BadZipFile(f"Member {name!r} is truncated")
+        return member, memoryview(self._map)[start:start + member.compressed_size]
+
+    def close(self):
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # a caller still holds a view; the mapping goes when the view does
+
+
+class ZipHandle:
+    """One user's hold on a MappedZip, with the part of zipfile.ZipFile's interface the app uses."""
+
+    def __init__(self, cache, archive):
+        self._cache = cache
+        self._archive = archive
+
+    def namelist(self):
+        return list(self._archive.members)
+
+    def view(self, name):
+        """The bytes of a stored member, as a memoryview of the mapping; None for a compressed one.
+
+        Nothing is copied or checked; the view is only good while this handle is open.
+        """
+        member, raw = self._archive._raw(name)
+        return raw if member.method == STORED else None
+
+    def open(self, name):
+        """A file object over the member: zero-copy and seekable if stored, inflated as read if deflated."""
+        member, raw = self._archive._raw(name)
+        if member.method == STORED:
+            return StoredMember(raw)
+        if member.method == DEFLATED:
+            return io.BufferedReader(DeflatedMember(name, raw, member), CHUNK_SIZE)
+        raise zipfile.BadZipFile(f"Member {name!r} uses unsupported compression method {member.method}")
+
+    def read(self, name):
+        member, raw = self._archive._raw(name)
+        if member.method == STORED:
+            data = bytes(raw)
+            if zlib.crc32(data) != member.crc:
+                raise zipfile.BadZipFile(f"Bad CRC-32 for member {name!r}")
+            return data
+        with self.open(name) as fh:
+            return fh.read()
+
+    def close(self):
+        if self._archive is not None:
+            self._cache._release(self._archive)
+            self._archive = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveCache:
+    """Mapped archives by path, least recently opened first, at most `max_open` of them idle."""
+
+    def __init__(self, max_open=MAX_OPEN):
+        self.max_open = max_open
+        self._archives = OrderedDict()  # path -> MappedZip
+        self._lock = Lock()
+        self.parses = 0  # central directories read, for benchmarks
+
+    def open(self, path):
+        """A ZipHandle on the archive at `path`; close it when done."""
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self._lock:
+            archive = self._archives.get(path)
+            if archive is not None and archive.stamp != stamp:
+                self._retire(self._archives.pop(path))
+                archive = None
+            if archive is None:
+                # Directory parsing is quick; doing it under the lock means
+                # concurrent first opens of a deck still parse it once
+                archive = self._archives[path] = MappedZip(path, stamp)
+                self.parses += 1
+                self._evict()
+            else:
+                self._archives.move_to_end(path)
+            archive.users += 1
+        return ZipHandle(self, archive)
+
+    def idle_bytes(self):
+        """Bytes mapped for archives that nothing is using; ones in use are counted by their users."""
+        with self._lock:
+            return sum(archive.size for archive in self._archives.values() if not archive.users)
+
+    def trim(self, target):
+        """Unmap idle archives, least recently opened first, until at most `target` bytes of them stay mapped."""
+        with self._lock:
+            idle = [(path, archive.size) for path, archive in self._archives.items() if not archive.users]
+            mapped = sum(size for _, size in idle)
+            for path, size in idle:
+                if mapped <= target:
+                    break
+                self._retire(self._archives.pop(path))
+                mapped -= size
+
+    def _release(self, archive):
+        with self._lock:
+            archive.users -= 1
+            if archive.retired and not archive.users:
+                archive.close()
+            else:
+                self._evict()
+
+    def _evict(self):
+        idle = [path for path, archive in self._archives.items() if not archive.users]
+        for path in idle[:max(0, len(idle) - self.max_open)]:
+            self._retire(self._archives.pop(path))
+
+    @staticmethod
+    def _retire(archive):
+        archive.retired = True
+        if not archive.users:
+            archive.close()
+
+
+archives = ArchiveCache()
+
+
+def open_zip(path):
+    """A ZipHandle on the loose .pptx at `path`, from the shared cache."""
+    return archives.open(path)
@@ -0,0 +1,7 @@
+"""Performance benchmarks for the app, run on a desktop against synthetic libraries.
+
+    python -m benchmarks.synthlib TARGET [--preset NAME]   build a library
+    python -m benchmarks.run [--preset NAME] ...            benchmark and compare to baseline
+
+Not shipped in the APK (see source.exclude_dirs in buildozer.spec).
+"""
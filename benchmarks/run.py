@@ -0,0 +1,343 @@
+"""Headless benchmarks for navigation, file listing, indexing, search, thumbnails and prefetching.
+
+    python -m benchmarks.run [--preset NAME] [--repeat N] [--library DIR]
+                             [--output FILE] [--baseline FILE] [--update-baseline]
+                             [--tolerance FRACTION]
+
+Drives a real MainMenu through its _show_*_popup chain in an offscreen
+window, rendering a frame after each step, and times the catalog,
+search index and thumbnail loader directly. Every benchmark reports p50
+and p95 in milliseconds, and the run records peak RSS.
+
+Results are written as JSON and compared with the baseline (by default
+benchmarks/baseline-<preset>.json). A p95 or peak RSS more than
+`tolerance` above the baseline is a regression: each one is printed and
+the exit status is 1. Baselines only compare on the machine that
+recorded them; refresh one with --update-baseline after an intended
+change.
+"""
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Before Kivy is imported: no argv parsing, no real display needed
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+os.environ.setdefault("KCFG_KIVY_LOG_LEVEL", "warning")
+
+from benchmarks import synthlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TOLERANCE = 0.5
+# Absolute slack so sub-millisecond steps don't flap on scheduler noise
+NOISE_FLOOR_MS = 2.0
+QUERIES = ("analysis", "stat", "lesson week", "probability sample", "research method", "q")
+THUMBNAILS_TIMED = 24
+WAIT_TIMEOUT = 120
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # benchmark name -> [seconds]
+
+    def add(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def time(self, name, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.add(name, time.perf_counter() - start)
+        return result
+
+    def summary(self):
+        return {
+            name: {
+                "runs": len(values),
+                "p50_ms": round(percentile(values, 0.5) * 1000, 3),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+                "max_ms": round(max(values) * 1000, 3),
+            }
+            for name, values in sorted(self.samples.items())
+        }
+
+
+def frame():
+    """Run one iteration of the Kivy loop (clock callbacks, layout, draw) and
+    wait for the GPU to finish it.
+
+    Software GL queues frames until something forces a flush, which would
+    otherwise bill several frames of drawing to whichever step comes next.
+    """
+    from kivy.base import EventLoop
+    from kivy.graphics.opengl import glFinish
+
+    EventLoop.idle()
+    glFinish()
+
+
+def pump_until(done, what):
+    deadline = time.perf_counter() + WAIT_TIMEOUT
+    while not done():
+        if time.perf_counter() > deadline:
+            raise RuntimeError(f"Timed out waiting for {what}")
+        frame()
+
+
+def bench_catalog(rec, library, data_dir, repeat):
+    from catalog import Catalog
+
+    for _ in range(repeat):
+        rec.time("catalog.scan_cold", Catalog(library).load)
+    index_path = os.path.join(data_dir, "bench-catalog.json")
+    Catalog(library, index_path).load()
+    for _ in range(repeat):
+        rec.time("catalog.load_warm", Catalog(library, index_path).load)
+    return Catalog(library, index_path).load()
+
+
+def bench_index(rec, catalog, data_dir, repeat):
+    from search import SearchIndex
+
+    index_path = os.path.join(data_dir, "bench-search.json")
+    # Extraction of every file dominates, so a few runs are plenty
+    for _ in range(min(repeat, 3)):
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        rec.time("index.build_cold", SearchIndex(index_path).update, catalog)
+    for _ in range(repeat):
+        rec.time("index.load_warm", SearchIndex(index_path).load)
+    index = SearchIndex(index_path)
+    index.load()
+    for _ in range(repeat):
+        for query in QUERIES:
+            rec.time("search.query", index.search, query, 50)
+
+
+def bench_navigation(rec, menu, repeat, rng):
+    catalog = menu.catalog
+    # The first pass builds the popup and warms font caches; it isn't timed
+    for run in range(repeat + 1):
+        quarter = rng.choice(catalog.quarters())
+        subject = rng.choice(catalog.subjects(quarter))
+        week = rng.choice(catalog.weeks(quarter, subject))
+        title = "Grade 11"
+        steps = [
+            ("nav.quarters", lambda: menu._show_quarters_popup(title)),
+            ("nav.subjects", lambda: menu._show_subjects_popup(f"{title} - Q", quarter)),
+            ("nav.weeks", lambda: menu._show_weeks_popup(f"{title} - Q - S", quarter, subject)),
+            ("nav.files", lambda: menu._show_files_popup(f"{title} - Q - S - W", quarter, subject, week)),
+            ("nav.back", menu.navigator.back),
+        ]
+        for name, step in steps:
+            gc.collect()  # keep collector pauses from earlier steps out of this one
+            start = time.perf_counter()
+            step()
+            frame()
+            if run:
+                rec.add(name, time.perf_counter() - start)
+        menu.navigator.close()
+        frame()
+
+
+def bench_prefetch(rec, menu, repeat, rng):
+    """A file list until its visible previews are in, after a pause on its week list.
+
+    The pause lets the prefetcher finish, as it would while the user reads
+    the list; previews start out of memory but may be in the disk cache.
+    """
+    catalog = menu.catalog
+
+    def previews_shown():
+        rows = menu.navigator.items_list.layout_manager.children
+        return not any(row.thumb_key in menu.thumbnails._pending for row in rows)
+
+    for _ in range(repeat):
+        quarter = rng.choice(catalog.quarters())
+        subject = rng.choice(catalog.subjects(quarter))
+        week = rng.choice(catalog.weeks(quarter, subject))
+        menu.thumbnails.clear_memory()
+        menu._show_quarters_popup("Grade 11")
+        menu._show_subjects_popup("Grade 11 - Q", quarter)
+        menu._show_weeks_popup("Grade 11 - Q - S", quarter, subject)
+        pump_until(lambda: not menu.prefetcher.busy, "prefetch")
+        gc.collect()
+        start = time.perf_counter()
+        menu._show_files_popup("Grade 11 - Q - S - W", quarter, subject, week)
+        frame()
+        pump_until(previews_shown, "previews")
+        rec.add("nav.files_previews", time.perf_counter() - start)
+        menu.navigator.close()
+        frame()
+
+
+def bench_search_ui(rec, menu, repeat):
+    for _ in range(repeat):
+        for query in QUERIES:
+            start = time.perf_counter()
+            menu.search_input.text = query
+            menu._run_search()
+            frame()
+            rec.add("search.results_shown", time.perf_counter() - start)
+    menu.search_input.text = ""
+    menu._run_search()
+
+
+def bench_thumbnails(rec, menu, data_dir):
+    from thumbnails import ThumbnailLoader
+
+    cache_dir = os.path.join(data_dir, "bench-thumbnails")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    loader = ThumbnailLoader(cache_dir, menu.jobs)
+    catalog = menu.catalog
+    entries = [e for e in catalog.entries() if e.kind in ("pptx", "pdf")][:THUMBNAILS_TIMED]
+    keys = [ThumbnailLoader.key_for(catalog.abs_path(e), e.size, e.mtime, e.kind) for e in entries]
+
+    for name in ("thumbnail.cold", "thumbnail.disk_cache"):
+        loader.clear_memory()
+        started = {}
+        finished = {}
+
+        def loaded(key, texture, name=name):
+            finished[key] = time.perf_counter()
+            rec.add(name, finished[key] - started[key])
+
+        for key in keys:
+            started[key] = time.perf_counter()
+            if loader.request(key, loaded) is not None:
+                loaded(key, None)
+        pump_until(lambda: len(finished) == len(keys), "thumbnails")
+
+
+def run(library, data_dir, repeat, seed=0):
+    # The menu resolves its data files through this, so nothing touches the user's
+    os.environ["GREGOR_DATA_DIR"] = data_dir
+    from kivy.base import EventLoop
+    from kivy.core.window import Window
+    from main import MainMenu
+
+    rec = Recorder()
+    rng = random.Random(seed)
+    catalog = bench_catalog(rec, library, data_dir, repeat)
+    bench_index(rec, catalog, data_dir, repeat)
+
+    EventLoop.ensure_window()
+    menu = MainMenu(library_dir=library, pack_path=None)
+    Window.add_widget(menu)
+    pump_until(lambda: menu.search_index.ready, "warm-up")
+    bench_navigation(rec, menu, repeat, rng)
+    bench_prefetch(rec, menu, repeat, rng)
+    bench_search_ui(rec, menu, repeat)
+    bench_thumbnails(rec, menu, data_dir)
+    Window.remove_widget(menu)
+    return rec.summary()
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`, as printable lines."""
+    problems = []
+    if baseline.get("library") != results["library"]:
+        problems.append(f"baseline was recorded on a different library: {baseline.get('library')}")
+        return problems
+    for name, base in sorted(baseline["benchmarks"].items()):
+        current = results["benchmarks"].get(name)
+        if current is None:
+            problems.append(f"{name}: no longer measured")
+            continue
+        limit = base["p95_ms"] * (1 + tolerance) + NOISE_FLOOR_MS
+        if current["p95_ms"] > limit:
+            problems.append(f"{name}: p95 {current['p95_ms']:.2f} ms, baseline {base['p95_ms']:.2f} ms "
+                            f"(limit {limit:.2f} ms)")
+    base_rss, rss = baseline.get("peak_rss_mb"), results.get("peak_rss_mb")
+    if base_rss and rss and rss > base_rss * (1 + tolerance):
+        problems.append(f"peak RSS: {rss:.1f} MB, baseline {base_rss:.1f} MB")
+    return problems
+
+
+def print_results(results, baseline):
+    base = (baseline or {}).get("benchmarks", {})
+    print(f"\n{'benchmark':<24} {'runs':>5} {'p50 ms':>9} {'p95 ms':>9} {'base p95':>9}")
+    for name, row in results["benchmarks"].items():
+        previous = f"{base[name]['p95_ms']:9.2f}" if name in base else f"{'-':>9}"
+        print(f"{name:<24} {row['runs']:>5} {row['p50_ms']:9.2f} {row['p95_ms']:9.2f} {previous}")
+    print(f"peak RSS {results['peak_rss_mb']} MB")
+
+
+def main(argv):
+    def option(flag, default):
+        return argv[argv.index(flag) + 1] if flag in argv else default
+
+    preset = option("--preset", "default")
+    if preset not in synthlib.PRESETS:
+        print(f"Unknown preset {preset}; choose from {', '.join(synthlib.PRESETS)}")
+        return 2
+    repeat = int(option("--repeat", 20))
+    tolerance = float(option("--tolerance", DEFAULT_TOLERANCE))
+    library = option("--library", os.path.join(tempfile.gettempdir(), f"gregor-synthlib-{preset}"))
+    output = option("--output", f"benchmark-{preset}.json")
+    baseline_path = option("--baseline", os.path.join(BENCH_DIR, f"baseline-{preset}.json"))
+
+    files = synthlib.generate_preset(library, preset)
+    data_dir = tempfile.mkdtemp(prefix="gregor-bench-")
+    try:
+        benchmarks = run(library, data_dir, repeat)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    results = {
+        "library": {"preset": preset, "files": files},
+        "repeat": repeat,
+        "time": time.time(),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}",
+        "benchmarks": benchmarks,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, indent=1)
+
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path, "r", encoding="utf-8") as fh:
+            baseline = json.load(fh)
+    print_results(results, baseline)
+    print(f"Results written to {output}")
+
+    if "--update-baseline" in argv:
+        shutil.copyfile(output, baseline_path)
+        print(f"Baseline updated: {baseline_path}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {baseline_path}; record one with --update-baseline")
+        return 0
+    problems = compare(results, baseline, tolerance)
+    if problems:
+        print(f"\nREGRESSION against {baseline_path} (tolerance {tolerance:.0%}):")
+        for line in problems:
+            print(f"  {line}")
+        return 1
+    print(f"No regressions against {baseline_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,267 @@
+"""Generate synthetic lesson libraries shaped like GregorELibrary.
+
+    python -m benchmarks.synthlib TARGET [--preset NAME] [--force]
+
+Decks are real .pptx zips (title and body text, pictures, some with an
+embedded preview) and PDFs have real text and JPEG images, so the
+catalog, search, thumbnail and viewer code all do their actual work.
+Output is deterministic for a given preset; a manifest next to the tree
+lets later runs reuse it.
+"""
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import zipfile
+import zlib
+
+from catalog import Catalog
+
+MANIFEST_SUFFIX = ".synthlib.json"
+GENERATOR_VERSION = 1
+
+SUBJECTS = [
+    "Oral Comm", "Reading and Writing", "21st Century Literature", "Statistics and Probability",
+    "Understanding Culture, Society, and Politics", "Earth and Life Science", "General Mathematics",
+    "Physical Education and Health", "Media and Information Literacy", "Empowerment Technologies",
+]
+WORDS = (
+    "analysis argument audience claim context culture data debate definition discourse evidence "
+    "example feedback function graph hypothesis identity inference interview literature media "
+    "method model narrative observation outline paragraph pattern poem population probability "
+    "proposal question reading research sample society source speech statistic summary survey "
+    "system technology theme thesis variable vocabulary writing"
+).split()
+
+PRESETS = {
+    # quarters, subjects per quarter, weeks per subject, lessons per week,
+    # slides per deck, pages per PDF, picture size in pixels
+    "small": dict(quarters=2, subjects=3, weeks=4, lessons=2, slides=6, pages=2, picture=(640, 360)),
+    "default": dict(quarters=4, subjects=5, weeks=8, lessons=3, slides=12, pages=4, picture=(1280, 720)),
+    "large": dict(quarters=4, subjects=8, weeks=10, lessons=5, slides=25, pages=8, picture=(1920, 1080)),
+}
+
+NS_P = "http://schemas.openxmlformats.org/presentationml/2006/main"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+NS_R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+SLIDE_CX, SLIDE_CY = 12192000, 6858000
+
+
+def _sentence(rng, words=10):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _xml(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def make_jpeg(rng, size, quality=80):
+    """A picture with enough structure that JPEG size and decode cost are realistic."""
+    from PIL import Image, ImageDraw
+
+    width, height = size
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(24):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(width // 12, width // 3), rng.randrange(height // 12, height // 3)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle((x, y, x + w, y + h), fill=color)
+        else:
+            draw.ellipse((x, y, x + w, y + h), fill=color)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _text_shape(shape_id, name, rect, paragraphs, size):
+    x, y, cx, cy = rect
+    body = "".join(
+        f'<a:p><a:r><a:rPr lang="en-US" sz="{size}"/><a:t>{_xml(text)}</a:t></a:r></a:p>'
+        for text in paragraphs
+    )
+    return (
+        f'<p:sp><p:nvSpPr><p:cNvPr id="{shape_id}" name="{name}"/><p:cNvSpPr/><p:nvPr/></p:nvSpPr>'
+        f'<p:spPr><a:xfrm><a:off x="{x}" y="{y}"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm></p:spPr>'
+        f'<p:txBody><a:bodyPr/><a:lstStyle/>{body}</p:txBody></p:sp>'
+    )
+
+
+def _picture(shape_id, rel_id, rect):
+    x, y, cx, cy = rect
+    return (
+        f'<p:pic><p:nvPicPr><p:cNvPr id="{shape_id}" name="Picture {shape_id}"/><p:cNvPicPr/><p:nvPr/></p:nvPicPr>'
+        f'<p:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></p:blipFill>'
+        f'<p:spPr><a:xfrm><a:off x="{x}" y="{y}"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm></p:spPr></p:pic>'
+    )
+
+
+def _rels(rows):
+    body = "".join(f'<Relationship Id="{rid}" Type="{REL}{kind}" Target="{target}"/>'
+                   for rid, kind, target in rows)
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{body}</Relationships>')
+
+
+def make_pptx(path, rng, title, slides, picture, logo):
+    """Write a deck of `slides` slides; every third slide has a picture."""
+    pictures = {}  # slide number -> media name
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        slide_ids = []
+        overrides = []
+        for number in range(1, slides + 1):
+            shapes = [
+                _text_shape(2, "Title", (457200, 274638, 11277600, 1143000),
+                            [title if number == 1 else _sentence(rng, 5)], 4000),
+                _text_shape(3, "Body", (457200, 1600200, 6400800, 4525963),
+                            [_sentence(rng, rng.randrange(8, 16)) for _ in range(rng.randrange(3, 7))], 2000),
+            ]
+            rels = [("rId1", "image", "../media/logo.jpeg")]
+            shapes.append(_picture(4, "rId1", (10972800, 6096000, 914400, 548640)))
+            if number % 3 == 1:
+                pictures[number] = f"image{number}.jpeg"
+                rels.append(("rId2", "image", f"../media/{pictures[number]}"))
+                shapes.append(_picture(5, "rId2", (7162800, 1600200, 4572000, 2571750)))
+            archive.writestr(f"ppt/slides/slide{number}.xml", (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                f'<p:sld xmlns:a="{NS_A}" xmlns:r="{NS_R}" xmlns:p="{NS_P}"><p:cSld><p:spTree>'
+                '<p:nvGrpSpPr><p:cNvPr id="1" name=""/><p:cNvGrpSpPr/><p:nvPr/></p:nvGrpSpPr><p:grpSpPr/>'
+                + "".join(shapes) + '</p:spTree></p:cSld></p:sld>'
+            ))
+            archive.writestr(f"ppt/slides/_rels/slide{number}.xml.rels", _rels(rels))
+            slide_ids.append(f'<p:sldId id="{255 + number}" r:id="rId{number}"/>')
+            overrides.append(f'<Override PartName="/ppt/slides/slide{number}.xml" ContentType='
+                             '"application/vnd.openxmlformats-officedocument.presentationml.slide+xml"/>')
+
+        archive.writestr("ppt/media/logo.jpeg", logo)
+        for name in pictures.values():
+            archive.writestr(f"ppt/media/{name}", make_jpeg(rng, picture))
+        archive.writestr("ppt/presentation.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<p:presentation xmlns:a="{NS_A}" xmlns:r="{NS_R}" xmlns:p="{NS_P}">'
+            f'<p:sldIdLst>{"".join(slide_ids)}</p:sldIdLst>'
+            f'<p:sldSz cx="{SLIDE_CX}" cy="{SLIDE_CY}"/><p:notesSz cx="6858000" cy="9144000"/></p:presentation>'
+        ))
+        archive.writestr("ppt/_rels/presentation.xml.rels",
+                         _rels([(f"rId{n}", "slide", f"slides/slide{n}.xml") for n in range(1, slides + 1)]))
+        package_rels = [("rId1", "officeDocument", "ppt/presentation.xml")]
+        if rng.random() < 0.5:
+            # Half the decks carry PowerPoint's own preview, half fall back to slide pictures
+            archive.writestr("docProps/thumbnail.jpeg", make_jpeg(rng, (256, 144), quality=60))
+            package_rels.append(("rId2", "metadata/thumbnail", "docProps/thumbnail.jpeg"))
+        archive.writestr("_rels/.rels", _rels(package_rels))
+        archive.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Default Extension="jpeg" ContentType="image/jpeg"/>'
+            '<Override PartName="/ppt/presentation.xml" ContentType='
+            '"application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml"/>'
+            + "".join(overrides) + '</Types>'
+        ))
+
+
+def _pdf_string(text):
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def make_pdf(path, rng, title, pages, picture):
+    """Write a Helvetica text PDF with a JPEG on the first page."""
+    objects = {}  # number -> bytes between "obj" and "endobj"
+    image = make_jpeg(rng, picture)
+    width, height = 612, 792
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"
+    objects[4] = (f"<< /Type /XObject /Subtype /Image /Width {picture[0]} /Height {picture[1]} "
+                  f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode /Length {len(image)} >>\n"
+                  ).encode("latin-1") + b"stream\n" + image + b"\nendstream"
+    page_numbers = []
+    for page in range(pages):
+        lines = ["BT /F1 20 Tf 72 720 Td", f"{_pdf_string(title if page == 0 else _sentence(rng, 5))} Tj",
+                 "/F1 11 Tf 0 -30 Td 14 TL"]
+        for _ in range(rng.randrange(20, 36)):
+            lines.append(f"{_pdf_string(_sentence(rng, rng.randrange(8, 13)))} '")
+        lines.append("ET")
+        if page == 0:
+            lines.append(f"q 468 0 0 {468 * picture[1] // picture[0]} 72 120 cm /Im1 Do Q")
+        content = zlib.compress("\n".join(lines).encode("latin-1"))
+        page_obj, content_obj = 5 + page * 2, 6 + page * 2
+        objects[content_obj] = (f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode("latin-1")
+                                + content + b"\nendstream")
+        objects[page_obj] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+                             f"/Resources << /Font << /F1 3 0 R >> /XObject << /Im1 4 0 R >> >> "
+                             f"/Contents {content_obj} 0 R >>").encode("latin-1")
+        page_numbers.append(page_obj)
+    kids = " ".join(f"{n} 0 R" for n in page_numbers)
+    objects[2] = f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode("latin-1")
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = out.tell()
+        out.write(f"{number} 0 obj\n".encode("latin-1") + objects[number] + b"\nendobj\n")
+    xref = out.tell()
+    count = max(objects) + 1
+    out.write(f"xref\n0 {count}\n0000000000 65535 f \n".encode("latin-1"))
+    for number in range(1, count):
+        out.write(f"{offsets[number]:010d} 00000 n \n".encode("latin-1"))
+    out.write(f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    with open(path, "wb") as fh:
+        fh.write(out.getvalue())
+
+
+def generate(root, quarters, subjects, weeks, lessons, slides, pages, picture, seed=0, force=False):
+    """Build the library under `root`; reused as-is if the same parameters built it.
+
+    Every third lesson file is a PDF, the rest are decks. Returns the
+    number of files in the library.
+    """
+    params = dict(version=GENERATOR_VERSION, quarters=quarters, subjects=subjects, weeks=weeks,
+                  lessons=lessons, slides=slides, pages=pages, picture=list(picture), seed=seed)
+    manifest = root.rstrip("/\\") + MANIFEST_SUFFIX
+    if not force and os.path.isdir(root) and os.path.exists(manifest):
+        with open(manifest, "r", encoding="utf-8") as fh:
+            built = json.load(fh)
+        if built.get("params") == params:
+            return built["files"]
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+
+    rng = random.Random(seed)
+    logo = make_jpeg(rng, (200, 120))
+    files = 0
+    for quarter in range(1, quarters + 1):
+        for number in range(1, subjects + 1):
+            subject = f"{number} - {SUBJECTS[(number - 1) % len(SUBJECTS)]}"
+            for week in range(1, weeks + 1):
+                folder = os.path.join(root, *Catalog.week_dir(quarter, subject, week).split("/"))
+                os.makedirs(folder, exist_ok=True)
+                for lesson in range(1, lessons + 1):
+                    title = f"Lesson {lesson} - Subject {number} - Week {week}"
+                    if files % 3 == 2:
+                        make_pdf(os.path.join(folder, title + ".pdf"), rng, title, pages, picture)
+                    else:
+                        make_pptx(os.path.join(folder, title + ".pptx"), rng, title, slides, picture, logo)
+                    files += 1
+    with open(manifest, "w", encoding="utf-8") as fh:
+        json.dump({"params": params, "files": files}, fh)
+    return files
+
+
+def generate_preset(root, preset="default", force=False):
+    return generate(root, force=force, **PRESETS[preset])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+    else:
+        preset = sys.argv[sys.argv.index("--preset") + 1] if "--preset" in sys.argv else "default"
+        count = generate_preset(sys.argv[1], preset, force="--force" in sys.argv)
+        print(f"{count} lesson files in {sys.argv[1]} ({preset})")
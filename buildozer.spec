@@ -13,16 +13,20 @@ package.domain = org.gregor
 source.dir = .
 
 # (list) Source files to include (let empty to include all the files)
-source.include_exts = py,png,jpg,kv,atlas,txt,pptx,pdf
+# Lessons ship as one GregorELibrary.pack and their slides pre-rendered
+# into GregorELibrary.slides; build both first with
+#     python lessonpack.py build
+#     python renders.py
+source.include_exts = py,png,jpg,kv,atlas,txt,pack,webp,json
 
 # (list) List of inclusions using pattern matching
-source.include_patterns = images/*.png, documents/*.pptx, documents/*.pdf
+source.include_patterns = images/*.png, GregorELibrary.pack, GregorELibrary.slides/*
 
 # (list) Source files to exclude (let empty to not exclude anything)
 #source.exclude_exts = spec
 
 # (list) List of directory to exclude (let empty to not exclude anything)
-#source.exclude_dirs = tests, bin, venv
+source.exclude_dirs = tests, bin, venv, GregorELibrary, benchmarks
 
 # (list) List of exclusions using pattern matching
 # Do not prefix with './'
@@ -0,0 +1,325 @@
+import json
+import os
+import re
+from collections import namedtuple
+from threading import Lock
+
+import tracing
+
+LIBRARY_DIR = "GregorELibrary"
+RENDER_DIR = LIBRARY_DIR + ".slides"  # its slides pre-rendered by renders.py
+INDEX_VERSION = 1
+
+QUARTER_RE = re.compile(r"^Quarter (\d+)$")
+SUBJECT_RE = re.compile(r"^Subject (\d+) - (.+)$")
+WEEK_RE = re.compile(r"^Week (\d+)$")
+
+# One file in the library. `path` is relative to the library root and always
+# uses "/" so the on-disk index is the same on Windows, Linux and Android.
+CatalogEntry = namedtuple("CatalogEntry", ["path", "size", "mtime", "kind"])
+
+
+def detect_kind(full_path, name):
+    """Classify a file by its magic bytes: pptx, pdf, stub or other."""
+    ext = os.path.splitext(name)[1].lower()
+    try:
+        with open(full_path, "rb") as fh:
+            head = fh.read(5)
+    except OSError:
+        head = b""
+    if head.startswith(b"PK\x03\x04"):
+        return "pptx" if ext == ".pptx" else "other"
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    # The library ships many small text placeholders named like real decks
+    if ext in (".pptx", ".pdf"):
+        return "stub"
+    return "other"
+
+
+def parse_route(rel_path):
+    """Split "Quarter 1/Subject 1 - Oral Comm/Week 2/x.pptx" into
+    (1, "1 - Oral Comm", 2, "x.pptx"), or None for paths outside that layout.
+    """
+    parts = rel_path.split("/")
+    if len(parts) != 4:
+        return None
+    quarter = QUARTER_RE.match(parts[0])
+    week = WEEK_RE.match(parts[2])
+    if not (quarter and week and SUBJECT_RE.match(parts[1])):
+        return None
+    return int(quarter.group(1)), parts[1][len("Subject "):], int(week.group(1)), parts[3]
+
+
+def _parent(rel):
+    return rel.rsplit("/", 1)[0] if "/" in rel else ""
+
+
+class Catalog:
+    """In-memory index of the GregorELibrary tree, persisted to a JSON file.
+
+    The tree is walked once; afterwards `refresh()` only stats the known
+    directories and rescans the ones whose mtime changed. When the lesson
+    pack at `pack_path` exists (as in the APK) the entries come from its
+    table of contents instead and nothing is walked or saved; given a
+    classroom RemoteLibrary as `remote`, they come from the server's
+    listing, and `refresh()` revalidates it with the server.
+    """
+
+    def __init__(self, root=LIBRARY_DIR, index_path=None, pack_path=None, remote=None):
+        self.root = root
+        self.index_path = index_path
+        self.pack_path = pack_path
+        self.remote = remote
+        self.pack = None  # the LessonPack, or RemoteLibrary, that entries are read from
+        self._dirs = {}   # relative dir -> mtime
+        self._files = {}  # relative path -> CatalogEntry
+        self._tree = {}   # quarter -> subject -> week -> [CatalogEntry]
+        self._loaded = False
+        self._load_lock = Lock()
+        self._scan_lock = Lock()  # the updater and the watcher rescan from different threads
+
+    # Loading and saving
+
+    def load(self):
+        """Load the on-disk index (if any), then bring it up to date.
+
+        Safe to call from several threads; later callers wait for the first.
+        """
+        if self._loaded:
+            return self
+        with self._load_lock, tracing.span("catalog.load"):
+            if self._loaded:
+                return self
+            if self.remote is not None or self.pack_path and os.path.exists(self.pack_path):
+                import lessonpack  # imports this module
+
+                self.pack = self.remote or lessonpack.LessonPack(self.pack_path)
+                lessonpack.use(self.pack)
+                self._files = {entry.path: entry for entry in self.pack.entries()}
+                self._rebuild_tree()
+            elif not self._read_index():
+                self._dirs.clear()
+                self._files.clear()
+                with tracing.span("catalog.scan", full=True):
+                    self._scan_dir("")
+                self._rebuild_tree()
+                self.save()
+            else:
+                self._rebuild_tree()
+                self.refresh()
+            self._loaded = True
+        return self
+
+    def _read_index(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != INDEX_VERSION or data.get("root") != os.path.abspath(self.root):
+            return False
+        self._dirs = dict(data["dirs"])
+        self._files = {row[0]: CatalogEntry(*row) for row in data["files"]}
+        return True
+
+    def save(self):
+        """Write the index atomically; a no-op when no index path is set."""
+        if not self.index_path:
+            return
+        data = {
+            "version": INDEX_VERSION,
+            "root": os.path.abspath(self.root),
+            "dirs": self._dirs,
+            "files": [list(entry) for entry in self._files.values()],
+        }
+        folder = os.path.dirname(self.index_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                # dumps, not dump: only the one-shot encoder is the fast C one
+                fh.write(json.dumps(data, separators=(",", ":")))
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Could not save catalog index: {e}")
+
+    # Scanning
+
+    def _abs(self, rel):
+        return os.path.join(self.root, *rel.split("/")) if rel else self.root
+
+    def _scan_dir(self, rel):
+        """(Re)scan one directory, recursing only into directories not yet known."""
+        full = self._abs(rel)
+        try:
+            mtime = os.stat(full).st_mtime
+            with os.scandir(full) as it:
+                children = list(it)
+        except OSError:
+            self._drop_dir(rel)
+            return
+
+        prefix = rel + "/" if rel else ""
+        for path in [p for p in self._files if p.startswith(prefix) and "/" not in p[len(prefix):]]:
+            del self._files[path]
+
+        self._dirs[rel] = mtime
+        seen_dirs = set()
+        for child in children:
+            child_rel = prefix + child.name
+            if child.is_dir():
+                seen_dirs.add(child_rel)
+                if child_rel not in self._dirs:
+                    self._scan_dir(child_rel)
+            elif child.is_file():
+                st = child.stat()
+                self._files[child_rel] = CatalogEntry(
+                    child_rel, st.st_size, st.st_mtime, detect_kind(child.path, child.name)
+                )
+
+        for known in [d for d in self._dirs if d.startswith(prefix) and d != rel
+                      and "/" not in d[len(prefix):]]:
+            if known not in seen_dirs:
+                self._drop_dir(known)
+
+    def _drop_dir(self, rel):
+        prefix = rel + "/" if rel else ""
+        for d in [d for d in self._dirs if d == rel or d.startswith(prefix)]:
+            del self._dirs[d]
+        for path in [p for p in self._files if p.startswith(prefix)]:
+            del self._files[path]
+
+    def refresh(self):
+        """Rescan directories whose mtime changed. Returns True if anything did."""
+        if self.remote is not None:
+            if not self.remote.refresh():
+                return False
+            self._files = {entry.path: entry for entry in self.remote.entries()}
+            self._rebuild_tree()
+            return True
+        if self.pack is not None:
+            return False  # a pack never changes under us
+        changed = False
+        with self._scan_lock:
+            for rel in sorted(self._dirs, key=len):
+                if rel not in self._dirs:
+                    continue  # dropped together with a parent during this pass
+                try:
+                    mtime = os.stat(self._abs(rel)).st_mtime
+                except OSError:
+                    self._drop_dir(rel)
+                    changed = True
+                    continue
+                if mtime != self._dirs[rel]:
+                    with tracing.span("catalog.scan", dir=rel):
+                        self._scan_dir(rel)
+                    changed = True
+            if changed:
+                self._rebuild_tree()
+                self.save()
+        return changed
+
+    def rescan(self, rel_paths):
+        """Bring the given files and folders up to date, e.g. after an update
+        replaced them or the watcher saw them change.
+
+        Only their folders are rescanned, however recent their mtimes.
+        Returns the paths of the entries added, changed or removed.
+        """
+        if self.pack is not None or not rel_paths:
+            return []
+        with self._scan_lock:
+            before = dict(self._files)
+            dirs = set()
+            for path in rel_paths:
+                if path in self._dirs:
+                    dirs.add(path)  # a known folder whose contents changed
+                folder = _parent(path)
+                # New folders are found by scanning the nearest one we know
+                while folder and folder not in self._dirs:
+                    folder = _parent(folder)
+                dirs.add(folder)
+            for rel in sorted(dirs, key=len):
+                if rel in self._dirs or not rel:  # not dropped along with a parent
+                    with tracing.span("catalog.scan", dir=rel):
+                        self._scan_dir(rel)
+            changed = sorted({path for path, _ in before.items() ^ self._files.items()})
+            if changed:
+                self._update_tree(changed)
+                self.save()
+        return changed
+
+    def _rebuild_tree(self):
+        tree = {}
+        for entry in self._files.values():
+            route = parse_route(entry.path)
+            if route is None:
+                continue
+            quarter_num, subject, week_num, _ = route
+            weeks = tree.setdefault(quarter_num, {}).setdefault(subject, {})
+            weeks.setdefault(week_num, []).append(entry)
+        for subjects in tree.values():
+            for weeks in subjects.values():
+                for entries in weeks.values():
+                    entries.sort(key=lambda e: e.path.lower())
+        self._tree = tree
+
+    def _update_tree(self, paths):
+        """Regroup only the weeks holding `paths`, after a rescan changed them."""
+        by_week = {}
+        for path in paths:
+            route = parse_route(path)
+            if route is not None:
+                by_week.setdefault(route[:3], set()).add(path)
+        for (quarter_num, subject, week_num), week_paths in by_week.items():
+            subjects = self._tree.setdefault(quarter_num, {})
+            weeks = subjects.setdefault(subject, {})
+            entries = [e for e in weeks.get(week_num, []) if e.path not in week_paths]
+            entries += [self._files[path] for path in week_paths if path in self._files]
+            entries.sort(key=lambda e: e.path.lower())
+            if entries:
+                weeks[week_num] = entries  # a new list: readers may hold the old one
+                continue
+            weeks.pop(week_num, None)
+            if not weeks:
+                del subjects[subject]
+                if not subjects:
+                    del self._tree[quarter_num]
+
+    # Navigation queries, all served from memory
+
+    def quarters(self):
+        return sorted(self._tree)
+
+    def subjects(self, quarter_num):
+        """Subject names as used in the UI, e.g. "1 - Oral Comm", in folder order."""
+        return sorted(self._tree.get(quarter_num, {}),
+                      key=lambda s: int(SUBJECT_RE.match("Subject " + s).group(1)))
+
+    def weeks(self, quarter_num, subject):
+        return sorted(self._tree.get(quarter_num, {}).get(subject, {}))
+
+    def files(self, quarter_num, subject, week_num, extensions=None):
+        entries = self._tree.get(quarter_num, {}).get(subject, {}).get(week_num, [])
+        if extensions:
+            entries = [e for e in entries if e.path.lower().endswith(extensions)]
+        return list(entries)
+
+    def entry(self, rel_path):
+        return self._files.get(rel_path)
+
+    def entries(self):
+        return list(self._files.values())
+
+    def abs_path(self, entry_or_path):
+        rel = entry_or_path.path if isinstance(entry_or_path, CatalogEntry) else entry_or_path
+        return self.pack.path_for(rel) if self.pack is not None else self._abs(rel)
+
+    @staticmethod
+    def week_dir(quarter_num, subject, week_num):
+        """Relative folder for a quarter/subject/week route."""
+        return f"Quarter {quarter_num}/Subject {subject}/Week {week_num}"
@@ -0,0 +1,654 @@
+"""Classroom library sharing over the local network.
+
+    python classroom.py serve [GregorELibrary] [--port N] [--index FILE]
+    python classroom.py ls URL                       list a served library
+    python classroom.py get URL PATH [--cache DIR]   fetch one lesson into a cache
+
+One device, a teacher's phone or a lab PC, serves its library: the
+catalog as catalog.json, the search index as index.json and every lesson
+under files/<path>. Responses carry strong ETags (the SHA-256 of the
+content), answer If-None-Match / If-Match / If-Range and single byte
+ranges. One asyncio event loop serves every connection, so a room full
+of students costs sockets, not threads; hashing and unpacking run on
+the loop's executor, and file bodies go out with sendfile.
+
+On a student's device a RemoteLibrary stands in for the lesson pack:
+the catalog is browsed from the server's listing (kept for offline use),
+previews and deck directories are read with range requests, and a
+lesson opened in full is downloaded once into a cache and revalidated
+by ETag after that.
+
+main.py serves its library when GREGOR_SERVE_PORT is set, and browses
+the library at GREGOR_LIBRARY_URL instead of its own when that is.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
+from http import HTTPStatus
+
+import archives
+import lessonpack
+from catalog import CatalogEntry, LIBRARY_DIR
+from updates import CHUNK_SIZE, FILES_PREFIX, file_hash
+
+DEFAULT_PORT = 8766
+LISTING_VERSION = 1
+CATALOG_NAME = "catalog.json"
+INDEX_NAME = "index.json"
+HEADER_LIMIT = 16 * 1024  # request line and headers
+IDLE_TIMEOUT = 30  # seconds a kept-alive connection may sit unused
+BACKLOG = 128
+TIMEOUT = 10  # seconds without an answer before a client request gives up
+READ_AHEAD = 64 * 1024  # smallest range a RemoteFile asks for
+STATE_FILE = "remote.json"
+FILES_DIR = "files"
+
+
+def _etag_matches(header, etag, weak):
+    """Whether an If-Match / If-None-Match list matches `etag`; `weak` ignores W/ prefixes."""
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def parse_range(value, size):
+    """(first, last) byte of a single range; None if unsatisfiable, () if not one we serve."""
+    unit, _, spec = value.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return ()  # other units and multiple ranges get the whole entity
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            count = int(last)  # suffix range: the last `count` bytes
+            return (max(0, size - count), size - 1) if count > 0 and size else None
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return ()
+    return (first, last) if first < size and first <= last else None
+
+
+def _parse_request(head):
+    """(method, target, version, headers) of a request head, or None if malformed."""
+    try:
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ")
+    except (UnicodeDecodeError, ValueError):
+        return None
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, sep, value = line.partition(":")
+            if not sep:
+                return None
+            headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+
+def _content_type(path):
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+class LibraryServer:
+    """Serves `catalog` over HTTP, with the search index at `index_path` if there is one.
+
+    Packed lessons are written out to `cache_dir` once (lessonpack.materialize)
+    and served from there. `start()` runs the event loop on its own thread.
+    """
+
+    def __init__(self, catalog, index_path=None, cache_dir=None, host="0.0.0.0", port=DEFAULT_PORT):
+        self.catalog = catalog
+        self.index_path = index_path
+        self.cache_dir = cache_dir
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.peak_connections = 0
+        self.requests = 0
+        self._listing = None  # path of the listing as served, written on demand
+        self._etags = {}      # local path -> ((size, mtime_ns), ETag)
+        self._pending = {}    # key -> Future of work running on the executor
+        self._writers = set()
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        """Serve on a background thread; returns once the port is bound."""
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self.serve_forever, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def invalidate(self):
+        """Rebuild the listing on the next request; call after the catalog changed."""
+        self._listing = None
+
+    def serve_forever(self, ready=None):
+        loop = self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(
+            self._handle, self.host, self.port, limit=HEADER_LIMIT, backlog=BACKLOG
+        ))
+        self.port = server.sockets[0].getsockname()[1]
+        if ready is not None:
+            ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            for writer in list(self._writers):
+                writer.close()
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+            self._loop = None
+
+    def _once(self, key, fn, *args):
+        """Run `fn` on the executor, sharing the result with callers asking for `key` meanwhile."""
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = self._loop.run_in_executor(None, fn, *args)
+            future.add_done_callback(lambda f: self._pending.pop(key, None))
+        return future
+
+    # Connections
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self.peak_connections = max(self.peak_connections, self.connections)
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError):
+                    break
+                request = _parse_request(head)
+                if request is None:
+                    await self._send_status(writer, 400, close=True)
+                    break
+                method, target, version, headers = request
+                self.requests += 1
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                if "content-length" in headers or "transfer-encoding" in headers:
+                    keep_alive = False  # a request body we won't read
+                await self._respond(writer, method, target, headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass  # the client went away, or the server is stopping
+        finally:
+            self._writers.discard(writer)
+            self.connections -= 1
+            writer.close()
+
+    async def _respond(self, writer, method, target, headers, keep_alive):
+        if method not in ("GET", "HEAD"):
+            await self._send_status(writer, 405, [("Allow", "GET, HEAD")], close=not keep_alive)
+            return
+        path = urllib.parse.unquote(urllib.parse.urlsplit(target).path).lstrip("/")
+        try:
+            if path == CATALOG_NAME:
+                local = await self._listing_file()
+            elif path == INDEX_NAME and self.index_path and os.path.exists(self.index_path):
+                local = self.index_path
+            elif path.startswith(FILES_PREFIX) and self.catalog.entry(path[len(FILES_PREFIX):]) is not None:
+                local = await self._lesson_file(path[len(FILES_PREFIX):])
+            else:
+                await self._send_status(writer, 404, close=not keep_alive)
+                return
+            etag = await self._etag(local)
+        except OSError as e:
+            print(f"Could not serve {path}: {e}")
+            await self._send_status(writer, 500, close=not keep_alive)
+            return
+        await self._send_file(writer, method, headers, local, etag, keep_alive)
+
+    async def _send_status(self, writer, status, fields=(), close=False):
+        fields = list(fields) + [("Content-Length", "0")]
+        writer.write(self._head(status, fields, close))
+        await writer.drain()
+
+    @staticmethod
+    def _head(status, fields, close):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+        lines += [f"{name}: {value}" for name, value in fields]
+        if close:
+            lines.append("Connection: close")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send_file(self, writer, method, headers, local, etag, keep_alive):
+        size = os.path.getsize(local)
+        fields = [("ETag", etag), ("Accept-Ranges", "bytes"), ("Cache-Control", "no-cache")]
+        first, last = 0, size - 1
+        status = 200
+        if "if-match" in headers and not _etag_matches(headers["if-match"], etag, weak=False):
+            await self._send_status(writer, 412, fields, close=not keep_alive)
+            return
+        if "if-none-match" in headers and _etag_matches(headers["if-none-match"], etag, weak=True):
+            await self._send_status(writer, 304, fields, close=not keep_alive)
+            return
+        # If-Range: the range only applies to the version the client already has part of
+        if "range" in headers and headers.get("if-range", etag) == etag:
+            span = parse_range(headers["range"], size)
+            if span is None:
+                await self._send_status(writer, 416, fields + [("Content-Range", f"bytes */{size}")],
+                                        close=not keep_alive)
+                return
+            if span:
+                status = 206
+                first, last = span
+                fields.append(("Content-Range", f"bytes {first}-{last}/{size}"))
+        count = last - first + 1
+        fields += [("Content-Type", _content_type(local)), ("Content-Length", str(count))]
+        writer.write(self._head(status, fields, not keep_alive))
+        if method == "HEAD" or not count:
+            await writer.drain()
+            return
+        with open(local, "rb") as fh:
+            # Falls back to reads on the executor where sendfile isn't available
+            await self._loop.sendfile(writer.transport, fh, first, count)
+
+    # What is served
+
+    async def _listing_file(self):
+        if self._listing is None or not os.path.exists(self._listing):
+            self._listing = await self._once("listing", self._write_listing)
+        return self._listing
+
+    def _write_listing(self):
+        """Write the catalog as served JSON into the cache folder; runs on the executor."""
+        data = {"version": LISTING_VERSION,
+                "files": sorted([list(entry) for entry in self.catalog.entries()])}
+        path = os.path.join(self._cache(), CATALOG_NAME)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        return path
+
+    async def _lesson_file(self, rel):
+        path = self.catalog.abs_path(rel)
+        if not path.startswith(lessonpack.PACK_SCHEME):
+            return path
+        return await self._once(("materialize", rel), lessonpack.materialize, path,
+                                os.path.join(self._cache(), FILES_DIR))
+
+    def _cache(self):
+        if self.cache_dir is None:
+            import tempfile
+
+            self.cache_dir = os.path.join(tempfile.gettempdir(), "gregor-classroom-server")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return self.cache_dir
+
+    async def _etag(self, local):
+        st = os.stat(local)
+        stamp = (st.st_size, st.st_mtime_ns)
+        known = self._etags.get(local)
+        if known is None or known[0] != stamp:
+            digest = await self._once(("hash", local, stamp), file_hash, local)
+            known = self._etags[local] = (stamp, f'"{digest}"')
+        return known[1]
+
+
+# Student side
+
+class RemoteFile(io.RawIOBase):
+    """A read-only, seekable file over HTTP range requests.
+
+    Opening fetches the last READ_AHEAD bytes, which tell the size and
+    hold a small deck's whole zip directory; later reads fetch at least
+    READ_AHEAD bytes at a time. Every request after the first must match
+    the first one's ETag, so a file replaced mid-read fails rather than
+    mixing versions.
+    """
+
+    def __init__(self, url):
+        super().__init__()
+        self.url = url
+        self.etag = None
+        self._pos = 0
+        self._start, self._data, self.size = self._fetch(f"bytes=-{READ_AHEAD}")
+
+    def _fetch(self, byte_range):
+        headers = {"Range": byte_range}
+        if self.etag:
+            headers["If-Match"] = self.etag
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self.url, headers=headers),
+                                        timeout=TIMEOUT) as response:
+                data = response.read()
+                self.etag = self.etag or response.headers.get("ETag")
+                if response.status != 206:
+                    return 0, data, len(data)  # the server sent it all
+                span, _, size = response.headers["Content-Range"].partition(" ")[2].partition("/")
+                return int(span.partition("-")[0]), data, int(size)
+        except urllib.error.HTTPError as e:
+            if e.code == 416:
+                return 0, b"", 0  # empty file
+            raise OSError(f"Could not read {self.url}: {e}")
+        except (urllib.error.URLError, ValueError, KeyError) as e:
+            raise OSError(f"Could not read {self.url}: {e}")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = (0, self._pos, self.size)[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, buffer):
+        if self._pos >= self.size or not len(buffer):
+            return 0
+        end = min(self.size, self._pos + len(buffer))
+        if not (self._start <= self._pos and end <= self._start + len(self._data)):
+            last = min(self.size, self._pos + max(len(buffer), READ_AHEAD)) - 1
+            self._start, self._data, _ = self._fetch(f"bytes={self._pos}-{last}")
+            end = min(end, self._start + len(self._data))
+        offset = self._pos - self._start
+        count = end - self._pos
+        buffer[:count] = self._data[offset:offset + count]
+        self._pos = end
+        return count
+
+
+def _listing_rows(data):
+    """The `files` rows of a catalog listing, raising ValueError unless each is a CatalogEntry."""
+    if not isinstance(data, dict):
+        raise ValueError("Listing is not a JSON object")
+    if data.get("version") != LISTING_VERSION:
+        raise ValueError(f"Unsupported listing version {data.get('version')!r}")
+    rows = data.get("files")
+    if not isinstance(rows, list):
+        raise ValueError("Listing has no list of files")
+    for row in rows:
+        if not (isinstance(row, list) and len(row) == 4
+                and isinstance(row[0], str) and isinstance(row[3], str)
+                and type(row[1]) is int and type(row[2]) in (int, float)):
+            raise ValueError(f"Bad listing row {row!r:.80}")
+    return rows
+
+
+class RemoteLibrary:
+    """The library served at `base_url`, standing in for the lesson pack.
+
+    Paths are PACK_SCHEME paths, so the lessonpack helpers, and with them
+    the thumbnailer, the viewer and the indexer, read it like a pack.
+    `cache_dir` keeps the last catalog listing and the lessons fetched.
+    """
+
+    def __init__(self, base_url, cache_dir):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.cache_dir = cache_dir
+        self.state_path = os.path.join(cache_dir, STATE_FILE)
+        self.downloaded = 0  # bytes of whole lessons fetched
+        self._entries = None  # path -> CatalogEntry
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._file_locks = {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as fh:
+                self._state = json.load(fh)
+        except (OSError, ValueError):
+            self._state = {}
+        if not isinstance(self._state, dict) or not isinstance(self._state.get("files", {}), dict):
+            self._state = {}
+        if "catalog" in self._state:
+            try:
+                _listing_rows({"version": LISTING_VERSION, "files": self._state["catalog"]})
+            except ValueError as e:
+                print(f"Dropping the saved classroom listing: {e}")
+                del self._state["catalog"]
+        self._state.setdefault("files", {})  # path -> [catalog mtime, ETag] of cached lessons
+
+    def _url(self, name):
+        return self.base_url + urllib.parse.quote(name)
+
+    def _save_state(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps(self._state, separators=(",", ":"))
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                fh.write(data)
+            os.replace(tmp_path, self.state_path)
+
+    def _get(self, name, etag=None):
+        """(body, ETag) of a listing from the server, or None if `etag` is still current."""
+        request = urllib.request.Request(self._url(name), headers={"If-None-Match": etag} if etag else {})
+        try:
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                return response.read(), response.headers.get("ETag")
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise OSError(f"Could not fetch {name}: {e}")
+        except urllib.error.URLError as e:
+            raise OSError(f"Could not reach {self.base_url}: {e.reason}")
+
+    # Catalog
+
+    def refresh(self):
+        """Revalidate the listing with the server; returns True if it changed."""
+        answer = self._get(CATALOG_NAME, self._state.get("catalog_etag") if "catalog" in self._state else None)
+        if answer is None:
+            return False
+        body, etag = answer
+        # From another device on the LAN: check it before anything reads it
+        rows = _listing_rows(json.loads(body))
+        with self._lock:
+            self._state["catalog"] = rows
+            self._state["catalog_etag"] = etag
+            self._entries = None
+        self._save_state()
+        return True
+
+    def _catalog(self):
+        # Never goes to the network, so it is safe on the UI thread; with
+        # nothing from last time the listing is empty until refresh()
+        if self._entries is None:
+            self._entries = {row[0]: CatalogEntry(*row) for row in self._state.get("catalog", [])}
+        return self._entries
+
+    def __contains__(self, path):
+        return path in self._catalog()
+
+    def path_for(self, rel):
+        return lessonpack.PACK_SCHEME + rel
+
+    def entry(self, path):
+        return self._catalog()[path]
+
+    def entries(self):
+        """The listing from last time, empty on a first launch until refresh() succeeds."""
+        return list(self._catalog().values())
+
+    def fetch_index(self, target):
+        """Bring the search index file at `target` up to date with the server's; True if replaced."""
+        etag = self._state.get("index_etag") if os.path.exists(target) else None
+        try:
+            answer = self._get(INDEX_NAME, etag)
+        except OSError as e:
+            print(f"No search index from the classroom library: {e}")
+            return False
+        if answer is None:
+            return False
+        body, etag = answer
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        with open(target + ".tmp", "wb") as fh:
+            fh.write(body)
+        os.replace(target + ".tmp", target)
+        with self._lock:
+            self._state["index_etag"] = etag
+        self._save_state()
+        return True
+
+    # Lessons
+
+    def _local(self, path):
+        return os.path.join(self.cache_dir, FILES_DIR, *path.split("/"))
+
+    def cached(self, path):
+        """The local copy of lesson `path` if it is current, else None."""
+        known = self._state["files"].get(path)
+        entry = self._catalog().get(path)
+        local = self._local(path)
+        if known and entry is not None and known[0] == entry.mtime and os.path.exists(local):
+            return local
+        return None
+
+    def fetch(self, path):
+        """The local path of lesson `path`, downloaded unless the cached copy is current."""
+        if path not in self._catalog():
+            raise FileNotFoundError(path)
+        with self._lock:
+            lock = self._file_locks.setdefault(path, threading.Lock())
+        with lock:
+            local = self.cached(path)
+            if local is not None:
+                return local
+            local = self._local(path)
+            known = self._state["files"].get(path)
+            # Same content under a new mtime costs a 304, not a download
+            etag = known[1] if known and os.path.exists(local) else None
+            etag = self._download(path, local, etag) or etag
+            with self._lock:
+                self._state["files"][path] = [self._catalog()[path].mtime, etag]
+            self._save_state()
+            return local
+
+    def _download(self, path, local, etag):
+        """Fetch `path` into `local`, checked against its ETag; None if `etag` was current."""
+        request = urllib.request.Request(self._url(FILES_PREFIX + path),
+                                         headers={"If-None-Match": etag} if etag else {})
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        part = local + ".part"
+        try:
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                etag = response.headers.get("ETag", "")
+                digest = hashlib.sha256()
+                with open(part, "wb") as fh:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                        fh.write(chunk)
+                        self.downloaded += len(chunk)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise OSError(f"Could not download {path}: {e}")
+        except urllib.error.URLError as e:
+            raise OSError(f"Could not download {path}: {e.reason}")
+        if etag.strip('"') != digest.hexdigest():
+            os.remove(part)
+            raise OSError(f"Download of {path} is corrupt")
+        os.replace(part, local)
+        return etag
+
+    def read(self, path):
+        with open(self.fetch(path), "rb") as fh:
+            return fh.read()
+
+    def open_zip(self, path):
+        """The cached deck if current; otherwise its directory and members over range requests."""
+        local = self.cached(path)
+        if local is not None:
+            return archives.open_zip(local)
+        if path not in self._catalog():
+            raise FileNotFoundError(path)
+        return zipfile.ZipFile(RemoteFile(self._url(FILES_PREFIX + path)))
+
+    def extract(self, path, target):
+        shutil.copyfile(self.fetch(path), target + ".tmp")
+        os.replace(target + ".tmp", target)
+
+    def close(self):
+        pass
+
+
+def main(argv):
+    from catalog import Catalog
+
+    def option(flag, default):
+        return argv[argv.index(flag) + 1] if flag in argv else default
+
+    values = {argv[i + 1] for i, arg in enumerate(argv[:-1]) if arg in ("--port", "--index", "--cache")}
+    args = [arg for arg in argv[1:] if not arg.startswith("--") and arg not in values]
+    command = args[0] if args else None
+    if command == "serve":
+        catalog = Catalog(args[1] if len(args) > 1 else LIBRARY_DIR).load()
+        server = LibraryServer(catalog, option("--index", None), port=int(option("--port", DEFAULT_PORT)))
+        server.start()
+        print(f"Serving {len(catalog.entries())} files on http://{server.host}:{server.port}/")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
+        return 0
+    if command in ("ls", "get") and len(args) > 1:
+        import tempfile
+
+        cache = option("--cache", os.path.join(tempfile.gettempdir(), "gregor-classroom"))
+        catalog = Catalog(remote=RemoteLibrary(args[1], cache))
+        try:
+            catalog.load()
+            catalog.refresh()
+            if command == "ls":
+                for quarter in catalog.quarters():
+                    for subject in catalog.subjects(quarter):
+                        weeks = catalog.weeks(quarter, subject)
+                        files = sum(len(catalog.files(quarter, subject, week)) for week in weeks)
+                        print(f"Quarter {quarter} / Subject {subject}: {len(weeks)} weeks, {files} files")
+                return 0
+            if len(args) < 3:
+                print(__doc__)
+                return 2
+            start = time.perf_counter()
+            local = catalog.remote.fetch(args[2])
+        except OSError as e:
+            print(e)
+            return 1
+        print(f"{local}: {catalog.remote.downloaded} bytes downloaded in {time.perf_counter() - start:.2f} s")
+        return 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
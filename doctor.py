@@ -0,0 +1,274 @@
+"""Library doctor: checks a lesson library before it ships.
+
+    python doctor.py [GregorELibrary] [--report FILE] [--jobs N] [--full] [--strict]
+
+Every file is checked in a process pool across all cores: archive
+integrity (each zip member's CRC), slide or page count, declared versus
+real type, and naming. The tree as a whole is then checked against the
+Quarter N / Subject N - Name / Week N layout the app navigates by, using
+the app's own route parser. Files are listed in the JSON report (by
+default doctor-report.json) with what was found; a later run re-checks
+only files whose size or mtime changed, unless --full is given.
+
+Exit status is 1 when there are errors, or warnings too with --strict,
+so a content drop can be gated on it.
+"""
+import json
+import os
+import posixpath
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+from catalog import LIBRARY_DIR, QUARTER_RE, SUBJECT_RE, WEEK_RE, parse_route
+
+CHECK_VERSION = 1  # bump when checks change, so cached results are redone
+REPORT_FILE = "doctor-report.json"
+CHUNK_SIZE = 64  # files per task sent to a worker process
+OPENABLE_EXTENSIONS = (".pptx", ".pdf")
+STRAY_NAMES = (".DS_Store", "Thumbs.db", "desktop.ini")
+
+ERROR = "error"
+WARNING = "warning"
+
+P_NS = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+R_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+PDF_PAGE_RE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+
+def sniff(head):
+    """Real type of a file from its first bytes."""
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if not head:
+        return "empty"
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError:
+        return "binary"
+    return "text"
+
+
+def _pptx_slides(path, problems):
+    """Slide count of a .pptx after checking every member's CRC, or None if unreadable."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            bad = archive.testzip()
+            if bad is not None:
+                problems.append((ERROR, "corrupt-archive", f"bad CRC in {bad}"))
+                return None
+            names = set(archive.namelist())
+            if "ppt/presentation.xml" not in names:
+                problems.append((ERROR, "not-a-presentation", "no ppt/presentation.xml"))
+                return None
+            presentation = ElementTree.fromstring(archive.read("ppt/presentation.xml"))
+            slides = presentation.findall(f"{P_NS}sldIdLst/{P_NS}sldId")
+            rels_name = "ppt/_rels/presentation.xml.rels"
+            targets = {}
+            if rels_name in names:
+                for rel in ElementTree.fromstring(archive.read(rels_name)):
+                    target = rel.get("Target", "")
+                    targets[rel.get("Id")] = (target[1:] if target.startswith("/")
+                                              else posixpath.normpath(posixpath.join("ppt", target)))
+            missing = [s.get(R_ID) for s in slides if targets.get(s.get(R_ID)) not in names]
+            if missing:
+                problems.append((ERROR, "missing-slide", f"{len(missing)} slides point at missing parts"))
+    except (OSError, zipfile.BadZipFile, ElementTree.ParseError, EOFError) as e:
+        problems.append((ERROR, "corrupt-archive", str(e)))
+        return None
+    return len(slides)
+
+
+def _pdf_pages(path, problems):
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except OSError as e:
+        problems.append((ERROR, "unreadable", str(e)))
+        return None
+    if b"%%EOF" not in data[-1024:]:
+        problems.append((ERROR, "truncated-pdf", "no %%EOF marker at the end"))
+    return len(PDF_PAGE_RE.findall(data))
+
+
+def check_file(task):
+    """Check one file; runs in a worker process. `task` is (root, rel, size, mtime)."""
+    root, rel, size, mtime = task
+    path = os.path.join(root, *rel.split("/"))
+    name = rel.rsplit("/", 1)[-1]
+    stem, ext = os.path.splitext(name)
+    ext = ext.lower()
+    problems = []
+    try:
+        with open(path, "rb") as fh:
+            real = sniff(fh.read(8))
+    except OSError as e:
+        return rel, {"size": size, "mtime": mtime, "type": None, "pages": None,
+                     "problems": [(ERROR, "unreadable", str(e))]}
+
+    if name in STRAY_NAMES or name.startswith("~$") or name.startswith("._"):
+        problems.append((WARNING, "stray-file", "editor or OS leftover"))
+    elif ext not in OPENABLE_EXTENSIONS:
+        problems.append((WARNING, "unsupported-type", f"the app can't open {ext or 'extensionless'} files"))
+    if os.path.splitext(stem)[1].lower() in OPENABLE_EXTENSIONS:
+        problems.append((WARNING, "double-extension", f"named {name}"))
+
+    pages = None
+    if ext in OPENABLE_EXTENSIONS and real == "text":
+        problems.append((ERROR, "placeholder", f"{size}-byte text file named like a lesson"))
+    elif real == "empty":
+        problems.append((ERROR, "empty-file", "0 bytes"))
+    elif ext == ".pptx" and real != "zip" or ext == ".pdf" and real != "pdf":
+        problems.append((ERROR, "type-mismatch", f"named {ext} but is {real}"))
+    elif real == "zip" and ext == ".pptx":
+        pages = _pptx_slides(path, problems)
+    elif real == "pdf" and ext == ".pdf":
+        pages = _pdf_pages(path, problems)
+    if pages == 0:
+        problems.append((ERROR, "no-slides", "nothing to show"))
+    return rel, {"size": size, "mtime": mtime, "type": real, "pages": pages, "problems": problems}
+
+
+def check_layout(root, files):
+    """Problems with the folder tree, as (severity, code, path, message)."""
+    problems = []
+    for rel in files:
+        if parse_route(rel) is None:
+            problems.append((ERROR, "outside-layout", rel,
+                             "not at Quarter N/Subject N - Name/Week N/<file>, so the app never lists it"))
+
+    numbers = {}  # quarter folder -> subject number -> names
+    for folder, dirs, names in os.walk(root):
+        rel = os.path.relpath(folder, root).replace(os.sep, "/")
+        parts = [] if rel == "." else rel.split("/")
+        if parts and not dirs and not names:
+            problems.append((WARNING, "empty-folder", rel, "nothing in it"))
+        pattern = (QUARTER_RE, SUBJECT_RE, WEEK_RE)[len(parts) - 1] if 1 <= len(parts) <= 3 else None
+        if pattern is not None and not pattern.match(parts[-1]):
+            problems.append((ERROR, "bad-folder-name", rel, f"expected a name like {pattern.pattern}"))
+        if len(parts) == 2:
+            match = SUBJECT_RE.match(parts[1])
+            if match:
+                numbers.setdefault(parts[0], {}).setdefault(int(match.group(1)), []).append(parts[1])
+    for quarter, subjects in sorted(numbers.items()):
+        for number, folders in sorted(subjects.items()):
+            if len(folders) > 1:
+                problems.append((ERROR, "duplicate-subject-number", quarter,
+                                 f"Subject {number} is used by {', '.join(sorted(folders))}"))
+    return problems
+
+
+def scan(root):
+    """Relative path -> (size, mtime) of every file under `root`."""
+    files = {}
+    for folder, dirs, names in os.walk(root):
+        for name in names:
+            st = os.stat(os.path.join(folder, name))
+            files[os.path.relpath(os.path.join(folder, name), root).replace(os.sep, "/")] = (st.st_size, st.st_mtime)
+    return files
+
+
+def load_report(path, root):
+    """Per-file results of an earlier run on `root` with the same checks, or {}."""
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            report = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    if report.get("check_version") != CHECK_VERSION or report.get("root") != os.path.abspath(root):
+        return {}
+    return report.get("files", {})
+
+
+def run(root, report_path=REPORT_FILE, jobs=None, full=False):
+    """Check the library and write the report; returns it."""
+    start = time.perf_counter()
+    files = scan(root)
+    previous = {} if full else load_report(report_path, root)
+    results = {}
+    tasks = []
+    for rel, (size, mtime) in files.items():
+        old = previous.get(rel)
+        if old is not None and old["size"] == size and old["mtime"] == mtime:
+            results[rel] = old
+        else:
+            tasks.append((root, rel, size, mtime))
+    if tasks:
+        if len(tasks) < CHUNK_SIZE or jobs == 1:
+            results.update(map(check_file, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                results.update(pool.map(check_file, tasks, chunksize=CHUNK_SIZE))
+
+    layout = check_layout(root, files)
+    counts = {ERROR: 0, WARNING: 0}
+    codes = {}
+    for severity, code in [p[:2] for r in results.values() for p in r["problems"]] + [p[:2] for p in layout]:
+        counts[severity] += 1
+        codes[code] = codes.get(code, 0) + 1
+    report = {
+        "check_version": CHECK_VERSION,
+        "root": os.path.abspath(root),
+        "time": time.time(),
+        "summary": {
+            "files": len(files),
+            "checked": len(tasks),
+            "errors": counts[ERROR],
+            "warnings": counts[WARNING],
+            "problems": dict(sorted(codes.items())),
+            "seconds": round(time.perf_counter() - start, 3),
+        },
+        "files": dict(sorted(results.items())),
+        "layout": layout,
+    }
+    tmp_path = report_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=1)
+    os.replace(tmp_path, report_path)
+    return report
+
+
+def print_summary(report, limit=20):
+    summary = report["summary"]
+    print(f"{summary['files']} files ({summary['checked']} checked) in {summary['seconds']} s: "
+          f"{summary['errors']} errors, {summary['warnings']} warnings")
+    for code, count in summary["problems"].items():
+        print(f"  {code:<26} {count}")
+    shown = 0
+    lines = [(severity, rel, code, message) for rel, result in report["files"].items()
+             for severity, code, message in result["problems"]]
+    lines += [(severity, rel, code, message) for severity, code, rel, message in report["layout"]]
+    for severity, rel, code, message in sorted(lines, key=lambda line: (line[0] != ERROR, line[1])):
+        if shown == limit:
+            print(f"  ... {len(lines) - limit} more in the report")
+            break
+        print(f"  {severity}: {rel}: {code}: {message}")
+        shown += 1
+
+
+def main(argv):
+    def option(flag, default):
+        return argv[argv.index(flag) + 1] if flag in argv else default
+
+    values = {argv[i + 1] for i, arg in enumerate(argv[:-1]) if arg in ("--report", "--jobs")}
+    positional = [arg for arg in argv[1:] if not arg.startswith("--") and arg not in values]
+    root = positional[0] if positional else LIBRARY_DIR
+    if not os.path.isdir(root):
+        print(f"No library at {root}")
+        return 2
+    jobs = option("--jobs", None)
+    report_path = option("--report", REPORT_FILE)
+    report = run(root, report_path, int(jobs) if jobs else None, "--full" in argv)
+    print_summary(report)
+    print(f"Report written to {report_path}")
+    summary = report["summary"]
+    return 1 if summary["errors"] or ("--strict" in argv and summary["warnings"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,290 @@
+"""Streaming text extraction from lesson files.
+
+    python extraction.py [GregorELibrary] [--jobs N] [--output FILE.jsonl]
+
+`records(path, kind)` yields a SlideText for each slide of a .pptx (with
+its speaker notes), each text-bearing content stream of a PDF (a page,
+in the PDFs Word exports) and the one "slide" of a text placeholder.
+Slide XML is read straight out of the zip, one part at a time, and a
+part too big to parse whole is parsed incrementally, every element
+dropped as soon as it closes; a PDF is memory-mapped and its streams
+inflated one at a time. Memory therefore stays flat however big the
+deck. `extract_many` spreads files over worker processes, a
+batch at a time, for indexing a whole library.
+
+Worker processes are for tools and desktop indexing; the app extracts
+in-process on its job pool.
+"""
+import json
+import mmap
+import os
+import re
+import sys
+import time
+import zlib
+from collections import deque, namedtuple
+from xml.etree import ElementTree
+
+import lessonpack
+from slides import read_rels
+
+SlideText = namedtuple("SlideText", ["file", "slide", "text", "notes"])
+
+A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+P_NS = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+R_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+A_T, A_P, A_FLD = A_NS + "t", A_NS + "p", A_NS + "fld"
+SLIDE_RE = re.compile(r"^ppt/slides/slide(\d+)\.xml$")
+NOTES_TYPE = "/notesSlide"
+STUB_BYTES = 64 * 1024
+WHOLE_PART_BYTES = 256 * 1024  # slide XML parsed in one go up to this size, streamed beyond
+STREAM_CHUNK = 64 * 1024
+BATCH_FILES = 16  # files per task sent to a worker process
+
+PDF_STREAM_RE = re.compile(rb"stream\r?\n(.*?)\r?\nendstream", re.S)
+PDF_TEXT_OP_RE = re.compile(rb"\[(.*?)\]\s*TJ|(\((?:\\.|[^\\)])*\))\s*(?:Tj|'|\")", re.S)
+PDF_STRING_RE = re.compile(rb"\((?:\\.|[^\\)])*\)", re.S)
+PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+
+# .pptx
+
+def _tree_text(root, skip_slide_numbers):
+    paragraphs = []
+    for paragraph in root.iter(A_P):
+        runs = [node.text for child in paragraph
+                if not (skip_slide_numbers and child.tag == A_FLD and child.get("type") == "slidenum")
+                for node in child.iter(A_T) if node.text]
+        if runs:
+            paragraphs.append("".join(runs))
+    return "\n".join(paragraphs)
+
+
+def stream_text(member, skip_slide_numbers=False):
+    """Paragraphs of a DrawingML part read from the file object `member`, one per line.
+
+    Parts up to WHOLE_PART_BYTES, which is nearly all of them, are parsed
+    in one go; element-by-element events cost more than building a small
+    tree. Bigger parts are parsed as they are read.
+    """
+    head = member.read(WHOLE_PART_BYTES + 1)
+    if len(head) <= WHOLE_PART_BYTES:
+        return _tree_text(ElementTree.fromstring(head), skip_slide_numbers)
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    paragraphs, runs = [], []
+    open_elements = []
+    fields = 0  # depth inside slide-number fields being skipped
+    chunk = head
+    while chunk:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == "start":
+                open_elements.append(elem)
+                if skip_slide_numbers and elem.tag == A_FLD and elem.get("type") == "slidenum":
+                    fields += 1
+                continue
+            open_elements.pop()
+            if elem.tag == A_T:
+                if elem.text and not fields:
+                    runs.append(elem.text)
+            elif elem.tag == A_P:
+                if runs:
+                    paragraphs.append("".join(runs))
+                    runs = []
+            elif elem.tag == A_FLD and fields and elem.get("type") == "slidenum":
+                fields -= 1
+            # Done with it: keep the tree from growing with the document
+            elem.clear()
+            if open_elements:
+                open_elements[-1].remove(elem)
+        chunk = member.read(STREAM_CHUNK)
+    parser.close()
+    return "\n".join(paragraphs)
+
+
+def _slide_parts(archive, names):
+    """Slide parts in presentation order, or by file number without a presentation part."""
+    if "ppt/presentation.xml" in names:
+        rels = read_rels(archive, names, "ppt/presentation.xml")
+        presentation = ElementTree.fromstring(archive.read("ppt/presentation.xml"))
+        parts = [rels[s.get(R_ID)][0] for s in presentation.iterfind(f"{P_NS}sldIdLst/{P_NS}sldId")
+                 if s.get(R_ID) in rels]
+        return [part for part in parts if part in names]
+    numbered = [(int(m.group(1)), name) for name in names for m in [SLIDE_RE.match(name)] if m]
+    return [name for _, name in sorted(numbered)]
+
+
+def pptx_records(path):
+    with lessonpack.open_zip(path) as archive:
+        names = set(archive.namelist())
+        for number, part in enumerate(_slide_parts(archive, names), 1):
+            with archive.open(part) as member:
+                text = stream_text(member)
+            notes = ""
+            notes_part = next((target for target, kind in read_rels(archive, names, part).values()
+                               if kind.endswith(NOTES_TYPE) and target in names), None)
+            if notes_part:
+                with archive.open(notes_part) as member:
+                    notes = stream_text(member, skip_slide_numbers=True)
+            yield SlideText(path, number, text, notes)
+
+
+# PDF
+
+def _pdf_unescape(literal):
+    body = literal[1:-1]
+    body = re.sub(rb"\\([0-7]{1,3})", lambda m: bytes([int(m.group(1), 8) & 0xFF]), body)
+    body = re.sub(rb"\\(.)", lambda m: PDF_ESCAPES.get(m.group(1), m.group(1)), body, flags=re.S)
+    return body.decode("cp1252", errors="ignore")
+
+
+def content_text(content):
+    """Best-effort text from the literal strings drawn by Tj/TJ operators.
+
+    Good enough for the WinAnsi-encoded PDFs teachers export from Word;
+    fonts with custom CMaps just contribute nothing.
+    """
+    parts = []
+    for array, single in PDF_TEXT_OP_RE.findall(content):
+        if array:
+            parts.append("".join(_pdf_unescape(s) for s in PDF_STRING_RE.findall(array)))
+        else:
+            parts.append(_pdf_unescape(single))
+        parts.append(" ")
+    return "".join(parts)
+
+
+def pdf_records(path):
+    pack_path = path.startswith(lessonpack.PACK_SCHEME)
+    if pack_path:
+        data = lessonpack.read_bytes(path)  # a packed PDF is one blob
+    else:
+        fh = open(path, "rb")
+        try:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            fh.close()
+            return
+    streams = PDF_STREAM_RE.finditer(data)
+    try:
+        number = 0
+        for match in streams:
+            raw = match.group(1)
+            match = None  # a live match pins the map
+            try:
+                content = zlib.decompress(raw)
+            except zlib.error:
+                content = raw
+            if b"BT" not in content:
+                continue  # images, fonts and other non-text streams
+            number += 1
+            yield SlideText(path, number, content_text(content), "")
+    finally:
+        streams = None
+        if not pack_path:
+            data.close()
+            fh.close()
+
+
+# Placeholders
+
+def stub_records(path):
+    if path.startswith(lessonpack.PACK_SCHEME):
+        data = lessonpack.read_bytes(path)[:STUB_BYTES]
+    else:
+        with open(path, "rb") as fh:
+            data = fh.read(STUB_BYTES)
+    yield SlideText(path, 1, data.decode("utf-8", errors="ignore"), "")
+
+
+EXTRACTORS = {"pptx": pptx_records, "pdf": pdf_records, "stub": stub_records}
+
+
+def records(path, kind):
+    """SlideText records of one file, in order; nothing for kinds without text.
+
+    Unreadable or malformed files stop early with a message rather than
+    raising, whatever the error, so one bad deck doesn't end a library-wide run.
+    """
+    extractor = EXTRACTORS.get(kind)
+    if extractor is None:
+        return
+    try:
+        yield from extractor(path)
+    except Exception as e:
+        print(f"Could not extract text from {path}: {e!r}")
+
+
+# Worker processes
+
+def _init_worker(pack_path):
+    if pack_path:
+        lessonpack.use(lessonpack.LessonPack(pack_path))
+
+
+def _extract_batch(items):
+    return [record for path, kind in items for record in records(path, kind)]
+
+
+def extract_many(items, workers=None, batch=BATCH_FILES):
+    """SlideText records of every (path, kind) in `items`, in order.
+
+    Files are extracted by `workers` processes (all cores by default), a
+    batch of files per task; at most two batches per worker are in flight,
+    so results waiting to be consumed stay bounded. With one worker, or
+    too few files to be worth it, everything runs in this process.
+    """
+    items = list(items)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(items) <= batch:
+        for path, kind in items:
+            yield from records(path, kind)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    pack = lessonpack.active()
+    batches = iter([items[i:i + batch] for i in range(0, len(items), batch)])
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(pack.path if pack else None,)) as pool:
+        in_flight = deque()
+        for chunk in batches:
+            in_flight.append(pool.submit(_extract_batch, chunk))
+            if len(in_flight) >= workers * 2:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def main(argv):
+    from catalog import Catalog, LIBRARY_DIR
+
+    def option(flag, default):
+        return argv[argv.index(flag) + 1] if flag in argv else default
+
+    values = {argv[i + 1] for i, arg in enumerate(argv[:-1]) if arg in ("--jobs", "--output")}
+    positional = [arg for arg in argv[1:] if not arg.startswith("--") and arg not in values]
+    catalog = Catalog(positional[0] if positional else LIBRARY_DIR).load()
+    jobs = option("--jobs", None)
+    output = option("--output", None)
+    entries = {catalog.abs_path(e): e for e in catalog.entries() if e.kind in EXTRACTORS}
+    start = time.perf_counter()
+    count = chars = 0
+    out = open(output, "w", encoding="utf-8") if output else None
+    try:
+        for record in extract_many([(path, e.kind) for path, e in entries.items()], int(jobs) if jobs else None):
+            count += 1
+            chars += len(record.text) + len(record.notes)
+            if out is not None:
+                out.write(json.dumps({"file": entries[record.file].path, "slide": record.slide,
+                                      "text": record.text, "notes": record.notes}) + "\n")
+    finally:
+        if out is not None:
+            out.close()
+    seconds = time.perf_counter() - start
+    print(f"{len(entries)} files, {count} slides, {chars} characters in {seconds:.2f} s "
+          f"({len(entries) / max(seconds, 1e-9):.0f} files/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import time
+from threading import Condition, Thread
+
+from kivy.clock import Clock
+
+import tracing
+
+# Lower runs first
+INTERACTIVE = 0   # the user is waiting on it, e.g. opening a lesson
+THUMBNAIL = 10    # visible rows waiting for a preview
+PREFETCH = 15     # guesses at what the user will want next
+BACKGROUND = 20   # indexing and other housekeeping
+
+
+class Job:
+    """Handle for one submitted job."""
+
+    def __init__(self, pool, key, priority, fn, args, on_done, on_error):
+        self.pool = pool
+        self.key = key
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = False
+        self.started = False
+        self.submitted = time.perf_counter()
+
+    def cancel(self):
+        """Skip the job if it hasn't started, and drop its result if it has."""
+        self.pool._cancel(self)
+
+
+class JobPool:
+    """A few worker threads shared by every background task in the app.
+
+    Jobs run in priority order. Non-interactive jobs may occupy at most
+    `workers - 1` threads, so indexing and thumbnails can never hold up an
+    open the user is waiting for. Jobs submitted with a `key` coalesce:
+    until a job's result has been delivered, submitting the same key
+    returns the existing job. `on_done(result)` and `on_error(exception)`
+    are called on the UI thread, and never for a cancelled job.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = max(2, workers)
+        self._heap = []
+        self._order = itertools.count()
+        self._keys = {}  # key -> Job whose result is not yet delivered
+        self._background_running = 0
+        self._cond = Condition()
+        self._threads = []
+
+    def submit(self, fn, *args, priority=BACKGROUND, key=None, on_done=None, on_error=None, lifo=False):
+        """Queue `fn(*args)`. `lifo=True` serves the newest job of a priority first."""
+        with self._cond:
+            if key is not None:
+                existing = self._keys.get(key)
+                if existing is not None and not existing.cancelled:
+                    return existing
+            job = Job(self, key, priority, fn, args, on_done, on_error)
+            if key is not None:
+                self._keys[key] = job
+            order = next(self._order)
+            heapq.heappush(self._heap, (priority, -order if lifo else order, job))
+            if len(self._threads) < self.workers:
+                thread = Thread(target=self._run, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._cond.notify()
+        return job
+
+    def promote(self, job, priority, lifo=False):
+        """Move a queued job up to `priority`, e.g. once a guessed-at result is really wanted."""
+        with self._cond:
+            if job.started or job.cancelled or priority >= job.priority:
+                return
+            job.priority = priority
+            # The old heap entry is skipped when it comes up
+            order = next(self._order)
+            heapq.heappush(self._heap, (priority, -order if lifo else order, job))
+            self._cond.notify()
+
+    def _cancel(self, job):
+        with self._cond:
+            job.cancelled = True
+            if self._keys.get(job.key) is job:
+                del self._keys[job.key]
+
+    def _next_job(self):
+        """Pop the best job this worker may run; call with the lock held."""
+        skipped = []
+        job = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            candidate = entry[2]
+            if candidate.cancelled or candidate.started or entry[0] != candidate.priority:
+                continue  # cancelled, or a stale entry of a promoted job
+            if candidate.priority > INTERACTIVE and self._background_running >= self.workers - 1:
+                skipped.append(entry)
+                continue
+            job = candidate
+            break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return job
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                job.started = True
+                if job.priority > INTERACTIVE:
+                    self._background_running += 1
+            name = getattr(job.fn, "__name__", "job")
+            try:
+                with tracing.span("job." + name, priority=job.priority,
+                                  queued_ms=round((time.perf_counter() - job.submitted) * 1000, 2)):
+                    result, error = job.fn(*job.args), None
+            except Exception as e:
+                result, error = None, e
+            with self._cond:
+                if job.priority > INTERACTIVE:
+                    self._background_running -= 1
+                # A background slot may have freed up for a waiting job
+                self._cond.notify_all()
+            if error is not None and job.on_error is None:
+                print(f"Background job {name} failed: {error}")
+            Clock.schedule_once(lambda dt, j=job, r=result, e=error: self._deliver(j, r, e))
+
+    def _deliver(self, job, result, error):
+        # The key stays taken until here, so a tap landing between the
+        # job finishing and its result arriving still coalesces
+        with self._cond:
+            if self._keys.get(job.key) is job:
+                del self._keys[job.key]
+        if job.cancelled:
+            return
+        if error is not None:
+            if job.on_error is not None:
+                job.on_error(error)
+        elif job.on_done is not None:
+            job.on_done(result)
@@ -0,0 +1,297 @@
+"""Single-file, deduplicated pack of the lesson library.
+
+    python lessonpack.py build [GregorELibrary] [GregorELibrary.pack]
+
+The pack is a run of blobs followed by a zlib-compressed JSON table of
+contents and a fixed-size footer. Each distinct content is stored once:
+whole files are hashed as they are, and .pptx decks are split into their
+zip members so media shared between decks is stored once too. Reading an
+entry is a seek and a read of its blobs; nothing is extracted up front.
+
+Paths handed out by a pack-backed Catalog start with PACK_SCHEME; the
+open_zip/read_bytes/exists helpers accept those and plain filesystem
+paths alike.
+"""
+import hashlib
+import io
+import json
+import os
+import struct
+import sys
+import zipfile
+import zlib
+from threading import Lock
+
+import archives
+from catalog import CatalogEntry, LIBRARY_DIR, detect_kind
+
+PACK_FILE = LIBRARY_DIR + ".pack"
+PACK_SCHEME = "pack:"
+PACK_VERSION = 1
+MAGIC = b"GLPACK01"
+FOOTER = struct.Struct("<8sQQ")  # magic, TOC offset, TOC length
+# Only keep the compressed form of a blob when it saves at least this much
+MIN_SAVING = 0.1
+
+_active = None  # the LessonPack that PACK_SCHEME paths refer to
+
+
+def use(pack):
+    """Make `pack` the one PACK_SCHEME paths are resolved against."""
+    global _active
+    _active = pack
+
+
+def active():
+    """The LessonPack in use, or None."""
+    return _active
+
+
+def _split(path):
+    if path.startswith(PACK_SCHEME):
+        if _active is None:
+            raise OSError(f"No lesson pack loaded for {path}")
+        return _active, path[len(PACK_SCHEME):]
+    return None, path
+
+
+def open_zip(path):
+    """A shared archives.ZipHandle for a loose file, PackedZip for a packed deck."""
+    pack, rel = _split(path)
+    return pack.open_zip(rel) if pack else archives.open_zip(rel)
+
+
+def read_bytes(path):
+    pack, rel = _split(path)
+    if pack:
+        return pack.read(rel)
+    with open(rel, "rb") as fh:
+        return fh.read()
+
+
+def exists(path):
+    pack, rel = _split(path)
+    return rel in pack if pack else os.path.exists(rel)
+
+
+def fetch(path):
+    """Make sure the whole of `path` is on this device before it is opened;
+    only lessons of a classroom library ever need fetching."""
+    pack, rel = _split(path)
+    if pack:
+        pack.fetch(rel)
+
+
+def materialize(path, cache_dir):
+    """A real file for `path`, for handing to other apps. Packed entries are
+    written to `cache_dir` once and reused."""
+    pack, rel = _split(path)
+    if not pack:
+        return rel
+    target = os.path.join(cache_dir, *rel.split("/"))
+    entry = pack.entry(rel)
+    if not (os.path.exists(target) and os.path.getmtime(target) == entry.mtime):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        pack.extract(rel, target)
+        os.utime(target, (entry.mtime, entry.mtime))
+    return target
+
+
+class PackedZip:
+    """The part of zipfile.ZipFile's interface the app uses, over a packed deck."""
+
+    def __init__(self, pack, members):
+        self._pack = pack
+        self._members = dict(members)
+        self._names = [name for name, _ in members]
+
+    def namelist(self):
+        return list(self._names)
+
+    def read(self, name):
+        if name not in self._members:
+            raise KeyError(f"There is no item named {name!r} in the archive")
+        return self._pack._blob(self._members[name])
+
+    def open(self, name):
+        return io.BytesIO(self.read(name))
+
+    def view(self, name):
+        return memoryview(self.read(name))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LessonPack:
+    """Random access to the entries of a pack file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, "rb")
+        self._lock = Lock()
+        try:
+            size = os.fstat(self._fh.fileno()).st_size
+            if size < FOOTER.size:
+                raise ValueError("file too small")
+            magic, toc_offset, toc_length = FOOTER.unpack(self._read_at(size - FOOTER.size, FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError("not a lesson pack")
+            toc = json.loads(zlib.decompress(self._read_at(toc_offset, toc_length)))
+            if toc.get("version") != PACK_VERSION:
+                raise ValueError(f"unsupported pack version {toc.get('version')}")
+        except (ValueError, zlib.error, struct.error):
+            self._fh.close()
+            raise
+        self._blobs = toc["blobs"]      # [offset, stored length, length, compressed]
+        self._entries = toc["entries"]  # path -> {size, mtime, kind, blob | members}
+
+    def close(self):
+        self._fh.close()
+
+    def _read_at(self, offset, length):
+        if hasattr(os, "pread"):
+            # No shared file position, so readers on several threads don't contend
+            return os.pread(self._fh.fileno(), length, offset)
+        with self._lock:
+            self._fh.seek(offset)
+            return self._fh.read(length)
+
+    def _blob(self, index):
+        offset, stored, length, compressed = self._blobs[index]
+        data = self._read_at(offset, stored)
+        return zlib.decompress(data) if compressed else data
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def path_for(self, rel):
+        """The app-wide path for entry `rel`, usable with the module helpers."""
+        return PACK_SCHEME + rel
+
+    def entry(self, path):
+        info = self._entries[path]
+        return CatalogEntry(path, info["size"], info["mtime"], info["kind"])
+
+    def entries(self):
+        return [self.entry(path) for path in self._entries]
+
+    def read(self, path):
+        """The entry's bytes; decks are rebuilt into a .pptx."""
+        info = self._entries.get(path)
+        if info is None:
+            raise FileNotFoundError(path)
+        if "members" in info:
+            buffer = io.BytesIO()
+            self._write_zip(info, buffer)
+            return buffer.getvalue()
+        return self._blob(info["blob"])
+
+    def fetch(self, path):
+        pass  # packed entries are always here
+
+    def open_zip(self, path):
+        info = self._entries.get(path)
+        if info is None:
+            raise FileNotFoundError(path)
+        if "members" not in info:
+            return zipfile.ZipFile(io.BytesIO(self._blob(info["blob"])))
+        return PackedZip(self, info["members"])
+
+    def extract(self, path, target):
+        info = self._entries[path]
+        tmp_path = target + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            if "members" in info:
+                self._write_zip(info, fh)
+            else:
+                fh.write(self._blob(info["blob"]))
+        os.replace(tmp_path, target)
+
+    def _write_zip(self, info, fh):
+        with zipfile.ZipFile(fh, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, blob in info["members"]:
+                archive.writestr(name, self._blob(blob))
+
+
+class PackWriter:
+    def __init__(self, fh):
+        self._fh = fh
+        self._fh.write(MAGIC)
+        self._offset = len(MAGIC)
+        self._hashes = {}  # sha256 -> blob index
+        self.blobs = []
+        self.entries = {}
+        self.raw_bytes = 0
+        self.shared = 0
+
+    def add_blob(self, data):
+        self.raw_bytes += len(data)
+        digest = hashlib.sha256(data).digest()
+        if digest in self._hashes:
+            self.shared += 1
+            return self._hashes[digest]
+        packed = zlib.compress(data, 9)
+        compressed = len(packed) < len(data) * (1 - MIN_SAVING)
+        stored = packed if compressed else data
+        self._fh.write(stored)
+        self.blobs.append([self._offset, len(stored), len(data), int(compressed)])
+        self._offset += len(stored)
+        self._hashes[digest] = len(self.blobs) - 1
+        return len(self.blobs) - 1
+
+    def add_file(self, rel, full_path):
+        st = os.stat(full_path)
+        kind = detect_kind(full_path, os.path.basename(full_path))
+        info = {"size": st.st_size, "mtime": st.st_mtime, "kind": kind}
+        if kind == "pptx":
+            try:
+                with zipfile.ZipFile(full_path) as archive:
+                    info["members"] = [[name, self.add_blob(archive.read(name))]
+                                       for name in archive.namelist()]
+            except zipfile.BadZipFile:
+                info.pop("members", None)
+        if "members" not in info:
+            with open(full_path, "rb") as fh:
+                info["blob"] = self.add_blob(fh.read())
+        self.entries[rel] = info
+
+    def finish(self):
+        toc = zlib.compress(json.dumps(
+            {"version": PACK_VERSION, "blobs": self.blobs, "entries": self.entries},
+            separators=(",", ":")
+        ).encode("utf-8"), 9)
+        self._fh.write(toc)
+        self._fh.write(FOOTER.pack(MAGIC, self._offset, len(toc)))
+
+
+def build(root, target):
+    """Pack every file under `root` into `target`, replacing it atomically."""
+    tmp_path = target + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        writer = PackWriter(fh)
+        for folder, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in sorted(files):
+                full_path = os.path.join(folder, name)
+                rel = os.path.relpath(full_path, root).replace(os.sep, "/")
+                writer.add_file(rel, full_path)
+        writer.finish()
+    os.replace(tmp_path, target)
+    print(f"{len(writer.entries)} files, {writer.raw_bytes} bytes of content -> "
+          f"{len(writer.blobs)} blobs ({writer.shared} duplicates stored once), "
+          f"{os.path.getsize(target)} bytes in {target}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print(__doc__)
+    else:
+        build(sys.argv[2] if len(sys.argv) > 2 else LIBRARY_DIR,
+              sys.argv[3] if len(sys.argv) > 3 else PACK_FILE)
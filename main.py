@@ -1,23 +1,147 @@
+# Imported first so startup timing includes loading Kivy
+from startup import timer as startup_timer, EXIT_ENV, DATA_DIR_ENV
+from startup import LIBRARY_URL_ENV, SERVE_PORT_ENV, UPDATE_URL_ENV  # opt-in features
 from kivy.app import App
 from kivy.uix.label import Label
 from kivy.uix.button import Button
-from kivy.uix.popup import Popup
 from kivy.graphics import Color, Rectangle, RoundedRectangle
 from kivy.metrics import dp, sp
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.scrollview import ScrollView
+from kivy.uix.textinput import TextInput
+from kivy.clock import Clock
 from kivy.core.window import Window
+from kivy.utils import platform as kivy_platform
+import functools
 import os
+import tempfile
 from kivy.config import Config
-import subprocess
-import platform
-from threading import Thread
+from archives import archives
+from catalog import Catalog, LIBRARY_DIR, RENDER_DIR, parse_route
+import lessonpack
+import tracing
+from memory import TRIM_MEMORY_UI_HIDDEN, accountant
+from responsive import metrics
+from search import SearchIndex
+from session import Session
+from navigation import NavigationPopup, NavItem, NavLevel
+from textures import label_cache
+from widgets import PillRow, VirtualList, style_pill_button
+from thumbnails import ThumbnailLoader
+from prefetch import Prefetcher, open_document
+from jobs import BACKGROUND, INTERACTIVE, JobPool
+
+startup_timer.mark("imports")
+
+# File types the app knows how to open
+OPENABLE_EXTENSIONS = ('.pptx', '.pdf')
+SEARCH_RESULTS_SHOWN = 50
+SEARCH_ROWS_VISIBLE = 5
+
+
+@functools.lru_cache(maxsize=256)
+def _fit_title(title, chars_per_width):
+    """Shorten a "A - B - C" title to about `chars_per_width` characters.
+
+    Memoised: the same few titles are fitted again on every navigation
+    step, and only change when the window width does.
+    """
+    # If title is too long, truncate it intelligently
+    if len(title) > chars_per_width:
+        # Split the title by parts
+        title_parts = title.split(" - ")
+
+        # Keep the first and last parts, abbreviate middle parts if needed
+        if len(title_parts) > 2:
+            # Always show the current level (last part)
+            last_part = title_parts[-1]
+            first_part = title_parts[0]
+
+            # Calculate remaining space for middle parts
+            remaining_chars = chars_per_width - len(first_part) - len(last_part) - 7  # 7 chars for " - ... - "
+
+            if remaining_chars > 10:  # If we have reasonable space
+                middle_parts = title_parts[1:-1]
+                middle_str = ""
+
+                # Try to fit as many middle parts as possible
+                for part in middle_parts:
+                    if len(middle_str) + len(part) + 3 <= remaining_chars:  # +3 for " - "
+                        middle_str += " - " + part if middle_str else part
+                    else:
+                        # Add ellipsis if we can't fit all parts
+                        middle_str += "..." if not middle_str else "..."
+                        break
+
+                return f"{first_part} - {middle_str} - {last_part}"
+            else:
+                # Very limited space, just show first and last with ellipsis
+                return f"{first_part} - ... - {last_part}"
+        else:
+            # Only two parts, try to show both
+            first_part = title_parts[0]
+            last_part = title_parts[1]
+
+            if len(first_part) + len(last_part) + 3 > chars_per_width:
+                # Still too long, truncate both parts
+                chars_each = (chars_per_width - 3) // 2  # -3 for " - "
+                return f"{first_part[:chars_each]}... - ...{last_part[-chars_each:]}"
+
+    # Title fits, return as is
+    return title
+
 
 class MainMenu(BoxLayout):
-    def __init__(self, **kwargs):
+    def __init__(self, library_dir=LIBRARY_DIR, pack_path=lessonpack.PACK_FILE, render_dir=RENDER_DIR,
+                 **kwargs):
         super().__init__(orientation='vertical', **kwargs)
         self.loading_popup = None
+        self.open_job = None
+        self._open_span = tracing.NO_SPAN
+        self.viewer = None
+        self.viewer_lesson = None  # catalog path of the lesson in the viewer
         self.current_navigation_path = ""  # Track current navigation path
+        # Nothing is read from disk until the first frame is on screen
+        index_path = self._user_data_path("search_index.json")
+        startup_timer.kind = "warm" if index_path and os.path.exists(index_path) else "cold"
+        # A classroom library on the LAN, when one is configured, replaces our own
+        library_url = os.environ.get(LIBRARY_URL_ENV)
+        self.remote = None
+        if library_url:
+            from classroom import RemoteLibrary
+
+            self.remote = RemoteLibrary(
+                library_url,
+                self._user_data_path("classroom") or os.path.join(tempfile.gettempdir(), "gregor-classroom")
+            )
+        self.catalog = Catalog(library_dir, self._user_data_path("catalog.json"), pack_path, self.remote)
+        self.server = None  # LibraryServer sharing our library, in serve mode
+        if render_dir and os.path.isdir(render_dir):
+            import renders
+
+            # Slides pre-rendered at build time open without parsing the deck
+            renders.use(renders.RenderSet(render_dir, library_dir))
+        self.watcher = None  # LibraryWatcher on a folder library, once warmed up
+        self.search_index = SearchIndex(index_path)
+        self._search_trigger = Clock.create_trigger(self._run_search, 0.15)
+        self.navigator = NavigationPopup(self)
+        self.jobs = JobPool(workers=2)
+        PillRow.thumbnail_loader = self.thumbnails = ThumbnailLoader(
+            self._user_data_path("thumbnails") or os.path.join(tempfile.gettempdir(), "gregor-thumbnails"),
+            self.jobs
+        )
+        self.prefetcher = Prefetcher(self.catalog, self.thumbnails, self.jobs, OPENABLE_EXTENSIONS)
+        # One memory budget for every cache; the cheapest to rebuild are trimmed first
+        accountant.register("prefetch", lambda: self.prefetcher.memory_used, self.prefetcher.trim_memory, rank=10)
+        accountant.register("archives", archives.idle_bytes, archives.trim, rank=20)
+        accountant.register("thumbnails", lambda: self.thumbnails.memory_used, self.thumbnails.trim_memory, rank=30)
+        accountant.register("labels", lambda: label_cache.used, label_cache.trim, rank=40)
+        # Lesson updates, when a server is configured and the library is a folder
+        update_url = os.environ.get(UPDATE_URL_ENV)
+        self.updater = None
+        if update_url and self.remote is None and not (pack_path and os.path.exists(pack_path)):
+            from updates import Updater
+
+            self.updater = Updater(library_dir, update_url, self._user_data_path("library_hashes.json"))
 
         # Orange background
         with self.canvas.before:
@@ -50,12 +174,12 @@ class MainMenu(BoxLayout):
         # Title - use adaptive sizing
         title_label = Label(
             text="Gregor-E Library",
-            font_size=self.get_adaptive_font_size(28),
             bold=True,
             color=(0, 0, 0, 1),
             size_hint=(1, None),
             height=dp(40)
         )
+        metrics.bind(title_label, 'font_size', 28)
         self.card.add_widget(title_label)
 
         # Spacer
@@ -64,16 +188,33 @@ class MainMenu(BoxLayout):
         # Tagline - use adaptive sizing
         subheading_label = Label(
             text="Your digital library at your fingertips",
-            font_size=self.get_adaptive_font_size(14),
             color=(0, 0, 0, 1),
             size_hint=(1, None),
             height=dp(30)
         )
+        metrics.bind(subheading_label, 'font_size', 14)
         self.card.add_widget(subheading_label)
 
         # Spacer
         self.card.add_widget(BoxLayout(size_hint=(1, None), height=dp(10)))
 
+        # Search box; results appear below it while typing
+        self.search_input = TextInput(
+            hint_text="Search lessons...",
+            multiline=False,
+            size_hint=(1, None),
+            height=dp(44)
+        )
+        metrics.bind(self.search_input, 'font_size', 14)
+        self.search_input.bind(text=lambda instance, text: self._search_trigger())
+        self.card.add_widget(self.search_input)
+
+        # Holds either the (virtualized) result list or a status label
+        self.search_results = BoxLayout(orientation='vertical', size_hint=(1, None))
+        self.search_results.bind(minimum_height=self.search_results.setter('height'))
+        self.card.add_widget(self.search_results)
+        self.search_list = None  # created with the first results
+
         # Buttons
         self._add_pill_button("Grade 11", self.show_grade11)
         self._add_pill_button("Grade 12", self.show_grade12)
@@ -85,32 +226,189 @@ class MainMenu(BoxLayout):
         # Bottom spacer
         self.add_widget(BoxLayout(size_hint=(1, 0.2)))
 
-        # Update layout when window size changes
-        Window.bind(on_resize=self.on_window_resize)
+        Window.bind(on_flip=self._on_first_frame)
+
+        # Put the user back where they were; the catalog and the saved page
+        # are read on the job pool, so the first frame doesn't wait for them
+        self.session = Session(self._user_data_path("session.json")).load()
+        if self.session.levels or self.session.lesson:
+            self.jobs.submit(
+                self._read_session,
+                priority=INTERACTIVE,
+                key="restore",
+                on_done=self._restore_session,
+                on_error=lambda e: print(f"Could not restore session: {e}")
+            )
 
-    def on_window_resize(self, instance, width, height):
-        """Handle window resize events to update adaptive layouts"""
-        # Update card size based on window dimensions
-        self.card.height = self.card.minimum_height
+    def _on_first_frame(self, *args):
+        """Start loading the catalog and search index once the menu is visible."""
+        Window.unbind(on_flip=self._on_first_frame)
+        startup_timer.mark("first_frame")
+        self.jobs.submit(
+            self._warm_up,
+            priority=BACKGROUND,
+            key="warm-up",
+            on_done=self._warmed_up
+        )
+
+    def _warm_up(self):
+        """Returns True if the classroom library's listing changed meanwhile."""
+        if self.updater is not None:
+            self.updater.finish_pending()  # an interrupted update, before the library is read
+        self.catalog.load()
+        refreshed = False
+        if self.remote is not None:
+            # Last time's listing is already browsable; catch up with the server
+            try:
+                refreshed = self.catalog.refresh()
+            except (OSError, ValueError) as e:
+                print(f"Classroom library unreachable, showing the copy from last time: {e}")
+            if self.search_index.index_path:
+                self.remote.fetch_index(self.search_index.index_path)
+        startup_timer.mark("catalog")
+        self.search_index.load()
+        self.search_index.update(self.catalog)
+        startup_timer.mark("index")
+        return refreshed
+
+    def _warmed_up(self, refreshed):
+        self._run_search()  # re-run whatever was typed meanwhile
+        if refreshed:
+            self._redraw_navigation(None)
+        startup_timer.finish(self._user_data_path(""))
+        if os.environ.get(EXIT_ENV):
+            App.get_running_app().stop()
+            return
+        serve_port = os.environ.get(SERVE_PORT_ENV)
+        if serve_port and self.server is None:
+            from classroom import LibraryServer
+
+            self.server = LibraryServer(self.catalog, self.search_index.index_path,
+                                        self._user_data_path("classroom-server"), port=int(serve_port)).start()
+            print(f"Sharing the library on port {self.server.port}")
+        if self.catalog.pack is None and os.path.isdir(self.catalog.root) and self.watcher is None:
+            from watcher import LibraryWatcher
+
+            # Lessons copied into the folder show up without a restart
+            self.watcher = LibraryWatcher(self.catalog.root, self._library_changed).start()
+        if self.updater is not None:
+            self.jobs.submit(
+                self.updater.run,
+                priority=BACKGROUND,
+                key="update",
+                on_done=self._updated,
+                on_error=lambda e: print(f"Lesson update failed: {e}")
+            )
+
+    def _updated(self, changed):
+        if not changed:
+            return
+        print(f"Lesson update: {len(changed)} files, {self.updater.downloaded} bytes downloaded")
+        # Only the updated folders are rescanned, then only those files re-indexed
+        self._catalog_changed(self.catalog.rescan(changed))
+
+    def _library_changed(self, paths):
+        """Watcher thread: rescan what a batch of file system events touched."""
+        if paths is None:  # events were lost; check every folder
+            changed = None if self.catalog.refresh() else []
+        else:
+            changed = self.catalog.rescan(paths)
+        if changed != []:
+            Clock.schedule_once(lambda dt: self._catalog_changed(changed))
+
+    def _catalog_changed(self, changed):
+        """Bring everything derived from the catalog up to date with the
+        entries at `changed` (None: any of them may have changed)."""
+        if changed == []:
+            return
+        if self.server is not None:
+            self.server.invalidate()
+        # Re-indexing compares the catalog with the index, so only new and changed files are read
+        self.jobs.submit(self.search_index.update, self.catalog, priority=BACKGROUND, key="reindex",
+                         on_done=lambda count: self._run_search())
+        self._redraw_navigation(changed)
+
+    def _redraw_navigation(self, changed):
+        """Redraw the navigation level on screen if entries at `changed` (None: any) are in it."""
+        if self.navigator.is_open and self.navigator.stack:
+            route = self.navigator.stack[-1].route
+            routes = [parse_route(path) for path in changed] if changed is not None else None
+            if routes is None or any(r is not None and r[:len(route)] == route for r in routes):
+                title = self.navigator.stack[-1].title
+                self.navigator.redraw(lambda: self._show_level(title, route))
+
+    def _show_level(self, title, route):
+        """Push the navigation level for `route`: () quarters, up to (quarter, subject, week) files."""
+        shows = (self._show_quarters_popup, self._show_subjects_popup,
+                 self._show_weeks_popup, self._show_files_popup)
+        shows[len(route)](title, *route)
+
+    def _read_session(self):
+        """The saved lesson's catalog entry and decoded page, each None if gone; runs on the job pool."""
+        self.catalog.load()  # quick: the index was written when the snapshot was
+        lesson = self.session.lesson
+        entry = self.catalog.entry(lesson["path"]) if lesson else None
+        if entry is None or entry.kind not in ("pptx", "pdf"):
+            return None, None
+        # The saved page is only good for the same version of the file
+        page = self.session.load_page() if (entry.size, entry.mtime) == (lesson["size"], lesson["mtime"]) else None
+        return entry, page
+
+    def _restore_session(self, result):
+        entry, page = result
+        levels = self.session.levels
+
+        def replay():
+            for title, route, _ in levels:
+                if len(route) > 3:
+                    break
+                self._show_level(title, route)
+
+        if levels:
+            self.navigator.restore(replay, [scroll_y for _, _, scroll_y in levels])
+        if entry is None:
+            return
+        # The saved page is on screen while the lesson opens behind it
+        file_path = self.catalog.abs_path(entry)
+        self.open_in_viewer(None, entry.path, self.session.lesson["page"], page, animation=False,
+                            title=os.path.basename(file_path))
+        self._start_open(
+            file_path, self.load_presentation if entry.kind == "pptx" else self.convert_and_show_pdf,
+            self.viewer.set_document, f"Could not reopen {os.path.basename(file_path)}", popup=False
+        )
 
-        # Update fonts
-        for child in self.card.children:
-            if isinstance(child, Label):
-                if "Gregor-E Library" in child.text:
-                    child.font_size = self.get_adaptive_font_size(28)
-                else:
-                    child.font_size = self.get_adaptive_font_size(14)
-            elif isinstance(child, Button):
-                child.font_size = self.get_adaptive_font_size(16)
+    def save_session(self):
+        """Snapshot the navigation levels and the lesson in the viewer."""
+        lesson = page = None
+        entry = self.catalog.entry(self.viewer_lesson) if self.viewer is not None and self.viewer_lesson else None
+        if entry is not None:
+            lesson = {"path": entry.path, "size": entry.size, "mtime": entry.mtime, "page": self.viewer.index}
+            page = self.viewer.current_page()
+        self.session.save(self.navigator.levels(), lesson, page)
+
+    def release_caches(self):
+        """Give back memory while in the background; everything is rebuilt on demand."""
+        self.prefetcher.cancel()
+        accountant.on_trim_memory(TRIM_MEMORY_UI_HIDDEN)
+        if self.viewer is not None:
+            self.viewer.release()
+
+    def resume(self):
+        if self.viewer is not None:
+            self.viewer.resume()
+
+    def _user_data_path(self, filename):
+        """Keep indexes next to the app's other writable data."""
+        if os.environ.get(DATA_DIR_ENV):
+            return os.path.join(os.environ[DATA_DIR_ENV], filename)
+        app = App.get_running_app()
+        if app is None:
+            return None  # e.g. constructed outside a running app; index stays in memory
+        return os.path.join(app.user_data_dir, filename)
 
     def get_adaptive_font_size(self, base_size):
-        """Calculate font size based on screen width"""
-        # Get the smaller dimension (portrait vs landscape)
-        min_dimension = min(Window.width, Window.height)
-        # Base calculation for adaptive font size
-        # Reference width: 360dp (common phone width)
-        reference_width = 360
-        return sp(base_size * (min_dimension / reference_width) * 0.7)
+        """Font size for `base_size` at the current window size (cached per size)"""
+        return metrics.font(base_size)
 
     def _update_bg(self, *args):
         self.bg_rect.pos = self.pos
@@ -124,27 +422,50 @@ class MainMenu(BoxLayout):
         btn = Button(
             text=text,
             size_hint=(1, None),
-            height=dp(50),  # Increased touch target for mobile
-            font_size=self.get_adaptive_font_size(16),
-            color=(0, 0, 0, 1),
-            background_color=(0, 0, 0, 0)
+            height=dp(50)  # Increased touch target for mobile
         )
+        metrics.bind(btn, 'font_size', 16)
         btn.bind(on_release=callback)
-
-        with btn.canvas.before:
-            Color(0.8, 0.8, 0.8, 1)  # Light gray
-            btn.rect = RoundedRectangle(
-                size=btn.size,
-                pos=btn.pos,
-                radius=[dp(25)]  # Larger radius for better look on mobile
-            )
-        btn.bind(size=self._update_btn_shape, pos=self._update_btn_shape)
+        # Light gray; larger radius for better look on mobile
+        style_pill_button(btn, (0.8, 0.8, 0.8, 1), (0, 0, 0, 1), radius=dp(25))
 
         self.card.add_widget(btn)
 
-    def _update_btn_shape(self, btn, *args):
-        btn.rect.pos = btn.pos
-        btn.rect.size = btn.size
+    def _run_search(self, *args):
+        self.search_results.clear_widgets()
+        query = self.search_input.text.strip()
+        if not query:
+            return
+
+        rows = []
+        for path, score in self.search_index.search(query, limit=SEARCH_RESULTS_SHOWN):
+            quarter_num, subject, week_num, file_name = parse_route(path)
+            if not file_name.lower().endswith(OPENABLE_EXTENSIONS):
+                continue
+            rows.append({
+                'text': f"📄 Q{quarter_num} · {file_name}",
+                'nav_action': lambda f=file_name, q=quarter_num, s=subject, w=week_num:
+                self._handle_file_selected(f, q, s, w),
+                'thumb_key': None,
+                'pill_color': (0.6, 0.6, 0.6, 1),
+                'font_size': self.get_adaptive_font_size(12)
+            })
+
+        if rows:
+            if self.search_list is None:
+                self.search_list = VirtualList(row_height=dp(44), spacing=dp(8), font_base=12, size_hint=(1, None))
+            self.search_list.data = rows
+            self.search_list.height = self.search_list.content_height(min(len(rows), SEARCH_ROWS_VISIBLE))
+            self.search_list.scroll_y = 1
+            self.search_results.add_widget(self.search_list)
+        else:
+            message = "No matching lessons" if self.search_index.ready else "Indexing lessons..."
+            self.search_results.add_widget(metrics.bind(Label(
+                text=message,
+                color=(0.3, 0.3, 0.3, 1),
+                size_hint=(1, None),
+                height=dp(30)
+            ), 'font_size', 12))
 
     def show_grade11(self, instance):
         self._show_quarters_popup("Grade 11")
@@ -152,412 +473,191 @@ class MainMenu(BoxLayout):
     def show_grade12(self, instance):
         self._show_quarters_popup("Grade 12")
 
-    def _show_quarters_popup(self, title):
-        self.current_navigation_path = title
-
-        popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
-        self._set_dark_bg(popup_content)
-
-        popup_content.add_widget(Label(
-            text=f"{title} - Select Quarter",
-            font_size=self.get_adaptive_font_size(20),
-            color=(1, 1, 1, 1),
-            size_hint=(1, None),
-            height=dp(40)
-        ))
-
-        quarters = ["1st", "2nd", "3rd", "4th"]
-        for i, quarter in enumerate(quarters, start=1):
-            quarter_button = Button(
-                text=f"📖 {quarter} Quarter",
-                size_hint=(1, None),
-                height=dp(50),  # Increased height for better touch targets
-                font_size=self.get_adaptive_font_size(16)
-            )
-            # Fix: Capture the loop variable i in the lambda function
-            quarter_num = i  # Explicitly get the quarter number
-            quarter_button.bind(on_release=lambda btn, q=quarter_num:
-            self._show_subjects_popup(f"{title} - {quarters[q - 1]} Quarter", q))
-            self._style_pill_button(quarter_button, (0.5, 0.5, 0.5, 1), (1, 1, 1, 1))
-            popup_content.add_widget(quarter_button)
-
-        close_button = Button(
-            text="❌ Close",
-            size_hint=(1, None),
-            height=dp(50),
-            font_size=self.get_adaptive_font_size(16)
-        )
-        self._style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
-
-        # Make popup responsive with size_hint
-        popup = Popup(
-            title=title,
-            content=popup_content,
-            size_hint=(0.95, 0.8),
-            title_size=self.get_adaptive_font_size(18)
-        )
-        close_button.bind(on_release=popup.dismiss)
-        popup_content.add_widget(close_button)
-        popup.open()
-
-    def _show_subjects_popup(self, title, quarter_num=None):
-        # Store current navigation path for later use
-        self.current_navigation_path = title
-
-        # Extract quarter from title if not provided
-        if quarter_num is None:
-            # Gets the '1' from '1st'
-            quarter_part = title.split(" - ")[1].split()[0][0]
-            quarter_num = int(quarter_part)
-
-        popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
-        self._set_dark_bg(popup_content)
-
-        popup_content.add_widget(Label(
-            text=f"{title} - Select Subject",
-            font_size=self.get_adaptive_font_size(14),
-            color=(1, 1, 1, 1),
-            size_hint=(1, None),
-            height=dp(40)
-        ))
-
-        # Determine grade from title
-        grade = 11 if "Grade 11" in title else 12
-
-        # Get subjects based on grade and quarter
-        if grade == 11:
-            if quarter_num in (1, 2):
-                subjects = [
-                    "Oral Comm",
-                    "Komunikasyon",
-                    "General Mathematics",
-                    "Earth Science",
-                    "Understanding Culture, Society and Politics",
-                    "Personal Development",
-                    "PE"
-                ]
+    @tracing.traced("tap.file")
+    def _handle_file_selected(self, file_name, quarter_num=None, subject=None, week_num=None):
+        self.catalog.load()
+        rel_path = f"{Catalog.week_dir(quarter_num, subject, week_num)}/{file_name}"
+        file_path = self.catalog.abs_path(rel_path)
+
+        entry = self.catalog.entry(rel_path)
+        show = lambda document: self.open_in_viewer(document, rel_path)
+        if entry is not None and entry.kind == "pptx" and lessonpack.exists(file_path):
+            # Real decks open in the built-in viewer; no app switch needed
+            self._start_open(file_path, self.load_presentation, show, "Failed to open presentation")
+        elif lessonpack.exists(file_path):
+            if file_name.lower().endswith('.pdf'):
+                self._start_open(file_path, self.convert_and_show_pdf, show, "Failed to open PDF")
             else:
-                subjects = [
-                    "Reading and Writing",
-                    "Pagbasa",
-                    "21st Century Literature",
-                    "Stats and Probability",
-                    "PE"
-                ]
-        else:  # Grade 12
-            subjects = [
-                "1 - Introduction & Overview",
-                "2 - Key Concepts & Theories",
-                "3 - Practical Applications",
-                "4 - Review and Assessment",
-                "5 - Advanced Topics or Follow-Up",
-                "6 - Additional Case Studies",
-                "7 - Problem-Solving Approaches",
-                "8 - Recap and Exam Preparation"
-            ]
-
-            subjects = subjects[:5] if quarter_num in (1, 2) else subjects[5:]
-
-        # Create scroll view for subjects
-        scroll_height = min(Window.height * 0.5, dp(300))
-        scroll_view = ScrollView(size_hint=(1, None), height=scroll_height)
-        subjects_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=dp(15))
-        subjects_layout.bind(minimum_height=subjects_layout.setter('height'))
-
-        for subject in subjects:
-            subject_button = Button(
-                text=f"📚 {subject}",
-                size_hint=(1, None),
-                height=dp(50),
-                font_size=self.get_adaptive_font_size(12)
-            )
-            # Capture current subject in lambda
-            subject_button.bind(on_release=lambda btn, q=quarter_num, s=subject:
-            self._show_weeks_popup(f"{title} - {s}", q, s))
-            self._style_pill_button(subject_button, (0.6, 0.6, 0.6, 1), (1, 1, 1, 1))
-            subjects_layout.add_widget(subject_button)
-
-        scroll_view.add_widget(subjects_layout)
-        popup_content.add_widget(scroll_view)
-
-        # Close button and popup creation remains the same
-        close_button = Button(
-            text="❌ Close",
-            size_hint=(1, None),
-            height=dp(50),
-            font_size=self.get_adaptive_font_size(12)
-        )
-        self._style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
-
-        popup = Popup(
-            title=title,
-            content=popup_content,
-            size_hint=(0.95, 0.9),
-            title_size=self.get_adaptive_font_size(14)
-        )
-        close_button.bind(on_release=popup.dismiss)
-        popup_content.add_widget(close_button)
-        popup.open()
-
-    def _show_weeks_popup(self, title, quarter_num=None, subject=None):
-        self.current_navigation_path = title
-
-        # Extract quarter and subject if not provided
-        if quarter_num is None:
-            title_parts = title.split(" - ")
-            quarter_part = title_parts[1].split()[0][0]  # Gets the '1' from '1st'
-            quarter_num = int(quarter_part)
-
-        if subject is None:
-            subject = title.split(" - ")[-1]
-
-        popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
-        self._set_dark_bg(popup_content)
-
-        popup_content.add_widget(Label(
-            text=f"{title} - Select Week",
-            font_size=self.get_adaptive_font_size(14),
-            color=(1, 1, 1, 1),
-            size_hint=(1, None),
-            height=dp(40)
-        ))
-
-        # Create scrollable area for weeks
-        scroll_height = min(Window.height * 0.6, dp(400))  # Adaptive height
-        scroll_view = ScrollView(size_hint=(1, None), height=scroll_height)
-        weeks_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=dp(15))
-        weeks_layout.bind(minimum_height=weeks_layout.setter('height'))
-
-        # Use 8 weeks to match the batch script
-        weeks = [f"Week {i}" for i in range(1, 9)]
-        for week in weeks:
-            week_button = Button(
-                text=f"📅 {week}",
-                size_hint=(1, None),
-                height=dp(50),
-                font_size=self.get_adaptive_font_size(14)
-            )
-            # Fix: Properly capture week number in the lambda
-            week_num = int(week.split()[1])
-            week_button.bind(on_release=lambda btn, q=quarter_num, s=subject, w=week_num:
-            self._show_files_popup(f"{title} - Week {w}", q, s, w))
-            self._style_pill_button(week_button, (0.7, 0.7, 0.7, 1), (1, 1, 1, 1))
-            weeks_layout.add_widget(week_button)
-
-        scroll_view.add_widget(weeks_layout)
-        popup_content.add_widget(scroll_view)
-
-        close_button = Button(
-            text="❌ Close",
-            size_hint=(1, None),
-            height=dp(50),
-            font_size=self.get_adaptive_font_size(14)
-        )
-        self._style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
-
-        # Responsive popup
-        popup = Popup(
-            title=title,
-            content=popup_content,
-            size_hint=(0.95, 0.9),
-            title_size=self.get_adaptive_font_size(14)
-        )
-        close_button.bind(on_release=popup.dismiss)
-        popup_content.add_widget(close_button)
-        popup.open()
-
-    def _show_files_popup(self, title, quarter_num=None, subject=None, week_num=None):
-        self.current_navigation_path = title
-
-        # Extract information if not provided
-        if any(param is None for param in [quarter_num, subject, week_num]):
-            title_parts = title.split(" - ")
-            if quarter_num is None:
-                quarter_part = title_parts[1].split()[0][0]  # Gets the '1' from '1st'
-                quarter_num = int(quarter_part)
-
-            if subject is None:
-                subject = title_parts[2].replace("Subject ", "")
-
-            if week_num is None:
-                week_num = int(title_parts[3].split()[1])
-
-        popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
-        self._set_dark_bg(popup_content)
-
-        popup_content.add_widget(Label(
-            text=f"{title} - Select File",
-            font_size=self.get_adaptive_font_size(20),
-            color=(1, 1, 1, 1),
-            size_hint=(1, None),
-            height=dp(40)
-        ))
-
-        # Create scrollable area for files
-        scroll_height = min(Window.height * 0.6, dp(400))  # Adaptive height
-        scroll_view = ScrollView(size_hint=(1, None), height=scroll_height)
-        files_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=dp(15))
-        files_layout.bind(minimum_height=files_layout.setter('height'))
-
-        BASE_DIR = "GregorELibrary"
-
-        folder_path = os.path.join(
-            BASE_DIR,
-            f"Quarter {quarter_num}",
-            f"Subject {subject}",
-            f"Week {week_num}"
-        )
-
-        # Debug output to verify path components
-        print(f"Looking for files in: {folder_path}")
-        print(f"Quarter: {quarter_num}, Subject: {subject}, Week: {week_num}")
-
-        files = []
-        if os.path.exists(folder_path):
-            # Include both PPTX and PDF files
-            files = [f for f in os.listdir(folder_path)
-                     if f.lower().endswith(('.pptx', '.pdf'))]
-
-        if files:
-            for file in files:
-                file_button = Button(
-                    text=f"📄 {file}",
-                    size_hint=(1, None),
-                    height=dp(50),
-                    font_size=self.get_adaptive_font_size(14)
-                )
-                # Fix: Properly capture file name in the lambda
-                file_button.bind(on_release=lambda btn, f=file, q=quarter_num, s=subject, w=week_num:
-                self._handle_file_selected(f, q, s, w))
-                self._style_pill_button(file_button, (0.8, 0.8, 0.8, 1), (1, 1, 1, 1))
-                files_layout.add_widget(file_button)
+                # Open the PPTX file using the default application
+                self._start_open(file_path, self.open_pptx_file, None, "Failed to open file")
         else:
-            files_layout.add_widget(Label(
-                text=f"No PowerPoint files found in:\n{folder_path}",
-                font_size=self.get_adaptive_font_size(14),
-                color=(1, 1, 1, 1),
-                size_hint=(1, None),
-                height=dp(80),
-                halign='center',
-                valign='middle',
-                text_size=(Window.width * 0.8, None)
-            ))
-
-        scroll_view.add_widget(files_layout)
-        popup_content.add_widget(scroll_view)
-
-        close_button = Button(
-            text="❌ Close",
-            size_hint=(1, None),
-            height=dp(50),
-            font_size=self.get_adaptive_font_size(14)
-        )
-        self._style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
+            self._show_error_popup("Error", f"File not found: {file_path}")
 
-        # Responsive popup
-        popup = Popup(
-            title=title,
-            content=popup_content,
-            size_hint=(0.95, 0.9),
-            title_size=self.get_adaptive_font_size(14)
+    def _start_open(self, file_path, work, on_done, failure, popup=True):
+        """Run `work(file_path)` on the job pool behind a cancellable loading popup.
+
+        `on_done(result)` runs on the UI thread. A second tap on the same
+        file while it is still opening joins the first job, and tapping a
+        different file cancels the earlier one. With `popup` False there is
+        no loading popup; closing the viewer cancels the open instead.
+        """
+        job = self.jobs.submit(
+            work, file_path,
+            priority=INTERACTIVE,
+            key=("open", file_path),
+            on_done=lambda result: self._open_finished(job, on_done, result),
+            on_error=lambda e: self._open_failed(job, f"{failure}: {e}")
         )
-        close_button.bind(on_release=popup.dismiss)
-        popup_content.add_widget(close_button)
-        popup.open()
-
-    def _handle_file_selected(self, file_name, quarter_num=None, subject=None, week_num=None):
-        BASE_DIR = "GregorELibrary"
-
-        file_path = os.path.join(
-            BASE_DIR,
-            f"Quarter {quarter_num}",
-            f"Subject {subject}",
-            f"Week {week_num}",
-            file_name
-        )
-
-        if os.path.exists(file_path):
-            try:
+        if job is self.open_job:
+            return
+        if self.open_job is not None:
+            self.open_job.cancel()
+        self.open_job = job
+        # Ends once whatever the open shows is on screen
+        self._open_span = tracing.span("open.tap_to_content", file=os.path.basename(file_path))
+        if popup and self.loading_popup is None:
+            with tracing.span("open.loading_popup"):
                 self.loading_popup = self._show_loading_popup()
-                if file_name.lower().endswith('.pptx'):
-                    # Open the PPTX file using the default application
-                    Thread(target=self.open_pptx_file, args=(file_path,)).start()
-                elif file_name.lower().endswith('.pdf'):
-                    Thread(target=self.convert_and_show_pdf, args=(file_path,)).start()
-            except Exception as e:
-                self._show_error_popup("Error", f"Failed to process file: {e}")
-                if self.loading_popup:
-                    self.loading_popup.dismiss()
-        else:
-            self._show_error_popup("Error", f"File not found: {file_path}")
-
+            tracing.until_next_frame("open.loading_popup_visible")
+
+    def _end_open(self, job):
+        if job is not self.open_job:
+            return False
+        self.open_job = None
+        tracing.end_on_next_frame(self._open_span)
+        self._open_span = tracing.NO_SPAN
+        if self.loading_popup:
+            self.loading_popup.dismiss()
+        return True
+
+    def _open_finished(self, job, on_done, result):
+        if self._end_open(job) and on_done is not None:
+            on_done(result)
+
+    def _open_failed(self, job, message):
+        if self._end_open(job):
+            if self.viewer is not None and self.viewer.deck is None:
+                # A restored page whose lesson can't be opened any more
+                print(message)
+                self.viewer.dismiss()
+                return
+            self._show_error_popup("Error", message)
+
+    def _on_loading_dismissed(self, popup):
+        # Closing the loading popup means the user no longer wants the file
+        self.loading_popup = None
+        self._cancel_open()
+
+    def _cancel_open(self):
+        if self.open_job is not None:
+            self._open_span.set(cancelled=True)
+            self._open_span.end()
+            self._open_span = tracing.NO_SPAN
+            self.open_job.cancel()
+            self.open_job = None
+
+    def load_presentation(self, file_path):
+        """Read a .pptx's slide list, or find its pre-rendered slides, for the in-app viewer; runs on the job pool."""
+        lessonpack.fetch(file_path)  # a classroom lesson is downloaded once, then opened from the cache
+        return self.prefetcher.take(file_path) or open_document(file_path, "pptx")
+
+    def open_in_viewer(self, document, rel_path=None, index=0, page=None, animation=True, title=None):
+        """Show an opened SlideDeck or PdfDocument in the in-app viewer,
+        at page `index`, which `page` may hold already decoded. With
+        `document` None, `page` is shown until viewer.set_document()."""
+        from viewer import DocumentViewer
+
+        title = title or os.path.basename(document.path)
+        self.viewer = DocumentViewer(document, title, index, page)
+        self.viewer_lesson = rel_path
+        self.viewer.bind(on_dismiss=self._on_viewer_dismissed)
+        self.viewer.open(animation=animation)
+
+    def _on_viewer_dismissed(self, viewer):
+        if viewer is self.viewer:
+            if viewer.deck is None:
+                self._cancel_open()  # closed before its lesson finished opening
+            self.viewer = None
+            self.viewer_lesson = None
+
+    def convert_and_show_pdf(self, file_path):
+        """Open a PDF for the in-app viewer; runs on the job pool.
+
+        Only the cross-reference table and page tree are read here; each
+        page is laid out when the viewer asks for it. Pre-rendered pages
+        are just decoded.
+        """
+        lessonpack.fetch(file_path)
+        return self.prefetcher.take(file_path) or open_document(file_path, "pdf")
+
+    @tracing.traced("open.external_app")
     def open_pptx_file(self, file_path):
-        """Open the PPTX file using the default application."""
-        try:
-            if platform.system() == "Windows":
-                # For Windows
-                os.startfile(file_path)
-            elif platform.system() == "Darwin":
-                # For macOS
-                subprocess.run(["open", file_path], check=True)
-            elif platform.system() == "Linux" and not self.is_android():
-                # For Linux (non-Android)
-                subprocess.run(["xdg-open", file_path], check=True)
-            else:
-                # For Android
-                self.open_file_on_android(file_path)
-        except Exception as e:
-            self._show_error_popup("Error", f"Failed to open file: {e}")
-        finally:
-            if self.loading_popup:
-                self.loading_popup.dismiss()
+        """Open the PPTX file using the default application; runs on the job pool."""
+        import platform
+        import subprocess
+
+        # Other apps need a real file; packed lessons are written out once
+        file_path = lessonpack.materialize(
+            file_path,
+            self._user_data_path("lessons") or os.path.join(tempfile.gettempdir(), "gregor-lessons")
+        )
+        if platform.system() == "Windows":
+            # For Windows
+            os.startfile(file_path)
+        elif platform.system() == "Darwin":
+            # For macOS
+            subprocess.run(["open", file_path], check=True)
+        elif platform.system() == "Linux" and not self.is_android():
+            # For Linux (non-Android)
+            subprocess.run(["xdg-open", file_path], check=True)
+        else:
+            # For Android
+            self.open_file_on_android(file_path)
 
     def is_android(self):
         """Check if the app is running on Android."""
-        return platform.system() == "Linux" and hasattr(android, "activity")
+        return kivy_platform == "android"
 
+    @tracing.traced("open.android_intent")
     def open_file_on_android(self, file_path):
         """Open a file on Android using an intent."""
-        try:
-            from android import mActivity
-            from jnius import autoclass, cast
+        from jnius import autoclass, cast
 
-            # Java classes required for Android intents
-            Intent = autoclass("android.content.Intent")
-            Uri = autoclass("android.net.Uri")
-            File = autoclass("java.io.File")
-            PythonActivity = autoclass("org.kivy.android.PythonActivity")
+        # Java classes required for Android intents
+        Intent = autoclass("android.content.Intent")
+        Uri = autoclass("android.net.Uri")
+        File = autoclass("java.io.File")
+        PythonActivity = autoclass("org.kivy.android.PythonActivity")
 
-            # Create a URI for the file
-            file = File(file_path)
-            uri = Uri.fromFile(file)
+        # Create a URI for the file
+        file = File(file_path)
+        uri = Uri.fromFile(file)
 
-            # Create an intent to view the file
-            intent = Intent(Intent.ACTION_VIEW)
-            intent.setDataAndType(uri, "application/vnd.ms-powerpoint")
+        # Create an intent to view the file
+        intent = Intent(Intent.ACTION_VIEW)
+        intent.setDataAndType(uri, "application/vnd.ms-powerpoint")
 
-            # Start the activity
-            current_activity = cast("android.app.Activity", PythonActivity.mActivity)
-            current_activity.startActivity(intent)
-        except Exception as e:
-            self._show_error_popup("Error", f"Failed to open file on Android: {e}")
+        # Start the activity
+        current_activity = cast("android.app.Activity", PythonActivity.mActivity)
+        current_activity.startActivity(intent)
 
     def _show_loading_popup(self):
+        from kivy.uix.popup import Popup
+
         popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
         self._set_dark_bg(popup_content)
-        popup_content.add_widget(Label(
-            text="Loading PPT...\nPlease wait",
-            font_size=self.get_adaptive_font_size(14),
+        popup_content.add_widget(metrics.bind(Label(
+            text="Loading lesson...\nPlease wait",
             color=(1, 1, 1, 1),
             halign='center'
-        ))
+        ), 'font_size', 14))
         # Responsive popup
-        popup = Popup(
+        popup = metrics.bind(Popup(
             title="Loading",
             content=popup_content,
-            size_hint=(0.7, 0.3),
-            title_size=self.get_adaptive_font_size(14)
-        )
+            size_hint=(0.7, 0.3)
+        ), 'title_size', 14)
+        popup.bind(on_dismiss=self._on_loading_dismissed)
         popup.open()
         return popup
 
@@ -571,104 +671,45 @@ class MainMenu(BoxLayout):
         # Using a conservative estimate based on font size
         font_size = self.get_adaptive_font_size(14)
         chars_per_width = int(available_width / (font_size * 0.6))  # Approximate character width
+        return _fit_title(title, chars_per_width)
+
+    def _refresh_remote(self):
+        """Ask the classroom library for its listing again, on the job pool."""
+        self.jobs.submit(
+            self.catalog.refresh,
+            priority=INTERACTIVE,
+            key="remote-refresh",
+            on_done=lambda changed: self._catalog_changed(None) if changed else None,
+            on_error=lambda e: print(f"Classroom library unreachable: {e}")
+        )
 
-        # If title is too long, truncate it intelligently
-        if len(title) > chars_per_width:
-            # Split the title by parts
-            title_parts = title.split(" - ")
-
-            # Keep the first and last parts, abbreviate middle parts if needed
-            if len(title_parts) > 2:
-                # Always show the current level (last part)
-                last_part = title_parts[-1]
-                first_part = title_parts[0]
-
-                # Calculate remaining space for middle parts
-                remaining_chars = chars_per_width - len(first_part) - len(last_part) - 7  # 7 chars for " - ... - "
-
-                if remaining_chars > 10:  # If we have reasonable space
-                    middle_parts = title_parts[1:-1]
-                    middle_str = ""
-
-                    # Try to fit as many middle parts as possible
-                    for part in middle_parts:
-                        if len(middle_str) + len(part) + 3 <= remaining_chars:  # +3 for " - "
-                            middle_str += " - " + part if middle_str else part
-                        else:
-                            # Add ellipsis if we can't fit all parts
-                            middle_str += "..." if not middle_str else "..."
-                            break
-
-                    return f"{first_part} - {middle_str} - {last_part}"
-                else:
-                    # Very limited space, just show first and last with ellipsis
-                    return f"{first_part} - ... - {last_part}"
-            else:
-                # Only two parts, try to show both
-                first_part = title_parts[0]
-                last_part = title_parts[1]
-
-                if len(first_part) + len(last_part) + 3 > chars_per_width:
-                    # Still too long, truncate both parts
-                    chars_each = (chars_per_width - 3) // 2  # -3 for " - "
-                    return f"{first_part[:chars_each]}... - ...{last_part[-chars_each:]}"
-
-        # Title fits, return as is
-        return title
-
-    # Now update the popup creation in all relevant methods:
-
+    @tracing.traced("tap.quarters")
     def _show_quarters_popup(self, title):
         self.current_navigation_path = title
+        self.catalog.load()  # normally already done by the warm-up job; never goes to the network
+        empty_text = ""
+        if self.remote is not None and not self.catalog.quarters():
+            # A first launch that couldn't reach the classroom library yet
+            empty_text = "Connecting to the classroom library..."
+            self._refresh_remote()
+
+        # Only quarters that actually have a folder in the library
+        ordinals = {1: "1st", 2: "2nd", 3: "3rd", 4: "4th"}
+        items = []
+        for quarter_num in self.catalog.quarters():
+            quarter = ordinals.get(quarter_num, f"{quarter_num}th")
+            items.append(NavItem(
+                f"📖 {quarter} Quarter",
+                lambda q=quarter_num, name=quarter: self._show_subjects_popup(f"{title} - {name} Quarter", q)
+            ))
 
-        popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
-        self._set_dark_bg(popup_content)
-
-        # Use responsive title
-        responsive_title = self._get_responsive_title(f"{title} - Select Quarter")
-
-        popup_content.add_widget(Label(
-            text=responsive_title,
-            font_size=self.get_adaptive_font_size(14),
-            color=(1, 1, 1, 1),
-            size_hint=(1, None),
-            height=dp(40)
-        ))
-
-        # Rest of the method remains the same
-        quarters = ["1st", "2nd", "3rd", "4th"]
-        for i, quarter in enumerate(quarters, start=1):
-            quarter_button = Button(
-                text=f"📖 {quarter} Quarter",
-                size_hint=(1, None),
-                height=dp(50),
-                font_size=self.get_adaptive_font_size(14)
-            )
-            quarter_num = i
-            quarter_button.bind(on_release=lambda btn, q=quarter_num:
-            self._show_subjects_popup(f"{title} - {quarters[q - 1]} Quarter", q))
-            self._style_pill_button(quarter_button, (0.5, 0.5, 0.5, 1), (1, 1, 1, 1))
-            popup_content.add_widget(quarter_button)
-
-        close_button = Button(
-            text="❌ Close",
-            size_hint=(1, None),
-            height=dp(50),
-            font_size=self.get_adaptive_font_size(14)
-        )
-        self._style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
-
-        # Use responsive title for popup
-        popup = Popup(
-            title=self._get_responsive_title(title),
-            content=popup_content,
-            size_hint=(0.95, 0.8),
-            title_size=self.get_adaptive_font_size(14)
+        self.navigator.push(
+            NavLevel(title, f"{title} - Select Quarter", items, (0.5, 0.5, 0.5, 1), empty_text=empty_text,
+                     route=()),
+            root=True
         )
-        close_button.bind(on_release=popup.dismiss)
-        popup_content.add_widget(close_button)
-        popup.open()
 
+    @tracing.traced("tap.subjects")
     def _show_subjects_popup(self, title, quarter_num=None):
         # Store current navigation path for later use
         self.current_navigation_path = title
@@ -678,78 +719,19 @@ class MainMenu(BoxLayout):
             quarter_part = title.split(" - ")[1].split()[0][0]
             quarter_num = int(quarter_part)
 
-        popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
-        self._set_dark_bg(popup_content)
-
-        # Use responsive title
-        responsive_title = self._get_responsive_title(f"{title} - Select Subject")
-
-        popup_content.add_widget(Label(
-            text=responsive_title,
-            font_size=self.get_adaptive_font_size(14),
-            color=(1, 1, 1, 1),
-            size_hint=(1, None),
-            height=dp(40)
-        ))
-
-        if quarter_num in [1, 2]:  # 1st and 2nd quarter subjects
-            subjects = [
-                "1 - Oral Comm",
-                "2 - Komunikasyon",
-                "3 - General Mathematics",
-                "4 - Earth Science",
-                "5 - Understanding Culture, Society and Politics",
-                "6 - Personal Development",
-                "7 - PE"
-            ]
-        elif quarter_num in [3, 4]:  # 3rd and 4th quarter subjects
-            subjects = [
-                "1 - Reading and Writing",
-                "2 - Pagbasa",
-                "3 - 21st Century Literature",
-                "4 - Stats and Probability",
-                "5 - PE"
-            ]
-
-        scroll_height = min(Window.height * 0.5, dp(300))
-        scroll_view = ScrollView(size_hint=(1, None), height=scroll_height)
-        subjects_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=dp(15))
-        subjects_layout.bind(minimum_height=subjects_layout.setter('height'))
-
-        for subject in subjects:
-            subject_button = Button(
-                text=f"📚 Subject {subject}",
-                size_hint=(1, None),
-                height=dp(50),
-                font_size=self.get_adaptive_font_size(14)
+        # Subject names come from the folders on disk, e.g. "1 - Oral Comm"
+        items = [
+            NavItem(
+                f"📚 Subject {subject}",
+                lambda s=subject: self._show_weeks_popup(f"{title} - Subject {s}", quarter_num, s)
             )
-            subject_button.bind(on_release=lambda btn, q=quarter_num, s=subject:
-            self._show_weeks_popup(f"{title} - Subject {s}", q, s))
-            self._style_pill_button(subject_button, (0.6, 0.6, 0.6, 1), (1, 1, 1, 1))
-            subjects_layout.add_widget(subject_button)
-
-        scroll_view.add_widget(subjects_layout)
-        popup_content.add_widget(scroll_view)
-
-        close_button = Button(
-            text="❌ Close",
-            size_hint=(1, None),
-            height=dp(50),
-            font_size=self.get_adaptive_font_size(14)
-        )
-        self._style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
+            for subject in self.catalog.subjects(quarter_num)
+        ]
 
-        # Use responsive title for popup
-        popup = Popup(
-            title=self._get_responsive_title(title),
-            content=popup_content,
-            size_hint=(0.95, 0.9),
-            title_size=self.get_adaptive_font_size(14)
-        )
-        close_button.bind(on_release=popup.dismiss)
-        popup_content.add_widget(close_button)
-        popup.open()
+        self.navigator.push(NavLevel(title, f"{title} - Select Subject", items, (0.6, 0.6, 0.6, 1),
+                                     route=(quarter_num,)))
 
+    @tracing.traced("tap.weeks")
     def _show_weeks_popup(self, title, quarter_num=None, subject=None):
         self.current_navigation_path = title
 
@@ -762,62 +744,20 @@ class MainMenu(BoxLayout):
         if subject is None:
             subject = title.split(" - ")[-1]
 
-        popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
-        self._set_dark_bg(popup_content)
-
-        # Use responsive title
-        responsive_title = self._get_responsive_title(f"{title} - Select Week")
-
-        popup_content.add_widget(Label(
-            text=responsive_title,
-            font_size=self.get_adaptive_font_size(14),
-            color=(1, 1, 1, 1),
-            size_hint=(1, None),
-            height=dp(40)
-        ))
-
-        # Rest of the method remains the same
-        scroll_height = min(Window.height * 0.6, dp(400))
-        scroll_view = ScrollView(size_hint=(1, None), height=scroll_height)
-        weeks_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=dp(15))
-        weeks_layout.bind(minimum_height=weeks_layout.setter('height'))
-
-        weeks = [f"Week {i}" for i in range(1, 9)]
-        for week in weeks:
-            week_button = Button(
-                text=f"📅 {week}",
-                size_hint=(1, None),
-                height=dp(50),
-                font_size=self.get_adaptive_font_size(14)
+        # Only list weeks that exist, e.g. Reading and Writing has Weeks 1, 3, 5
+        items = [
+            NavItem(
+                f"📅 Week {week_num}",
+                lambda w=week_num: self._show_files_popup(f"{title} - Week {w}", quarter_num, subject, w)
             )
-            week_num = int(week.split()[1])
-            week_button.bind(on_release=lambda btn, q=quarter_num, s=subject, w=week_num:
-            self._show_files_popup(f"{title} - Week {w}", q, s, w))
-            self._style_pill_button(week_button, (0.7, 0.7, 0.7, 1), (1, 1, 1, 1))
-            weeks_layout.add_widget(week_button)
+            for week_num in self.catalog.weeks(quarter_num, subject)
+        ]
 
-        scroll_view.add_widget(weeks_layout)
-        popup_content.add_widget(scroll_view)
-
-        close_button = Button(
-            text="❌ Close",
-            size_hint=(1, None),
-            height=dp(50),
-            font_size=self.get_adaptive_font_size(14)
-        )
-        self._style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
-
-        # Use responsive title for popup
-        popup = Popup(
-            title=self._get_responsive_title(title),
-            content=popup_content,
-            size_hint=(0.95, 0.9),
-            title_size=self.get_adaptive_font_size(14)
-        )
-        close_button.bind(on_release=popup.dismiss)
-        popup_content.add_widget(close_button)
-        popup.open()
+        # While the weeks are on screen, each week's previews and first lesson are warmed
+        self.navigator.push(NavLevel(title, f"{title} - Select Week", items, (0.7, 0.7, 0.7, 1),
+                                     route=(quarter_num, subject)))
 
+    @tracing.traced("tap.files")
     def _show_files_popup(self, title, quarter_num=None, subject=None, week_num=None):
         self.current_navigation_path = title
 
@@ -834,89 +774,27 @@ class MainMenu(BoxLayout):
             if week_num is None:
                 week_num = int(title_parts[3].split()[1])
 
-        popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
-        self._set_dark_bg(popup_content)
-
-        # Use responsive title
-        responsive_title = self._get_responsive_title(f"{title} - Select File")
-
-        popup_content.add_widget(Label(
-            text=responsive_title,
-            font_size=self.get_adaptive_font_size(14),
-            color=(1, 1, 1, 1),
-            size_hint=(1, None),
-            height=dp(40)
-        ))
-
-        # Rest of the method remains the same
-        scroll_height = min(Window.height * 0.6, dp(400))
-        scroll_view = ScrollView(size_hint=(1, None), height=scroll_height)
-        files_layout = BoxLayout(orientation='vertical', size_hint_y=None, spacing=dp(15))
-        files_layout.bind(minimum_height=files_layout.setter('height'))
+        folder_path = self.catalog.abs_path(Catalog.week_dir(quarter_num, subject, week_num))
 
-        BASE_DIR = "GregorELibrary"
-
-        folder_path = os.path.join(
-            BASE_DIR,
-            f"Quarter {quarter_num}",
-            f"Subject {subject}",
-            f"Week {week_num}"
-        )
-
-        print(f"Looking for files in: {folder_path}")
-        print(f"Quarter: {quarter_num}, Subject: {subject}, Week: {week_num}")
-
-        files = []
-        if os.path.exists(folder_path):
-            files = [f for f in os.listdir(folder_path) if f.endswith('.pptx')]
-
-        if files:
-            for file in files:
-                file_button = Button(
-                    text=f"📄 {file}",
-                    size_hint=(1, None),
-                    height=dp(50),
-                    font_size=self.get_adaptive_font_size(14)
-                )
-                file_button.bind(on_release=lambda btn, f=file, q=quarter_num, s=subject, w=week_num:
-                self._handle_file_selected(f, q, s, w))
-                self._style_pill_button(file_button, (0.8, 0.8, 0.8, 1), (1, 1, 1, 1))
-                files_layout.add_widget(file_button)
-        else:
-            files_layout.add_widget(Label(
-                text=f"No PowerPoint files found in:\n{folder_path}",
-                font_size=self.get_adaptive_font_size(14),
-                color=(1, 1, 1, 1),
-                size_hint=(1, None),
-                height=dp(80),
-                halign='center',
-                valign='middle',
-                text_size=(Window.width * 0.8, None)
+        # Served from the in-memory catalog; no directory scan per tap
+        items = []
+        for entry in self.catalog.files(quarter_num, subject, week_num, OPENABLE_EXTENSIONS):
+            file_name = os.path.basename(entry.path)
+            items.append(NavItem(
+                f"📄 {file_name}",
+                lambda f=file_name: self._handle_file_selected(f, quarter_num, subject, week_num),
+                ThumbnailLoader.key_for(self.catalog.abs_path(entry), entry.size, entry.mtime, entry.kind)
             ))
 
-        scroll_view.add_widget(files_layout)
-        popup_content.add_widget(scroll_view)
-
-        close_button = Button(
-            text="❌ Close",
-            size_hint=(1, None),
-            height=dp(50),
-            font_size=self.get_adaptive_font_size(14)
-        )
-        self._style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
-
-        # Use responsive title for popup
-        popup = Popup(
-            title=self._get_responsive_title(title),
-            content=popup_content,
-            size_hint=(0.95, 0.9),
-            title_size=self.get_adaptive_font_size(14)
-        )
-        close_button.bind(on_release=popup.dismiss)
-        popup_content.add_widget(close_button)
-        popup.open()
+        self.navigator.push(NavLevel(
+            title, f"{title} - Select File", items, (0.8, 0.8, 0.8, 1),
+            empty_text=f"No PowerPoint files found in:\n{folder_path}",
+            route=(quarter_num, subject, week_num)
+        ))
 
     def _show_error_popup(self, title, message):
+        from kivy.uix.popup import Popup
+
         popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(10))
         self._set_dark_bg(popup_content)
 
@@ -940,6 +818,8 @@ class MainMenu(BoxLayout):
         popup.open()
 
     def show_about_us(self, instance):
+        from kivy.uix.popup import Popup
+
         popup_content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(10))
         self._set_dark_bg(popup_content)
 
@@ -981,30 +861,51 @@ class MainMenu(BoxLayout):
         layout.bg_rect.size = layout.size
 
     def _style_pill_button(self, btn, bg_color, text_color):
-        btn.background_color = (0, 0, 0, 0)
-        btn.color = text_color
-        btn.background_normal = ''
-        btn.background_down = ''
-
-        with btn.canvas.before:
-            Color(*bg_color)
-            btn.rect = RoundedRectangle(size=btn.size, pos=btn.pos, radius=[dp(20)])
-        btn.bind(size=self._update_btn_rect, pos=self._update_btn_rect)
-
-    def _update_btn_rect(self, instance, *args):
-        instance.rect.pos = instance.pos
-        instance.rect.size = instance.size
+        style_pill_button(btn, bg_color, text_color)
 
 
 class GregorELibraryApp(App):
     def build(self):
         # Load initial configuration
         Window.bind(on_keyboard=self.on_keyboard)
-        return MainMenu()
+        self.menu = MainMenu()
+        accountant.listen()
+        startup_timer.mark("build")
+        return self.menu
+
+    def on_pause(self):
+        # Android may stop the app from here on without another word
+        self.menu.save_session()
+        self.menu.release_caches()
+        self._export_trace()
+        return True
+
+    def on_resume(self):
+        self.menu.resume()
+
+    def on_stop(self):
+        self.menu.save_session()
+        if self.menu.server is not None:
+            self.menu.server.stop()
+        if self.menu.watcher is not None:
+            self.menu.watcher.stop()
+        self._export_trace()
+
+    def _export_trace(self):
+        if not tracing.enabled:
+            return
+        try:
+            path = tracing.export(tracing.output_path(self.menu._user_data_path("")))
+            print(f"Trace written to {path}")
+        except OSError as e:
+            print(f"Could not write trace: {e}")
 
     def on_keyboard(self, window, key, *args):
-        # Disable back button exit
+        # Android back button steps back through the navigation levels
+        # instead of exiting the app
         if key == 27:
+            if self.menu.navigator.is_open:
+                self.menu.navigator.back()
             return True
         return False
 
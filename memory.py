@@ -0,0 +1,209 @@
+"""One memory budget for all of the app's caches.
+
+Thumbnails, text textures, decoded pages, zoom tiles, lessons opened
+ahead and mapped archives each keep their own least recently used cache.
+Each cache registers with the accountant: `usage()` returns the bytes it
+holds now and `trim(target)` evicts until it holds at most `target`,
+keeping whatever is on screen. Together they are held to a budget that
+scales with the device's RAM. Over budget, the caches cheapest to
+rebuild are trimmed first.
+
+Android asks running apps to give memory back through onTrimMemory and
+onLowMemory; those trims go further than the budget, down to nothing
+but what is on screen when memory is critical or the app is hidden, and
+while the app runs the budget stays lowered for a while after a trim.
+
+On desktop Linux the same trims can be tried by sending the app SIGUSR1
+(memory running critically low) or SIGUSR2 (low memory); every trim
+prints what each cache holds before and after. GREGOR_MEMORY_BUDGET sets
+the budget in megabytes, to try a small device's budget on a big one.
+"""
+import os
+import time
+from threading import Lock
+
+import tracing
+
+BUDGET_ENV = "GREGOR_MEMORY_BUDGET"
+RAM_SHARE = 32  # the budget is 1/RAM_SHARE of the device's RAM...
+MIN_BUDGET = 32 * 1024 * 1024   # ...but at least this
+MAX_BUDGET = 192 * 1024 * 1024  # and at most this
+DEFAULT_BUDGET = 64 * 1024 * 1024  # when the RAM can't be told
+CHECK_INTERVAL = 1.0  # seconds between checks of the total against the budget
+PRESSURE_SECONDS = 30.0  # how long a trim keeps the budget lowered...
+PRESSURE_SHARE = 0.25  # ...to at least this share of it
+
+# android.content.ComponentCallbacks2 trim levels
+TRIM_MEMORY_RUNNING_MODERATE = 5
+TRIM_MEMORY_RUNNING_LOW = 10
+TRIM_MEMORY_RUNNING_CRITICAL = 15
+TRIM_MEMORY_UI_HIDDEN = 20
+TRIM_MEMORY_COMPLETE = 80  # what onLowMemory is treated as
+
+# Share of the budget kept after a trim of at least each level, most severe first
+TRIM_KEEP = (
+    (TRIM_MEMORY_UI_HIDDEN, 0),
+    (TRIM_MEMORY_RUNNING_CRITICAL, 0),
+    (TRIM_MEMORY_RUNNING_LOW, 0.25),
+    (TRIM_MEMORY_RUNNING_MODERATE, 0.5),
+)
+
+MB = 1024 * 1024
+
+
+def device_memory():
+    """Bytes of RAM in the device, or None where that can't be told."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None  # e.g. Windows, which has no sysconf
+
+
+def default_budget():
+    if os.environ.get(BUDGET_ENV):
+        return int(float(os.environ[BUDGET_ENV]) * MB)
+    ram = device_memory()
+    if not ram:
+        return DEFAULT_BUDGET
+    return max(MIN_BUDGET, min(MAX_BUDGET, ram // RAM_SHARE))
+
+
+def _mb(size):
+    return f"{size / MB:.1f} MB"
+
+
+class MemoryAccountant:
+    """Registered caches by name, held together to `budget` bytes."""
+
+    def __init__(self, budget=None):
+        self.budget = default_budget() if budget is None else budget
+        self._caches = {}  # name -> (usage, trim, rank)
+        self._lock = Lock()
+        self._limit = None  # lowered budget after a trim...
+        self._limit_until = 0  # ...until this time.monotonic()
+        self._callbacks = None  # the Android ComponentCallbacks2, kept alive here
+
+    def register(self, name, usage, trim, rank=50):
+        """Count `usage()` towards the budget and call `trim(target)` to bring it down.
+
+        Caches of lower `rank` are trimmed first, so give the ones
+        cheapest to rebuild a low one. Registering a name again replaces it.
+        """
+        with self._lock:
+            self._caches[name] = (usage, trim, rank)
+
+    def unregister(self, name):
+        with self._lock:
+            self._caches.pop(name, None)
+
+    def usage(self):
+        """Bytes each cache holds now, by name."""
+        with self._lock:
+            caches = list(self._caches.items())
+        return {name: usage() for name, (usage, _, _) in caches}
+
+    def total(self):
+        return sum(self.usage().values())
+
+    def report(self):
+        """One line of what each cache holds, biggest first, for diagnostics."""
+        usage = self.usage()
+        parts = ", ".join(f"{name} {_mb(size)}" for name, size in sorted(usage.items(), key=lambda i: -i[1]))
+        return f"{_mb(sum(usage.values()))} of {_mb(self.limit())}: {parts or 'nothing registered'}"
+
+    def limit(self):
+        """The budget, or less for a while after the system asked for memory back."""
+        if self._limit is not None and time.monotonic() < self._limit_until:
+            return self._limit
+        self._limit = None
+        return self.budget
+
+    def enforce(self, limit=None):
+        """Trim caches, lowest rank first, until together they hold at most `limit` bytes
+        (by default the current limit). Call on the UI thread; returns the bytes freed."""
+        limit = self.limit() if limit is None else limit
+        with self._lock:
+            caches = sorted(self._caches.values(), key=lambda cache: cache[2])
+        caches = [(usage, trim, usage()) for usage, trim, _ in caches]
+        excess = sum(used for _, _, used in caches) - limit
+        freed = 0
+        for usage, trim, used in caches:
+            if excess <= 0:
+                break
+            if not used:
+                continue
+            trim(max(0, used - excess))
+            released = used - usage()
+            excess -= released
+            freed += released
+        return freed
+
+    def check(self, *args):
+        """Bring the caches back within the limit; called every CHECK_INTERVAL."""
+        if self.enforce():
+            print(f"Memory over budget, trimmed to {self.report()}")
+
+    def on_trim_memory(self, level):
+        """Give memory back as asked by Android's onTrimMemory(`level`)."""
+        keep = next((share for threshold, share in TRIM_KEEP if level >= threshold), None)
+        if keep is None:
+            return
+        before = self.report()
+        target = int(self.budget * keep)
+        with tracing.span("memory.trim", level=level):
+            freed = self.enforce(target)
+        if level < TRIM_MEMORY_UI_HIDDEN:
+            # Still on screen: refill slowly, but leave room for what scrolls into view
+            self._limit = max(target, int(self.budget * PRESSURE_SHARE))
+            self._limit_until = time.monotonic() + PRESSURE_SECONDS
+        print(f"Memory trim (level {level}) freed {_mb(freed)}: {before} -> {self.report()}")
+
+    def on_low_memory(self):
+        self.on_trim_memory(TRIM_MEMORY_COMPLETE)
+
+    def listen(self):
+        """Check the budget every CHECK_INTERVAL and take trims from Android, or on
+        desktops from SIGUSR1 and SIGUSR2; call once, on the main thread."""
+        from kivy.clock import Clock
+        from kivy.utils import platform
+
+        Clock.schedule_interval(self.check, CHECK_INTERVAL)
+        if platform == "android":
+            self._callbacks = _android_callbacks(self)
+            return
+        import signal
+
+        if hasattr(signal, "SIGUSR1"):
+            # Handled between frames, like the Android callbacks
+            signal.signal(signal.SIGUSR1, lambda *args: Clock.schedule_once(
+                lambda dt: self.on_trim_memory(TRIM_MEMORY_RUNNING_CRITICAL)))
+            signal.signal(signal.SIGUSR2, lambda *args: Clock.schedule_once(lambda dt: self.on_low_memory()))
+
+
+def _android_callbacks(accountant):
+    """Register ComponentCallbacks2 with the activity; they hand trims to the UI thread."""
+    from jnius import PythonJavaClass, autoclass, java_method
+    from kivy.clock import Clock
+
+    class TrimCallbacks(PythonJavaClass):
+        __javainterfaces__ = ["android/content/ComponentCallbacks2"]
+        __javacontext__ = "app"
+
+        @java_method("(I)V")
+        def onTrimMemory(self, level):
+            Clock.schedule_once(lambda dt: accountant.on_trim_memory(level))
+
+        @java_method("()V")
+        def onLowMemory(self):
+            Clock.schedule_once(lambda dt: accountant.on_low_memory())
+
+        @java_method("(Landroid/content/res/Configuration;)V")
+        def onConfigurationChanged(self, config):
+            pass
+
+    callbacks = TrimCallbacks()
+    autoclass("org.kivy.android.PythonActivity").mActivity.registerComponentCallbacks(callbacks)
+    return callbacks
+
+
+accountant = MemoryAccountant()
@@ -0,0 +1,213 @@
+from collections import namedtuple
+
+from kivy.metrics import dp
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.label import Label
+
+import tracing
+from responsive import metrics
+from widgets import VirtualList
+
+# One row of a navigation level: the button text, a no-argument callable and
+# an optional ThumbnailLoader key for rows that show a preview
+NavItem = namedtuple("NavItem", ["text", "action", "thumb"], defaults=(None,))
+
+
+class NavLevel:
+    """Retained state of one level (quarters, subjects, weeks or files).
+
+    `route` is the level's place in the library, e.g. (quarter, subject),
+    which tells the prefetcher what the next tap may need.
+    """
+
+    def __init__(self, title, header, items, color, empty_text="", route=None):
+        self.title = title
+        self.header = header
+        self.items = items
+        self.color = color
+        self.empty_text = empty_text
+        self.route = route
+        self.scroll_y = 1
+
+
+class NavigationPopup:
+    """A single persistent popup for the quarter -> subject -> week -> file drill-down.
+
+    Levels are kept on a stack so Back redraws the previous one from its
+    retained items. Rows are shown in a VirtualList, so only the visible
+    buttons exist and they are recycled across levels and while scrolling.
+    """
+
+    def __init__(self, menu):
+        self.menu = menu
+        self.stack = []
+        self._closing = False
+        self._restoring = False
+        self.popup = None
+
+    def _build(self):
+        from kivy.uix.popup import Popup
+
+        menu = self.menu
+        content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(15))
+        menu._set_dark_bg(content)
+
+        self.header = metrics.bind(Label(
+            color=(1, 1, 1, 1),
+            size_hint=(1, None),
+            height=dp(40)
+        ), 'font_size', 14)
+        content.add_widget(self.header)
+
+        # The list and the "nothing here" label take turns in this slot
+        self.body = BoxLayout(orientation='vertical')
+        content.add_widget(self.body)
+        self.items_list = VirtualList(font_base=14, size_hint=(1, 1))
+
+        self.empty_label = metrics.bind(Label(
+            color=(1, 1, 1, 1),
+            halign='center',
+            valign='middle'
+        ), 'font_size', 14)
+        self.empty_label.bind(width=lambda label, width: setattr(label, 'text_size', (width, None)))
+
+        nav_row = BoxLayout(orientation='horizontal', size_hint=(1, None), height=dp(50), spacing=dp(10))
+        self.back_button = metrics.bind(Button(text="⬅ Back"), 'font_size', 14)
+        menu._style_pill_button(self.back_button, (0.4, 0.4, 0.4, 1), (1, 1, 1, 1))
+        self.back_button.bind(on_release=lambda btn: self.back())
+        nav_row.add_widget(self.back_button)
+
+        close_button = metrics.bind(Button(text="❌ Close"), 'font_size', 14)
+        menu._style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
+        close_button.bind(on_release=lambda btn: self.close())
+        nav_row.add_widget(close_button)
+        content.add_widget(nav_row)
+
+        self.popup = metrics.bind(Popup(
+            content=content,
+            size_hint=(0.95, 0.9)
+        ), 'title_size', 14)
+        self.popup.bind(on_dismiss=self._on_dismiss)
+        # Titles are truncated to the window width, so redo them on resize
+        metrics.listen(self._retitle)
+
+    @property
+    def is_open(self):
+        return self.popup is not None and self.popup.parent is not None
+
+    def push(self, level, root=False):
+        """Show `level` on top of the stack; `root=True` starts a new drill-down."""
+        if self.popup is None:
+            with tracing.span("nav.build"):
+                self._build()
+        if root:
+            self.stack.clear()
+        elif self.stack and not self._restoring:
+            self.stack[-1].scroll_y = self.items_list.scroll_y
+        self.stack.append(level)
+        if self._restoring:
+            return
+        with tracing.span("nav.show", rows=len(level.items)):
+            self._show(level)
+        if not self.is_open:
+            with tracing.span("nav.open"):
+                self.popup.open()
+        tracing.until_next_frame("nav.first_frame", level=level.title)
+
+    def restore(self, replay, scrolls=()):
+        """Rebuild a saved drill-down: `replay()` pushes every level, but
+        only the top one is drawn, and the popup appears without fading in.
+
+        `scrolls` are the saved scroll positions, bottom level first.
+        """
+        self._restoring = True
+        try:
+            replay()
+        finally:
+            self._restoring = False
+        if not self.stack:
+            return
+        for level, scroll_y in zip(self.stack, scrolls):
+            level.scroll_y = scroll_y
+        level = self.stack[-1]
+        self.menu.current_navigation_path = level.title
+        self._show(level)
+        if not self.is_open:
+            self.popup.open(animation=False)
+
+    def redraw(self, replay):
+        """Replace the level on screen with the one `replay()` pushes, keeping
+        the scroll position, e.g. after the library changed under it."""
+        if not self.is_open or not self.stack:
+            return
+        old = self.stack.pop()
+        depth = len(self.stack)
+        self._restoring = True
+        try:
+            replay()
+        finally:
+            self._restoring = False
+            if len(self.stack) == depth:
+                self.stack.append(old)  # nothing replaced it
+        level = self.stack[-1]
+        level.scroll_y = self.items_list.scroll_y
+        self._show(level)
+
+    def levels(self):
+        """(title, route, scroll_y) of every level, bottom first, for a session snapshot."""
+        if self.is_open and self.stack:
+            self.stack[-1].scroll_y = self.items_list.scroll_y
+        return [(level.title, level.route, level.scroll_y) for level in self.stack] if self.is_open else []
+
+    def back(self):
+        """Return to the previous level, or close at the top level."""
+        if len(self.stack) <= 1:
+            self.close()
+            return
+        self.stack.pop()
+        level = self.stack[-1]
+        self.menu.current_navigation_path = level.title
+        with tracing.span("nav.show", rows=len(level.items)):
+            self._show(level)
+        tracing.until_next_frame("nav.first_frame", level=level.title)
+
+    def close(self):
+        self._closing = True
+        if self.popup is not None:
+            self.popup.dismiss()
+
+    def _on_dismiss(self, popup):
+        # Tapping outside used to close just the topmost popup; keep that
+        if not self._closing and len(self.stack) > 1:
+            self.back()
+            return True
+        self._closing = False
+        self.stack.clear()
+        self.menu.prefetcher.cancel()
+        return False
+
+    def _retitle(self):
+        if self.stack:
+            level = self.stack[-1]
+            self.popup.title = self.menu._get_responsive_title(level.title)
+            self.header.text = self.menu._get_responsive_title(level.header)
+
+    def _show(self, level):
+        font_size = metrics.font(14)
+        self._retitle()
+
+        self.body.clear_widgets()
+        if level.items:
+            self.items_list.data = [
+                {'text': item.text, 'nav_action': item.action, 'thumb_key': item.thumb,
+                 'pill_color': level.color, 'font_size': font_size}
+                for item in level.items
+            ]
+            self.body.add_widget(self.items_list)
+            self.items_list.scroll_y = level.scroll_y
+        else:
+            self.items_list.data = []
+            self.empty_label.text = level.empty_text
+            self.body.add_widget(self.empty_label)
+        self.menu.prefetcher.show(level.route)
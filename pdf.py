@@ -0,0 +1,707 @@
+import io
+import math
+import mmap
+import re
+import zlib
+from collections import namedtuple
+
+import lessonpack
+from slides import MAX_DECODE_WIDTH, DecodedPage
+
+WHITESPACE = b" \t\r\n\f\x00"
+MAX_FORM_DEPTH = 6
+DEFAULT_GLYPH_WIDTH = 500  # thousandths of the font size, used without /Widths
+
+NUMBER_RE = re.compile(rb"[+-]?(?:\d+\.?\d*|\.\d+)")
+REF_RE = re.compile(rb"\s+(\d+)\s+R(?![A-Za-z])")
+OBJ_RE = re.compile(rb"(\d+)\s+(\d+)\s+obj(?![A-Za-z])")
+TOKEN_END_RE = re.compile(rb"[^\s()<>\[\]{}/%\x00]*")
+XREF_ROW_RE = re.compile(rb"\s*(\d+)\s+(\d+)\s+([nf])")
+
+Ref = namedtuple("Ref", ["num", "gen"])
+
+
+class PdfError(Exception):
+    """The file is not a PDF this reader can make sense of."""
+
+
+class Name(str):
+    """A PDF /Name (without the slash)."""
+
+
+class Keyword(str):
+    """A bare word: a content-stream operator, or obj/endobj/stream/R."""
+
+
+class Stream:
+    def __init__(self, attrs, raw):
+        self.attrs = attrs
+        self.raw = raw
+
+    def decoded(self):
+        """The stream body with any FlateDecode filters undone."""
+        filters = self.attrs.get("Filter")
+        filters = filters if isinstance(filters, list) else [filters] if filters else []
+        data = self.raw
+        for name in filters:
+            if name in ("FlateDecode", "Fl"):
+                data = zlib.decompressobj().decompress(data)
+            else:
+                break  # DCTDecode etc. are left for the caller
+        return data
+
+
+def _skip(data, pos):
+    end = len(data)
+    while pos < end:
+        c = data[pos]
+        if c in WHITESPACE:
+            pos += 1
+        elif c == 0x25:  # % comment
+            while pos < end and data[pos] not in b"\r\n":
+                pos += 1
+        else:
+            break
+    return pos
+
+
+def _literal(data, pos):
+    """Parse a (string) starting just after the opening parenthesis."""
+    out = bytearray()
+    depth = 1
+    end = len(data)
+    while pos < end:
+        c = data[pos]
+        pos += 1
+        if c == 0x5C:  # backslash
+            c = data[pos]
+            pos += 1
+            if c in b"01234567":
+                digits = bytes([c])
+                while len(digits) < 3 and data[pos] in b"01234567":
+                    digits += bytes([data[pos]])
+                    pos += 1
+                out.append(int(digits, 8) & 0xFF)
+            elif c in b"\r\n":
+                if c == 0x0D and data[pos] == 0x0A:
+                    pos += 1
+            else:
+                out += {0x6E: b"\n", 0x72: b"\r", 0x74: b"\t", 0x62: b"\b", 0x66: b"\f"}.get(c, bytes([c]))
+        elif c == 0x28:
+            depth += 1
+            out.append(c)
+        elif c == 0x29:
+            depth -= 1
+            if not depth:
+                break
+            out.append(c)
+        else:
+            out.append(c)
+    return bytes(out), pos
+
+
+def parse(data, pos):
+    """Parse one object at `pos`; returns (value, position after it)."""
+    pos = _skip(data, pos)
+    if pos >= len(data):
+        raise PdfError("unexpected end of data")
+    c = data[pos]
+    if c == 0x2F:  # /Name
+        match = TOKEN_END_RE.match(data, pos + 1)
+        raw = match.group()
+        if b"#" in raw:
+            raw = re.sub(rb"#([0-9A-Fa-f]{2})", lambda m: bytes([int(m.group(1), 16)]), raw)
+        return Name(raw.decode("latin-1")), match.end()
+    if c == 0x3C:  # << dict or <hex>
+        if data[pos + 1] == 0x3C:
+            pos += 2
+            result = {}
+            while True:
+                pos = _skip(data, pos)
+                if data[pos] == 0x3E:
+                    return result, pos + 2
+                key, pos = parse(data, pos)
+                value, pos = parse(data, pos)
+                result[key] = value
+        end = data.find(b">", pos)
+        digits = re.sub(rb"\s", b"", data[pos + 1:end])
+        if len(digits) % 2:
+            digits += b"0"
+        return bytes.fromhex(digits.decode("ascii")), end + 1
+    if c == 0x5B:  # [array]
+        pos += 1
+        result = []
+        while True:
+            pos = _skip(data, pos)
+            if data[pos] == 0x5D:
+                return result, pos + 1
+            value, pos = parse(data, pos)
+            result.append(value)
+    if c == 0x28:
+        return _literal(data, pos + 1)
+    match = NUMBER_RE.match(data, pos)
+    if match:
+        text = match.group()
+        if b"." in text:
+            return float(text), match.end()
+        ref = REF_RE.match(data, match.end())
+        if ref:
+            return Ref(int(text), int(ref.group(1))), ref.end()
+        return int(text), match.end()
+    match = TOKEN_END_RE.match(data, pos)
+    word = match.group()
+    if not word:
+        # A stray delimiter such as ")" or "}"; step over it
+        return Keyword(chr(c)), pos + 1
+    word = word.decode("latin-1")
+    if word == "true":
+        return True, match.end()
+    if word == "false":
+        return False, match.end()
+    if word == "null":
+        return None, match.end()
+    return Keyword(word), match.end()
+
+
+def _multiply(m, n):
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (a * a2 + b * c2, a * b2 + b * d2,
+            c * a2 + d * c2, c * b2 + d * d2,
+            e * a2 + f * c2 + e2, e * b2 + f * d2 + f2)
+
+
+def _parse_cmap(data):
+    """Code -> text from a ToUnicode CMap (bfchar and bfrange sections)."""
+    mapping = {}
+    text = data.decode("latin-1")
+    for block in re.findall(r"beginbfchar(.*?)endbfchar", text, re.S):
+        codes = re.findall(r"<([0-9A-Fa-f]+)>", block)
+        for src, dst in zip(codes[0::2], codes[1::2]):
+            mapping[int(src, 16)] = bytes.fromhex(dst).decode("utf-16-be", "replace")
+    for block in re.findall(r"beginbfrange(.*?)endbfrange", text, re.S):
+        for lo, hi, dst in re.findall(r"<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]+)>\s*(<[0-9A-Fa-f]+>|\[[^\]]*\])", block):
+            lo, hi = int(lo, 16), int(hi, 16)
+            if dst.startswith("["):
+                for offset, item in enumerate(re.findall(r"<([0-9A-Fa-f]+)>", dst)):
+                    mapping[lo + offset] = bytes.fromhex(item).decode("utf-16-be", "replace")
+            else:
+                start = int(dst[1:-1], 16)
+                for code in range(lo, min(hi, lo + 0xFFFF) + 1):
+                    mapping[code] = chr(start + code - lo) if start + code - lo < 0x110000 else ""
+    return mapping
+
+
+class Font:
+    """Just enough of a PDF font to turn string bytes into text and advances."""
+
+    def __init__(self, doc, attrs):
+        self.two_byte = attrs.get("Subtype") == "Type0"
+        self.unicode = None
+        cmap = doc.resolve(attrs.get("ToUnicode"))
+        if isinstance(cmap, Stream):
+            try:
+                self.unicode = _parse_cmap(cmap.decoded())
+            except (zlib.error, ValueError):
+                self.unicode = None
+        self.first_char = doc.resolve(attrs.get("FirstChar")) or 0
+        self.widths = doc.resolve(attrs.get("Widths")) or []
+        self.default_width = DEFAULT_GLYPH_WIDTH
+        self.cid_widths = {}
+        if self.two_byte:
+            descendants = doc.resolve(attrs.get("DescendantFonts")) or []
+            cid_font = doc.resolve(descendants[0]) if descendants else {}
+            self.default_width = doc.resolve(cid_font.get("DW")) or 1000
+            self.cid_widths = self._cid_widths(doc, doc.resolve(cid_font.get("W")) or [])
+
+    @staticmethod
+    def _cid_widths(doc, spec):
+        """Expand a CID font /W array: "c [w1 w2 ...]" and "first last w" entries."""
+        widths = {}
+        spec = [doc.resolve(item) for item in spec]
+        i = 0
+        while i < len(spec) - 1:
+            first, rest = spec[i], spec[i + 1]
+            if isinstance(rest, list):
+                for offset, width in enumerate(rest):
+                    widths[first + offset] = doc.resolve(width)
+                i += 2
+            elif i + 2 < len(spec):
+                for code in range(first, min(rest, first + 0xFFFF) + 1):
+                    widths[code] = spec[i + 2]
+                i += 3
+            else:
+                break
+        return widths
+
+    def codes(self, raw):
+        if self.two_byte:
+            return [(raw[i] << 8) | raw[i + 1] for i in range(0, len(raw) - 1, 2)]
+        return list(raw)
+
+    def text(self, codes):
+        if self.unicode is not None:
+            return "".join(self.unicode.get(code, "") for code in codes)
+        return bytes(code & 0xFF for code in codes).decode("cp1252", "replace")
+
+    def width(self, code):
+        """Glyph advance in thousandths of the font size."""
+        if self.two_byte:
+            return self.cid_widths.get(code, self.default_width)
+        index = code - self.first_char
+        if 0 <= index < len(self.widths):
+            width = self.widths[index]
+            if isinstance(width, (int, float)):
+                return width
+        return self.default_width
+
+
+class PdfDocument:
+    """Random access to the pages of one PDF.
+
+    The file is memory-mapped (or read in one go from the lesson pack) and
+    only the cross-reference table and the page tree are read up front; a page's content stream, fonts and images
+    are parsed when that page is asked for. Without a PDF rasteriser pages
+    are redrawn from their text runs and embedded pictures, which is what
+    lesson handouts consist of.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        if path.startswith(lessonpack.PACK_SCHEME):
+            # Packed PDFs are one blob: a single read, no temporary file
+            self._data = lessonpack.read_bytes(path)
+        else:
+            self._file = open(path, "rb")
+            try:
+                self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self._file.close()
+                raise PdfError("empty file")
+        self._offsets = {}      # object number -> file offset
+        self._in_streams = {}   # object number -> (object stream number, index)
+        self._objects = {}      # parsed non-stream objects
+        self._object_streams = {}
+        self._fonts = {}
+        self.trailer = {}
+        try:
+            try:
+                self._read_xref()
+            except (PdfError, ValueError, IndexError, zlib.error) as e:
+                print(f"Rebuilding cross-reference table of {path}: {e}")
+                self._scan_objects()
+            root = self.resolve(self.trailer.get("Root"))
+            if not isinstance(root, dict):
+                raise PdfError("no document catalog")
+            self.pages = []
+            self._collect_pages(root.get("Pages"), {}, set())
+        except Exception:
+            self.close()  # a corrupt file mustn't keep its map and handle open
+            raise
+
+    def __len__(self):
+        return len(self.pages)
+
+    def close(self):
+        self._object_streams.clear()
+        self._objects.clear()
+        if self._file is not None:
+            self._data.close()
+            self._file.close()
+
+    # Cross-reference table
+
+    def _read_xref(self):
+        tail = self._data[max(0, len(self._data) - 1024):]
+        start = tail.rfind(b"startxref")
+        if start == -1:
+            raise PdfError("no startxref")
+        offset = int(tail[start + 9:].split()[0])
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            trailer = self._read_xref_section(offset)
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            # Hybrid files keep the compressed objects in a separate xref stream
+            if isinstance(trailer.get("XRefStm"), int):
+                self._read_xref_section(trailer["XRefStm"])
+            offset = trailer.get("Prev")
+
+    def _read_xref_section(self, offset):
+        """Read one xref table or stream; newer sections win, so never overwrite."""
+        data = self._data
+        pos = _skip(data, offset)
+        if data[pos:pos + 4] == b"xref":
+            pos += 4
+            while True:
+                pos = _skip(data, pos)
+                if data[pos:pos + 7] == b"trailer":
+                    trailer, _ = parse(data, pos + 7)
+                    return trailer
+                first, pos = parse(data, pos)
+                count, pos = parse(data, pos)
+                for number in range(first, first + count):
+                    row = XREF_ROW_RE.match(data, pos)
+                    if not row:
+                        raise PdfError(f"bad xref row at {pos}")
+                    pos = row.end()
+                    if row.group(3) == b"n" and number not in self._offsets and number not in self._in_streams:
+                        self._offsets[number] = int(row.group(1))
+
+        stream = self._parse_indirect(offset)
+        if not isinstance(stream, Stream) or stream.attrs.get("Type") != "XRef":
+            raise PdfError(f"no xref at offset {offset}")
+        attrs = stream.attrs
+        widths = attrs["W"]
+        ranges = attrs.get("Index", [0, attrs["Size"]])
+        rows = stream.decoded()
+        pos = 0
+        for first, count in zip(ranges[0::2], ranges[1::2]):
+            for number in range(first, first + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(rows[pos:pos + width], "big") if width else None)
+                    pos += width
+                kind = 1 if fields[0] is None else fields[0]
+                if number in self._offsets or number in self._in_streams:
+                    continue
+                if kind == 1:
+                    self._offsets[number] = fields[1]
+                elif kind == 2:
+                    self._in_streams[number] = (fields[1], fields[2])
+        return attrs
+
+    def _scan_objects(self):
+        """Fallback for damaged files: find every "N G obj" by brute force."""
+        self._offsets.clear()
+        self._in_streams.clear()
+        for match in OBJ_RE.finditer(self._data):
+            self._offsets[int(match.group(1))] = match.start()
+        for match in re.finditer(rb"trailer", self._data):
+            try:
+                trailer, _ = parse(self._data, match.end())
+            except (PdfError, ValueError, IndexError):
+                continue
+            self.trailer.update(trailer)
+        if "Root" not in self.trailer:
+            for number in self._offsets:
+                value = self.get(number)
+                if isinstance(value, dict) and value.get("Type") == "Catalog":
+                    self.trailer["Root"] = Ref(number, 0)
+                    break
+
+    # Objects
+
+    def _parse_indirect(self, offset):
+        data = self._data
+        match = OBJ_RE.match(data, _skip(data, offset))
+        if not match:
+            raise PdfError(f"no object at offset {offset}")
+        value, pos = parse(data, match.end())
+        pos = _skip(data, pos)
+        if isinstance(value, dict) and data[pos:pos + 6] == b"stream":
+            pos += 6
+            if data[pos:pos + 2] == b"\r\n":
+                pos += 2
+            elif data[pos] in b"\r\n":
+                pos += 1
+            length = value.get("Length")
+            if isinstance(length, Ref):
+                length = self.get(length.num)
+            if not isinstance(length, int) or data[pos + length:pos + length + 20].find(b"endstream") == -1:
+                length = data.find(b"endstream", pos) - pos
+            # Slicing the map copies just this stream, never the whole file
+            return Stream(value, data[pos:pos + length])
+        return value
+
+    def get(self, number):
+        if number in self._objects:
+            return self._objects[number]
+        value = None
+        if number in self._offsets:
+            value = self._parse_indirect(self._offsets[number])
+        elif number in self._in_streams:
+            stream_number, index = self._in_streams[number]
+            value = self._object_stream(stream_number).get(number)
+        if not isinstance(value, Stream):
+            # Streams are re-read from the map so their bytes aren't pinned
+            self._objects[number] = value
+        return value
+
+    def _object_stream(self, number):
+        if number not in self._object_streams:
+            stream = self.get(number)
+            objects = {}
+            if isinstance(stream, Stream):
+                data = stream.decoded()
+                first = stream.attrs.get("First", 0)
+                header = data[:first].split()
+                for i in range(0, len(header) - 1, 2):
+                    value, _ = parse(data, first + int(header[i + 1]))
+                    objects[int(header[i])] = value
+            self._object_streams[number] = objects
+        return self._object_streams[number]
+
+    def resolve(self, value):
+        while isinstance(value, Ref):
+            value = self.get(value.num)
+        return value
+
+    # Page tree
+
+    def _collect_pages(self, node_ref, inherited, seen):
+        if isinstance(node_ref, Ref):
+            if node_ref.num in seen:
+                return
+            seen.add(node_ref.num)
+        node = self.resolve(node_ref)
+        if not isinstance(node, dict):
+            return
+        inherited = dict(inherited)
+        for key in ("Resources", "MediaBox", "CropBox", "Rotate"):
+            if key in node:
+                inherited[key] = node[key]
+        if node.get("Type") == "Pages" or "Kids" in node:
+            for kid in self.resolve(node.get("Kids")) or []:
+                self._collect_pages(kid, inherited, seen)
+        else:
+            page = dict(node)
+            page.update({k: v for k, v in inherited.items() if k not in node})
+            self.pages.append(page)
+
+    def _font(self, ref):
+        key = ref.num if isinstance(ref, Ref) else id(ref)
+        if key not in self._fonts:
+            attrs = self.resolve(ref)
+            self._fonts[key] = Font(self, attrs if isinstance(attrs, dict) else {})
+        return self._fonts[key]
+
+    # Rendering
+
+    def load_page(self, index, width_px, max_width=MAX_DECODE_WIDTH):
+        """Lay out page `index` and decode its pictures for a `width_px` wide view, `max_width` at most."""
+        from PIL import Image
+
+        page = self.pages[index]
+        box = [float(self.resolve(v)) for v in self.resolve(page.get("CropBox") or page.get("MediaBox"))
+               or [0, 0, 612, 792]]
+        x0, y0, x1, y1 = min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3])
+        page_width, page_height = (x1 - x0) or 612, (y1 - y0) or 792
+        scale = min(width_px, max_width) / page_width
+        # Flip to top-left origin pixels; page rotation is not applied
+        base = (scale, 0, 0, -scale, -x0 * scale, y1 * scale)
+
+        layout = _PageLayout(self, Image, scale)
+        contents = self.resolve(page.get("Contents"))
+        parts = contents if isinstance(contents, list) else [contents]
+        chunks = []
+        for part in parts:
+            stream = self.resolve(part)
+            if isinstance(stream, Stream):
+                chunks.append(stream.decoded())
+        layout.run(b"\n".join(chunks), self.resolve(page.get("Resources")) or {}, base)
+        return DecodedPage(
+            index, page_width * scale, page_height * scale, (1, 1, 1, 1),
+            layout.elements, layout.cost, {}
+        )
+
+
+class _PageLayout:
+    """Interprets a content stream into DecodedPage elements.
+
+    Only positioning, text and image operators matter here; paths are
+    skipped. Consecutive text on the same baseline is merged into one run
+    so each line becomes a single label.
+    """
+
+    def __init__(self, doc, Image, scale):
+        self.doc = doc
+        self.Image = Image
+        self.scale = scale
+        self.elements = []
+        self.cost = 0
+        self._line = None  # [x, baseline, right edge, size, color, parts]
+
+    def run(self, content, resources, ctm, depth=0):
+        doc = self.doc
+        fonts = doc.resolve(resources.get("Font")) or {}
+        xobjects = doc.resolve(resources.get("XObject")) or {}
+        stack = []
+        color = (0, 0, 0, 1)
+        font, size, leading = None, 0, 0
+        tm = lm = (1, 0, 0, 1, 0, 0)
+        h_scale, rise, char_space, word_space = 1.0, 0, 0, 0
+        operands = []
+        pos, end = 0, len(content)
+        while True:
+            pos = _skip(content, pos)
+            if pos >= end:
+                break
+            try:
+                value, pos = parse(content, pos)
+            except (PdfError, ValueError, IndexError):
+                break
+            if not isinstance(value, Keyword):
+                operands.append(value)
+                continue
+            op, args = value, operands
+            operands = []
+            try:
+                if op == "q":
+                    stack.append((ctm, color, font, size, leading))
+                elif op == "Q":
+                    if stack:
+                        ctm, color, font, size, leading = stack.pop()
+                elif op == "cm":
+                    ctm = _multiply(tuple(args[-6:]), ctm)
+                elif op in ("rg", "g", "k", "sc", "scn"):
+                    color = self._color(op, args, color)
+                elif op == "BT":
+                    tm = lm = (1, 0, 0, 1, 0, 0)
+                elif op == "Tf":
+                    font, size = doc._font(fonts.get(args[0])), args[1]
+                elif op == "TL":
+                    leading = args[0]
+                elif op == "Tz":
+                    h_scale = args[0] / 100
+                elif op == "Ts":
+                    rise = args[0]
+                elif op == "Tc":
+                    char_space = args[0]
+                elif op == "Tw":
+                    word_space = args[0]
+                elif op in ("Td", "TD"):
+                    if op == "TD":
+                        leading = -args[1]
+                    tm = lm = _multiply((1, 0, 0, 1, args[0], args[1]), lm)
+                elif op == "Tm":
+                    tm = lm = tuple(args[:6])
+                elif op == "T*":
+                    tm = lm = _multiply((1, 0, 0, 1, 0, -leading), lm)
+                elif op in ("Tj", "'", '"', "TJ") and font is not None:
+                    if op in ("'", '"'):
+                        if op == '"':
+                            word_space, char_space = args[0], args[1]
+                        tm = lm = _multiply((1, 0, 0, 1, 0, -leading), lm)
+                    items = args[-1] if op == "TJ" else [args[-1]]
+                    for item in items:
+                        if isinstance(item, (int, float)):
+                            tm = _multiply((1, 0, 0, 1, -item / 1000 * size * h_scale, 0), tm)
+                        elif isinstance(item, bytes):
+                            codes = font.codes(item)
+                            trm = _multiply(_multiply((size * h_scale, 0, 0, size, 0, rise), tm), ctm)
+                            advance = sum(font.width(code) / 1000 * size + char_space
+                                          + (word_space if code == 32 and not font.two_byte else 0)
+                                          for code in codes) * h_scale
+                            end_tm = _multiply((1, 0, 0, 1, advance, 0), tm)
+                            self._add_text(font.text(codes), trm, _multiply(end_tm, ctm)[4], color)
+                            tm = end_tm
+                elif op == "Do":
+                    self._draw_xobject(doc.resolve(xobjects.get(args[0])), ctm, depth)
+                elif op == "BI":
+                    # Inline images are skipped wholesale
+                    close = content.find(b"EI", pos)
+                    while close != -1 and not (content[close - 1:close] in b" \t\r\n" and
+                                               content[close + 2:close + 3] in b" \t\r\n"):
+                        close = content.find(b"EI", close + 2)
+                    pos = end if close == -1 else close + 2
+            except (IndexError, TypeError, KeyError, ValueError, ZeroDivisionError):
+                continue  # one malformed operator shouldn't lose the page
+        self._flush()
+
+    @staticmethod
+    def _color(op, args, current):
+        numbers = [a for a in args if isinstance(a, (int, float))]
+        if len(numbers) == 1:
+            return (numbers[0], numbers[0], numbers[0], 1)
+        if len(numbers) == 3:
+            return (numbers[0], numbers[1], numbers[2], 1)
+        if len(numbers) == 4:
+            c, m, y, k = numbers
+            return ((1 - c) * (1 - k), (1 - m) * (1 - k), (1 - y) * (1 - k), 1)
+        return current
+
+    def _add_text(self, text, trm, right, color):
+        if not text:
+            return
+        x, baseline = trm[4], trm[5]
+        size = math.hypot(trm[2], trm[3])
+        if size < 1:
+            return
+        line = self._line
+        if (line is not None and abs(baseline - line[1]) < size * 0.3 and abs(size - line[3]) < size * 0.2
+                and -size < x - line[2] < size * 3):
+            if x - line[2] > size * 0.2 and not line[5][-1].endswith(" ") and not text.startswith(" "):
+                line[5].append(" ")
+            line[5].append(text)
+            line[2] = max(line[2], right)
+            return
+        self._flush()
+        self._line = [x, baseline, max(right, x), size, color, [text]]
+
+    def _flush(self):
+        line, self._line = self._line, None
+        if line is None:
+            return
+        x, baseline, right, size, color, parts = line
+        text = "".join(parts).rstrip()
+        if not text.strip():
+            return
+        # Kivy's font is usually wider than the PDF's, so leave room to spare
+        width = (right - x) * 1.25 + size
+        self.elements.append(("text", (x, baseline - size, width, size * 1.3), text, size, color, False))
+
+    def _draw_xobject(self, xobject, ctm, depth):
+        if not isinstance(xobject, Stream):
+            return
+        attrs = xobject.attrs
+        if attrs.get("Subtype") == "Form" and depth < MAX_FORM_DEPTH:
+            self._flush()
+            matrix = tuple(self.doc.resolve(attrs.get("Matrix")) or (1, 0, 0, 1, 0, 0))
+            resources = self.doc.resolve(attrs.get("Resources")) or {}
+            self.run(xobject.decoded(), resources, _multiply(matrix, ctm), depth + 1)
+        elif attrs.get("Subtype") == "Image":
+            # The image fills the unit square mapped through the CTM
+            corners = [(ctm[0] * u + ctm[2] * v + ctm[4], ctm[1] * u + ctm[3] * v + ctm[5])
+                       for u, v in ((0, 0), (1, 0), (0, 1), (1, 1))]
+            xs, ys = [c[0] for c in corners], [c[1] for c in corners]
+            box = (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+            if box[2] < 1 or box[3] < 1:
+                return
+            pixels = self._decode_image(attrs, xobject, box)
+            if pixels:
+                self._flush()
+                self.elements.append(("picture", box, pixels))
+                self.cost += len(pixels[2])
+
+    def _decode_image(self, attrs, xobject, box):
+        Image = self.Image
+        doc = self.doc
+        filters = doc.resolve(attrs.get("Filter"))
+        filters = filters if isinstance(filters, list) else [filters] if filters else []
+        width, height = doc.resolve(attrs.get("Width")), doc.resolve(attrs.get("Height"))
+        try:
+            if filters and filters[-1] in ("DCTDecode", "DCT"):
+                data = xobject.raw if len(filters) == 1 else zlib.decompress(xobject.raw)
+                image = Image.open(io.BytesIO(data))
+            elif filters and filters[-1] not in ("FlateDecode", "Fl"):
+                return None  # JPX, CCITT and JBIG2 need decoders we don't ship
+            else:
+                space = doc.resolve(attrs.get("ColorSpace"))
+                if isinstance(space, list):
+                    space = space[0]
+                mode = {"DeviceRGB": "RGB", "DeviceGray": "L", "CalRGB": "RGB", "CalGray": "L"}.get(space)
+                if mode is None or doc.resolve(attrs.get("BitsPerComponent")) != 8:
+                    return None
+                image = Image.frombytes(mode, (width, height), xobject.decoded())
+            # Decode no larger than the picture appears on the page
+            size = (max(1, int(box[2])), max(1, int(box[3])))
+            image.draft("RGBA", size)
+            image = image.convert("RGBA").resize(size)
+        except (OSError, ValueError, zlib.error, TypeError) as e:
+            print(f"Skipping PDF image: {e}")
+            return None
+        return image.width, image.height, image.tobytes()
+
@@ -0,0 +1,199 @@
+"""Warms what the next tap will need while the user is still choosing.
+
+Listings already come from the in-memory catalog, so what a tap still
+waits on is disk: the previews on a week's file list and the zip
+directory (or PDF cross-reference table) read when a lesson is opened.
+With a subject's weeks on screen, the first rows' previews of every week
+are produced and each week's first lesson is opened; with a file list on
+screen, its first lessons are opened. Opened documents are handed to the
+next open of the same file.
+
+All of it runs as PREFETCH jobs, behind visible thumbnails, within a
+memory and I/O budget, and whatever the previous level asked for is
+cancelled as soon as another level is shown or the popup closes.
+"""
+import os
+from collections import OrderedDict
+from threading import Lock
+
+import lessonpack
+from jobs import PREFETCH
+from thumbnails import ThumbnailLoader
+
+ROWS_AHEAD = 6        # rows of a file list on screen without scrolling
+OPEN_AHEAD = 2        # lessons opened ahead on a file list
+MAX_DOCUMENTS = 8     # opened documents kept; each holds a file handle or mapping
+IO_BUDGET = 32 * 1024 * 1024  # bytes of lesson files one level may read ahead
+THUMBNAIL_SHARE = 0.5  # of the thumbnail memory budget prefetched previews may fill
+VIEWER_KINDS = ("pptx", "pdf")
+
+
+def open_document(path, kind):
+    """The lesson's pre-rendered pages, else a SlideDeck or PdfDocument, for the in-app viewer."""
+    from renders import open_rendered
+
+    document = open_rendered(path)
+    if document is not None:
+        return document
+    if kind == "pptx":
+        from slides import SlideDeck
+
+        return SlideDeck(path)
+    from pdf import PdfDocument
+
+    return PdfDocument(path)
+
+
+def _stamp(path):
+    """(size, mtime) of a loose file; packed entries never change."""
+    if path.startswith(lessonpack.PACK_SCHEME):
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+
+class Prefetcher:
+    """Guesses the next tap from the navigation level on screen.
+
+    `show(route)` is called with each level's route: () for quarters,
+    (quarter,), (quarter, subject) and (quarter, subject, week), or None
+    once the popup closes.
+    """
+
+    def __init__(self, catalog, thumbnails, pool, extensions=(".pptx", ".pdf")):
+        self.catalog = catalog
+        self.thumbnails = thumbnails
+        self.pool = pool
+        self.extensions = extensions
+        self.route = None
+        self._thumbs = set()   # thumbnail keys asked for by the current level
+        self._opens = {}       # abs path -> Job, for the current level
+        self._documents = OrderedDict()  # abs path -> (stamp, document, bytes held), least recent first
+        self._lock = Lock()
+
+    def show(self, route):
+        """Warm what can be tapped from the level at `route`; drop the previous level's work."""
+        if route == self.route:
+            return
+        self.route = route
+        thumbs, opens = self._plan(route)
+        wanted = {ThumbnailLoader.key_for(self.catalog.abs_path(e), e.size, e.mtime, e.kind) for e in thumbs}
+        for key in self._thumbs - wanted:
+            self.thumbnails.cancel(key, self._thumb_ready)
+        paths = {self.catalog.abs_path(e): e for e in opens}
+        for path in [p for p in self._opens if p not in paths]:
+            self._opens.pop(path).cancel()
+
+        self._thumbs &= wanted
+        for entry in thumbs:
+            key = ThumbnailLoader.key_for(self.catalog.abs_path(entry), entry.size, entry.mtime, entry.kind)
+            if key in self._thumbs or self.thumbnails.has(key):
+                continue
+            self._thumbs.add(key)
+            self.thumbnails.request(key, self._thumb_ready, priority=PREFETCH)
+        for path, entry in paths.items():
+            with self._lock:
+                if path in self._opens or path in self._documents:
+                    continue
+            self._opens[path] = self.pool.submit(
+                self._open_ahead, path, entry.kind, entry.size,
+                priority=PREFETCH,
+                key=("prefetch", path),
+                on_done=lambda result, p=path: self._opens.pop(p, None),
+                on_error=lambda e, p=path: self._open_failed(p, e)
+            )
+
+    def cancel(self):
+        self.show(None)
+
+    @property
+    def memory_used(self):
+        """Bytes of the lessons opened ahead, mapped or read."""
+        with self._lock:
+            return sum(cost for _, _, cost in self._documents.values())
+
+    def trim_memory(self, target):
+        """Close the documents opened longest ago until at most `target` bytes of them are held; 0 closes them all."""
+        closed = []
+        with self._lock:
+            held = sum(cost for _, _, cost in self._documents.values())
+            while self._documents and (held > target or not target):
+                _, document, cost = self._documents.popitem(last=False)[1]
+                closed.append(document)
+                held -= cost
+        for document in closed:
+            document.close()
+
+    @property
+    def busy(self):
+        """Whether anything asked for by the current level is still on its way."""
+        return bool(self._thumbs or self._opens)
+
+    def _plan(self, route):
+        """(entries to preview, entries to open) for `route`, most likely first, within budget."""
+        if not route or len(route) < 2:
+            return [], []
+        quarter, subject = route[:2]
+        if len(route) == 2:
+            weeks = [self.catalog.files(quarter, subject, week, self.extensions)
+                     for week in self.catalog.weeks(quarter, subject)]
+        else:
+            weeks = [self.catalog.files(quarter, subject, route[2], self.extensions)]
+
+        thumb_cost = self.thumbnails.size[0] * self.thumbnails.size[1] * 4
+        thumbs_left = int(self.thumbnails.memory_budget * THUMBNAIL_SHARE / thumb_cost)
+        io_left = IO_BUDGET
+        thumbs, opens = [], []
+        for files in weeks:
+            files = [e for e in files if e.kind in VIEWER_KINDS]
+            # A file list's own rows already request their previews
+            for entry in files[:ROWS_AHEAD] if len(route) == 2 else ():
+                if thumbs_left <= 0 or entry.size > io_left:
+                    break
+                thumbs.append(entry)
+                thumbs_left -= 1
+                io_left -= entry.size
+            for entry in files[:1 if len(route) == 2 else OPEN_AHEAD]:
+                if len(opens) >= MAX_DOCUMENTS or entry.size > io_left:
+                    break
+                opens.append(entry)
+                io_left -= entry.size
+        return thumbs, opens
+
+    def _thumb_ready(self, key, texture):
+        self._thumbs.discard(key)
+
+    def _open_failed(self, path, error):
+        # Opening it for real will fail too, and report it then
+        self._opens.pop(path, None)
+        print(f"Could not open {path} ahead: {error}")
+
+    # Worker threads
+
+    def _open_ahead(self, path, kind, size):
+        from renders import RenderedDeck
+
+        stamp = _stamp(path)
+        document = open_document(path, kind)
+        # Pre-rendered pages are read as they are shown; a deck or PDF keeps its file mapped
+        cost = 0 if isinstance(document, RenderedDeck) else size
+        with self._lock:
+            previous = self._documents.pop(path, None)
+            self._documents[path] = (stamp, document, cost)
+            evicted = [previous[1]] if previous else []
+            while len(self._documents) > MAX_DOCUMENTS:
+                evicted.append(self._documents.popitem(last=False)[1][1])
+        for old in evicted:
+            old.close()
+
+    def take(self, path):
+        """The document opened ahead for `path`, now owned by the caller, or None."""
+        with self._lock:
+            stamp, document, _ = self._documents.pop(path, (None, None, 0))
+        if document is not None and stamp != _stamp(path):
+            document.close()  # the file changed since
+            return None
+        return document
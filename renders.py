@@ -0,0 +1,309 @@
+"""Lesson slides pre-rendered to images at build time.
+
+    python renders.py [GregorELibrary] [--output GregorELibrary.slides] [--jobs N] [--full]
+
+Opening a lesson on a weak phone is mostly parsing slide XML and
+decoding pictures. This build step lays out every page of every .pptx
+and PDF with the app's own parsers (slides.py, pdf.py), flattens it
+into one picture and writes it as WebP at each of DENSITIES: the width
+of a REFERENCE_WIDTH dp screen on mdpi, hdpi, xhdpi and xxhdpi phones.
+The app then shows a page by decoding the one image closest to its
+screen width.
+
+The output folder holds:
+
+    index.json              library path -> [size, mtime, sha256] of each file rendered
+    <sha256>/manifest.json  kind, page count and the widths rendered
+    <sha256>/<width>/<page>.webp
+
+Renders are keyed by content, so identical decks are rendered once, and
+a rebuild renders only content it has not seen; files whose size and
+mtime match the index aren't even hashed again. Files are rendered in a
+process pool across all cores. A lesson whose file no longer matches the
+index is opened by parsing it, as without renders.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from threading import Lock
+
+import lessonpack
+import tiles
+from catalog import LIBRARY_DIR, RENDER_DIR, detect_kind
+from slides import MAX_DECODE_WIDTH, DecodedPage
+
+RENDER_VERSION = 2  # bump when rendering changes, so everything is redone
+INDEX_FILE = "index.json"
+MANIFEST_FILE = "manifest.json"
+REFERENCE_WIDTH = 360  # dp; responsive.REFERENCE_WIDTH, the phone screen layouts are designed for
+DENSITIES = (1, 1.5, 2, 3)  # Kivy's dp() scale on mdpi, hdpi, xhdpi and xxhdpi screens
+WEBP_QUALITY = 80
+RENDER_KINDS = ("pptx", "pdf")
+HASH_CHUNK = 1024 * 1024
+
+
+def widths():
+    """Rendered image widths in pixels, smallest first."""
+    return sorted({min(round(REFERENCE_WIDTH * density), MAX_DECODE_WIDTH) for density in DENSITIES})
+
+
+# Rendering (build time)
+
+def flatten(page):
+    """Draw a DecodedPage, pictures and text, into one RGB Pillow image."""
+    return tiles.draw(page)
+
+
+def _open(path, kind):
+    if kind == "pptx":
+        from slides import SlideDeck
+
+        return SlideDeck(path)
+    from pdf import PdfDocument
+
+    return PdfDocument(path)
+
+
+def render_file(task):
+    """Render one file at every width; runs in a worker process.
+
+    `task` is (path, kind, folder). Images are written to a temporary
+    folder that replaces `folder` once complete. Returns (folder, pages,
+    error message or None).
+    """
+    from PIL import Image
+
+    path, kind, folder = task
+    tmp_folder = f"{folder}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    sizes = widths()
+    try:
+        document = _open(path, kind)
+        try:
+            for width in sizes:
+                os.makedirs(os.path.join(tmp_folder, str(width)))
+            for index in range(len(document)):
+                # Laid out once at the biggest size; smaller ones are scaled from it
+                image = flatten(document.load_page(index, sizes[-1]))
+                for width in sizes:
+                    height = max(1, round(image.height * width / image.width))
+                    scaled = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                    scaled.save(os.path.join(tmp_folder, str(width), f"{index + 1}.webp"),
+                                "WEBP", quality=WEBP_QUALITY, method=4)
+            pages = len(document)
+        finally:
+            document.close()
+        manifest = {"version": RENDER_VERSION, "kind": kind, "pages": pages, "widths": sizes}
+        with open(os.path.join(tmp_folder, MANIFEST_FILE), "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp_folder, folder)
+    except Exception as e:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        return folder, None, f"{type(e).__name__}: {e}"
+    return folder, pages, None
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _rendered(folder):
+    return _read_json(os.path.join(folder, MANIFEST_FILE)).get("version") == RENDER_VERSION
+
+
+def build(root, target=RENDER_DIR, jobs=None, full=False):
+    """Render every lesson under `root` that `target` doesn't hold yet; returns a summary."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    start = time.perf_counter()
+    index = _read_json(os.path.join(target, INDEX_FILE))
+    previous = index.get("files", {}) if index.get("version") == RENDER_VERSION and not full else {}
+    files = {}  # library path -> [size, mtime, sha256]
+    tasks = {}  # sha256 -> (path, kind, folder)
+    for folder, dirs, names in os.walk(root):
+        dirs.sort()
+        for name in sorted(names):
+            full_path = os.path.join(folder, name)
+            kind = detect_kind(full_path, name)
+            if kind not in RENDER_KINDS:
+                continue
+            rel = os.path.relpath(full_path, root).replace(os.sep, "/")
+            st = os.stat(full_path)
+            old = previous.get(rel)
+            digest = old[2] if old and old[:2] == [st.st_size, st.st_mtime] else _sha256(full_path)
+            files[rel] = [st.st_size, st.st_mtime, digest]
+            out = os.path.join(target, digest)
+            if digest not in tasks and (full or not _rendered(out)):
+                tasks[digest] = (full_path, kind, out)
+
+    os.makedirs(target, exist_ok=True)
+    if len(tasks) <= 1 or jobs == 1:
+        results = list(map(render_file, tasks.values()))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # One file per task: decks vary too much in size for bigger chunks
+            results = list(pool.map(render_file, tasks.values(), chunksize=1))
+    failed = set()
+    pages = 0
+    for folder, count, error in results:
+        digest = os.path.basename(folder)
+        if error is not None:
+            failed.add(digest)
+            print(f"Could not render {tasks[digest][0]}: {error}")
+        else:
+            pages += count
+
+    # Files that failed are left to the app to parse; renders nothing points at are deleted
+    files = {rel: info for rel, info in files.items() if info[2] not in failed}
+    kept = {info[2] for info in files.values()}
+    removed = 0
+    for name in os.listdir(target):
+        path = os.path.join(target, name)
+        if os.path.isdir(path) and name not in kept:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    tmp_path = os.path.join(target, INDEX_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump({"version": RENDER_VERSION, "root": os.path.abspath(root), "widths": widths(),
+                   "files": dict(sorted(files.items()))}, fh, indent=1)
+    os.replace(tmp_path, os.path.join(target, INDEX_FILE))
+    return {"files": len(files), "rendered": len(tasks) - len(failed), "failed": len(failed),
+            "pages": pages, "removed": removed, "seconds": round(time.perf_counter() - start, 2)}
+
+
+# Showing (run time)
+
+class RenderedDeck:
+    """A lesson's pre-rendered pages, opened like a SlideDeck or PdfDocument."""
+
+    def __init__(self, path, folder, manifest):
+        self.path = path
+        self.folder = folder
+        self.kind = manifest.get("kind") or ("pdf" if path.lower().endswith(".pdf") else "pptx")
+        self.pages = manifest["pages"]
+        self.widths = sorted(manifest["widths"])
+        self._source = None  # the lesson itself, opened for zooming in
+
+    def __len__(self):
+        return self.pages
+
+    def close(self):
+        if self._source is not None:
+            self._source.close()
+
+    def load_page(self, index, width_px, max_width=MAX_DECODE_WIDTH):
+        """Decode page `index` from the smallest render at least `width_px` wide.
+
+        Pages wider than MAX_DECODE_WIDTH, wanted for zooming in, are laid
+        out from the lesson itself so their text stays sharp.
+        """
+        from PIL import Image
+
+        if max_width > MAX_DECODE_WIDTH:
+            if self._source is None:
+                self._source = _open(self.path, self.kind)
+            return self._source.load_page(index, width_px, max_width)
+        width = next((width for width in self.widths if width >= width_px), self.widths[-1])
+        with Image.open(os.path.join(self.folder, str(width), f"{index + 1}.webp")) as image:
+            width, height = image.size
+            rgba = image.convert("RGBA").tobytes()
+        return DecodedPage(index, width, height, (1, 1, 1, 1),
+                           [("picture", (0, 0, width, height), (width, height, rgba))], len(rgba), {})
+
+
+class RenderSet:
+    """The renders in `folder` of the library at `root`; the index is read on first use."""
+
+    def __init__(self, folder=RENDER_DIR, root=LIBRARY_DIR):
+        self.folder = folder
+        self.root = root
+        self._files = None
+        self._lock = Lock()
+
+    def _index(self):
+        with self._lock:
+            if self._files is None:
+                index = _read_json(os.path.join(self.folder, INDEX_FILE))
+                self._files = index.get("files", {}) if index.get("version") == RENDER_VERSION else {}
+            return self._files
+
+    def open(self, path):
+        """A RenderedDeck for the lesson at `path` if it was rendered from this very
+        version of the file, else None."""
+        files = self._index()
+        if not files:
+            return None
+        try:
+            if path.startswith(lessonpack.PACK_SCHEME):
+                rel = path[len(lessonpack.PACK_SCHEME):]
+                entry = lessonpack.active().entry(rel)
+                stamp = [entry.size, entry.mtime]
+            else:
+                rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+                st = os.stat(path)
+                stamp = [st.st_size, st.st_mtime]
+        except (OSError, KeyError, AttributeError):
+            return None
+        info = files.get(rel)
+        if info is None or info[:2] != stamp:
+            return None
+        folder = os.path.join(self.folder, info[2])
+        manifest = _read_json(os.path.join(folder, MANIFEST_FILE))
+        if manifest.get("version") != RENDER_VERSION or not manifest.get("widths"):
+            return None
+        return RenderedDeck(path, folder, manifest)
+
+
+_active = None  # the RenderSet lessons are looked up in
+
+
+def use(render_set):
+    """Make `render_set` the one open_rendered() looks in."""
+    global _active
+    _active = render_set
+
+
+def open_rendered(path):
+    """The pre-rendered pages of the lesson at `path`, or None."""
+    return _active.open(path) if _active is not None else None
+
+
+def main(argv):
+    def option(flag, default):
+        return argv[argv.index(flag) + 1] if flag in argv else default
+
+    values = {argv[i + 1] for i, arg in enumerate(argv[:-1]) if arg in ("--output", "--jobs")}
+    positional = [arg for arg in argv[1:] if not arg.startswith("--") and arg not in values]
+    root = positional[0] if positional else LIBRARY_DIR
+    if not os.path.isdir(root):
+        print(f"No library at {root}")
+        return 2
+    target = option("--output", RENDER_DIR)
+    jobs = option("--jobs", None)
+    summary = build(root, target, int(jobs) if jobs else None, "--full" in argv)
+    size = sum(os.path.getsize(os.path.join(folder, name))
+               for folder, _, names in os.walk(target) for name in names)
+    print(f"{summary['files']} lessons, {summary['rendered']} rendered ({summary['pages']} pages), "
+          f"{summary['failed']} failed, {summary['removed']} stale renders removed "
+          f"in {summary['seconds']} s; {size} bytes in {target}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
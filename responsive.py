@@ -0,0 +1,79 @@
+"""Font sizes that follow the window size.
+
+Scale factors are computed once per window size and cached. Widgets
+register a property with `metrics.bind(widget, prop, base_size)`; any
+number of resize events within a frame (a rotation, a split-screen
+divider being dragged) schedule a single update for the next frame,
+which resets every registered property and then calls the listeners.
+Font sizes only follow the smaller side, so a rotation keeps them, but
+the listeners still run: some of them lay out by the window's width.
+"""
+import weakref
+
+from kivy.clock import Clock
+from kivy.core.window import Window
+from kivy.metrics import sp
+
+# Base sizes are designed for a window this many pixels across (a common phone)
+REFERENCE_WIDTH = 360
+FONT_SCALE = 0.7
+
+
+class LayoutMetrics:
+    def __init__(self):
+        self._dimension = None  # smaller window side the cache was built for
+        self._size = None       # window size the listeners last ran for
+        self._fonts = {}        # base size -> font size
+        self._bound = weakref.WeakKeyDictionary()  # widget -> {property: base size}
+        self._listeners = []    # weak references to callables
+        self._trigger = Clock.create_trigger(self._apply, 0)
+        Window.bind(size=lambda window, size: self._trigger())
+
+    def font(self, base_size):
+        """Font size for `base_size` at the current window size."""
+        if self._dimension is None:
+            self._dimension = min(Window.width, Window.height)
+        size = self._fonts.get(base_size)
+        if size is None:
+            size = self._fonts[base_size] = sp(base_size * (self._dimension / REFERENCE_WIDTH) * FONT_SCALE)
+        return size
+
+    def bind(self, widget, prop="font_size", base_size=14):
+        """Set `widget.prop` now and keep it scaled; the widget is held weakly."""
+        self._bound.setdefault(widget, {})[prop] = base_size
+        setattr(widget, prop, self.font(base_size))
+        return widget
+
+    def listen(self, callback):
+        """Call `callback()` after each size change, rotations included, for
+        layouts bind() can't express.
+
+        Bound methods are held weakly, so listening doesn't keep a popup alive.
+        """
+        if hasattr(callback, "__self__"):
+            self._listeners.append(weakref.WeakMethod(callback))
+        else:
+            self._listeners.append(lambda: callback)
+
+    def _apply(self, *args):
+        size = tuple(Window.size)
+        if size == self._size:
+            return
+        self._size = size
+        dimension = min(size)
+        if dimension != self._dimension:  # not after a rotation: same font sizes
+            self._dimension = dimension
+            self._fonts.clear()
+            for widget, props in list(self._bound.items()):
+                for prop, base_size in props.items():
+                    setattr(widget, prop, self.font(base_size))
+        alive = []
+        for ref in self._listeners:
+            callback = ref()
+            if callback is not None:
+                callback()
+                alive.append(ref)
+        self._listeners = alive
+
+
+metrics = LayoutMetrics()
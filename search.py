@@ -0,0 +1,208 @@
+import bisect
+import json
+import math
+import os
+import re
+from collections import deque
+from threading import Lock
+
+from catalog import parse_route
+from extraction import EXTRACTORS, extract_many
+
+INDEX_VERSION = 2  # 2: speaker notes are indexed
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Matches on the file and folder names count more than matches in the body
+NAME_WEIGHT = 3
+
+# BM25 tuning; the usual defaults work well for short slide texts
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) > 1]
+
+
+class SearchIndex:
+    """BM25-ranked inverted index over the lesson files in a Catalog.
+
+    `update()` is meant to run on a background thread; `search()` is cheap
+    and safe to call from the UI thread at any time, even mid-update.
+    """
+
+    def __init__(self, index_path=None):
+        self.index_path = index_path
+        self._lock = Lock()
+        self._save_lock = Lock()  # one save at a time, without holding up search()
+        self._docs = {}      # path -> {"size", "mtime", "length", "terms": {term: tf}}
+        self._postings = {}  # term -> {path: tf}
+        self._terms = []     # sorted vocabulary, for prefix lookups
+        self._total_length = 0
+        self.ready = False
+
+    def load(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != INDEX_VERSION:
+            return False
+        with self._lock:
+            self._docs = data["docs"]
+            self._postings = {}
+            self._total_length = 0
+            for path, doc in self._docs.items():
+                self._add_postings(path, doc)
+            self._terms = sorted(self._postings)
+            self.ready = True
+        return True
+
+    def save(self):
+        if not self.index_path:
+            return
+        with self._save_lock:
+            # Docs are replaced, never changed in place, so a shallow copy is a snapshot
+            with self._lock:
+                data = {"version": INDEX_VERSION, "docs": dict(self._docs)}
+            folder = os.path.dirname(self.index_path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as fh:
+                    # dumps, not dump: only the one-shot encoder is the fast C one
+                    fh.write(json.dumps(data, separators=(",", ":")))
+                os.replace(tmp_path, self.index_path)
+            except OSError as e:
+                print(f"Could not save search index: {e}")
+
+    def update(self, catalog, workers=1):
+        """Index new or changed catalog entries and drop deleted ones.
+
+        Text is streamed a slide at a time and counted as it comes, so a
+        huge deck never sits in memory whole; `workers` > 1 extracts in
+        that many processes (see extraction.extract_many). Returns the
+        number of documents that changed.
+        """
+        wanted = {e.path: e for e in catalog.entries() if e.kind in EXTRACTORS}
+        stale = [p for p, d in self._docs.items()
+                 if p not in wanted or (d["size"], d["mtime"]) != (wanted[p].size, wanted[p].mtime)]
+        fresh = [e for p, e in wanted.items()
+                 if p not in self._docs or p in stale]
+
+        for path in stale:
+            with self._lock:
+                self._remove(path)
+
+        by_path = {catalog.abs_path(e): e for e in fresh}
+        pending = deque(by_path)  # files yield records in this order; some yield none
+        current, terms = None, {}
+        # Extraction is the slow part, so it runs without holding the lock
+        for record in extract_many([(path, by_path[path].kind) for path in pending], workers):
+            if record.file != current:
+                while pending[0] != record.file:
+                    self._store(by_path[pending.popleft()], {})
+                if current is not None:
+                    self._store(by_path[current], terms)
+                pending.popleft()
+                current, terms = record.file, {}
+            for text in (record.text, record.notes):
+                for token in tokenize(text):
+                    terms[token] = terms.get(token, 0) + 1
+        if current is not None:
+            self._store(by_path[current], terms)
+        for path in pending:
+            self._store(by_path[path], {})
+
+        with self._lock:
+            if stale or fresh:
+                self._terms = sorted(self._postings)
+            self.ready = True
+        if stale or fresh:
+            self.save()
+        return len(set(stale) | {e.path for e in fresh})
+
+    def _store(self, entry, terms):
+        """Add `entry` with its body term counts `terms` (taken over) to the index."""
+        doc = self._make_doc(entry, terms)
+        with self._lock:
+            self._docs[entry.path] = doc
+            self._add_postings(entry.path, doc)
+
+    def _make_doc(self, entry, terms):
+        for token in tokenize(entry.path.replace("/", " ")):
+            terms[token] = terms.get(token, 0) + NAME_WEIGHT
+        return {
+            "size": entry.size,
+            "mtime": entry.mtime,
+            "length": sum(terms.values()),
+            "terms": terms,
+        }
+
+    def _add_postings(self, path, doc):
+        for term, tf in doc["terms"].items():
+            self._postings.setdefault(term, {})[path] = tf
+        self._total_length += doc["length"]
+
+    def _remove(self, path):
+        doc = self._docs.pop(path, None)
+        if doc is None:
+            return
+        for term in doc["terms"]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(path, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= doc["length"]
+
+    def _expand(self, token):
+        """All vocabulary terms starting with `token` (for search-as-you-type)."""
+        start = bisect.bisect_left(self._terms, token)
+        matches = []
+        for term in self._terms[start:]:
+            if not term.startswith(token):
+                break
+            matches.append(term)
+        return matches
+
+    def search(self, query, limit=20):
+        """Return up to `limit` (path, score) pairs, best first.
+
+        Every query token must match; the last one also matches as a prefix
+        so results appear while the word is still being typed.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+            scores = None
+            for i, token in enumerate(tokens):
+                terms = self._expand(token) if i == len(tokens) - 1 else [token]
+                token_scores = {}
+                for term in terms:
+                    postings = self._postings.get(term, {})
+                    idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for path, tf in postings.items():
+                        length = self._docs[path]["length"]
+                        norm = tf * (BM25_K1 + 1) / (
+                            tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+                        token_scores[path] = max(token_scores.get(path, 0), idf * norm)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {p: s + token_scores[p] for p, s in scores.items() if p in token_scores}
+                if not scores:
+                    return []
+        ranked = sorted(((p, s) for p, s in scores.items() if parse_route(p)),
+                        key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
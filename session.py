@@ -0,0 +1,122 @@
+"""Where the user was, kept across restarts.
+
+Android stops backgrounded apps without warning, so on pause the app
+writes a small JSON snapshot: the navigation levels, the lesson in the
+viewer and its page. The page on screen, already decoded, is pickled
+next to it. The next launch replays the levels and reopens the lesson
+at that page, drawn from the pickle without decoding anything.
+"""
+import json
+import os
+import pickle
+
+SESSION_VERSION = 1
+LESSON_KEYS = ("path", "size", "mtime", "page")
+PAGE_LIMIT = 8 * 1024 * 1024  # decoded pages bigger than this aren't worth writing on pause
+
+
+class Session:
+    """The snapshot at `path` (None keeps it in memory only)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.levels = []   # [(title, route, scroll_y)], bottom of the stack first
+        self.lesson = None  # {"path", "size", "mtime", "page"} of the lesson in the viewer
+        self._page_key = None  # what the page file on disk holds
+
+    @property
+    def page_path(self):
+        return self.path + ".page"
+
+    def load(self):
+        """Read the snapshot; a missing or unreadable one is an empty session."""
+        if not self.path or not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError) as e:
+            print(f"Could not read session: {e}")
+            return self
+        try:
+            if data.get("version") != SESSION_VERSION:
+                return self
+            if not isinstance(data["levels"], list):
+                raise TypeError("levels is not a list")
+            levels = [(str(title), tuple(route), float(scroll_y))
+                      for title, route, scroll_y in data["levels"]]
+            lesson = data.get("lesson")
+            if lesson is not None:
+                # _key() and the app index these directly
+                lesson = {key: lesson[key] for key in LESSON_KEYS}
+                if not isinstance(lesson["path"], str) or not isinstance(lesson["page"], int):
+                    raise TypeError("lesson path or page has the wrong type")
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            print(f"Could not read session: malformed snapshot ({e!r})")
+            return self
+        self.levels = levels
+        self.lesson = lesson
+        return self
+
+    def save(self, levels, lesson=None, page=None):
+        """Write the snapshot atomically; `page` is the lesson's DecodedPage on screen, if any."""
+        self.levels = levels
+        self.lesson = lesson
+        if not self.path:
+            return
+        data = {
+            "version": SESSION_VERSION,
+            "levels": [[title, list(route), scroll_y] for title, route, scroll_y in levels],
+            "lesson": lesson,
+        }
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        try:
+            _write_atomic(self.path, json.dumps(data, separators=(",", ":")).encode("utf-8"))
+            self._save_page(lesson, page)
+        except OSError as e:
+            print(f"Could not save session: {e}")
+
+    def _save_page(self, lesson, page):
+        key = self._key(lesson)
+        if page is None or key is None or page.index != lesson["page"] or page.cost > PAGE_LIMIT:
+            if os.path.exists(self.page_path):
+                os.remove(self.page_path)
+            self._page_key = None
+            return
+        if key == self._page_key:
+            return  # still on the page written last time
+        # Textures belong to the GL context that is about to go away
+        blob = pickle.dumps((key, page._replace(textures={})), pickle.HIGHEST_PROTOCOL)
+        _write_atomic(self.page_path, blob)
+        self._page_key = key
+
+    def load_page(self):
+        """The saved DecodedPage of the saved lesson, or None if it doesn't match."""
+        key = self._key(self.lesson)
+        if key is None or not os.path.exists(self.page_path):
+            return None
+        try:
+            with open(self.page_path, "rb") as fh:
+                saved_key, page = pickle.load(fh)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError) as e:
+            print(f"Could not read saved page: {e}")
+            return None
+        if saved_key != key:
+            return None
+        self._page_key = key
+        return page
+
+    @staticmethod
+    def _key(lesson):
+        if not lesson:
+            return None
+        return lesson["path"], lesson["size"], lesson["mtime"], lesson["page"]
+
+
+def _write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,250 @@
+"""Parsing of .pptx slides into pages ready to draw.
+
+Kept free of Kivy so build tools and worker processes can lay slides out
+without opening a window; viewer.py draws what this produces.
+"""
+import posixpath
+from collections import namedtuple
+from xml.etree import ElementTree
+
+import lessonpack
+
+NS = {
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+}
+R_ID = "{%s}id" % NS["r"]
+R_EMBED = "{%s}embed" % NS["r"]
+REL_TYPE_LAYOUT = "/slideLayout"
+REL_TYPE_MASTER = "/slideMaster"
+
+EMU_PER_POINT = 12700
+DEFAULT_FONT_PT = 18
+MAX_DECODE_WIDTH = 1280  # px; bigger screens just scale the decoded slide up
+
+# A slide or PDF page ready for display. `elements` are in z-order and are
+# either ("picture", rect, (width, height, rgba_bytes)) or
+# ("text", rect, text, font_px, rgba, bold); rects are (x, y, w, h) in
+# pixels from the page's top-left corner. `textures` is filled in by
+# SlideView so flipping back to a cached page reuses its GPU textures.
+DecodedPage = namedtuple(
+    "DecodedPage", ["index", "width", "height", "background", "elements", "cost", "textures"]
+)
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def read_rels(archive, names, part):
+    """Relationship id -> (part name, type) of one part of an open deck whose
+    members are `names`; these files are small, so they are read whole."""
+    folder, name = posixpath.split(part)
+    rels_name = posixpath.join(folder, "_rels", name + ".rels")
+    if rels_name not in names:
+        return {}
+    rels = {}
+    for rel in ElementTree.fromstring(archive.read(rels_name)):
+        if rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target", "")
+        # Targets are relative to the part's folder, or absolute from the package root
+        target = target[1:] if target.startswith("/") else posixpath.normpath(posixpath.join(folder, target))
+        rels[rel.get("Id")] = (target, rel.get("Type", ""))
+    return rels
+
+
+def _hex_color(value, default):
+    try:
+        return (int(value[0:2], 16) / 255, int(value[2:4], 16) / 255, int(value[4:6], 16) / 255, 1)
+    except (TypeError, ValueError):
+        return default
+
+
+class SlideDeck:
+    """Random access to the slides of one .pptx.
+
+    Opening reads only the zip directory and presentation.xml; each slide's
+    XML and pictures are parsed when that slide is asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = lessonpack.open_zip(path)
+        self._names = set(self._zip.namelist())
+        self._frames = {}  # layout/master part -> placeholder frames
+
+        presentation = ElementTree.fromstring(self._zip.read("ppt/presentation.xml"))
+        size = presentation.find("p:sldSz", NS)
+        self.width_emu = int(size.get("cx")) if size is not None else 9144000
+        self.height_emu = int(size.get("cy")) if size is not None else 6858000
+        rels = self._rels("ppt/presentation.xml")
+        self.slides = [rels[s.get(R_ID)][0] for s in presentation.iterfind("p:sldIdLst/p:sldId", NS)
+                       if s.get(R_ID) in rels]
+
+    def __len__(self):
+        return len(self.slides)
+
+    def close(self):
+        self._zip.close()
+
+    def _rels(self, part):
+        """Relationship id -> (resolved part name, type) for one part."""
+        return read_rels(self._zip, self._names, part)
+
+    @staticmethod
+    def _xfrm(node):
+        xfrm = node.find("p:spPr/a:xfrm", NS)
+        if xfrm is None:
+            xfrm = node.find("p:grpSpPr/a:xfrm", NS)
+        if xfrm is None:
+            return None
+        off, ext = xfrm.find("a:off", NS), xfrm.find("a:ext", NS)
+        if off is None or ext is None:
+            return None
+        return int(off.get("x")), int(off.get("y")), int(ext.get("cx")), int(ext.get("cy"))
+
+    @staticmethod
+    def _placeholder(node):
+        ph = node.find("p:nvSpPr/p:nvPr/p:ph", NS)
+        if ph is None:
+            return None
+        return ph.get("type", "body"), ph.get("idx")
+
+    def _placeholder_frames(self, part):
+        """Frames of the placeholders on a layout or master, by idx and by type."""
+        if part in self._frames:
+            return self._frames[part]
+        frames = {}
+        root = ElementTree.fromstring(self._zip.read(part))
+        for sp in root.iter("{%s}sp" % NS["p"]):
+            ph, rect = self._placeholder(sp), self._xfrm(sp)
+            if ph and rect:
+                if ph[1] is not None:
+                    frames.setdefault(("idx", ph[1]), rect)
+                frames.setdefault(("type", ph[0]), rect)
+        parent = next((t for t, kind in self._rels(part).values() if kind.endswith(REL_TYPE_MASTER)), None)
+        if parent:
+            for key, rect in self._placeholder_frames(parent).items():
+                frames.setdefault(key, rect)
+        self._frames[part] = frames
+        return frames
+
+    def load_page(self, index, width_px, max_width=MAX_DECODE_WIDTH):
+        """Parse slide `index` and decode its pictures for a `width_px` wide view, `max_width` at most."""
+        from PIL import Image
+
+        part = self.slides[index]
+        root = ElementTree.fromstring(self._zip.read(part))
+        rels = self._rels(part)
+        layout = next((t for t, kind in rels.values() if kind.endswith(REL_TYPE_LAYOUT)), None)
+        frames = self._placeholder_frames(layout) if layout else {}
+
+        scale = min(width_px, max_width) / self.width_emu
+        background = (1, 1, 1, 1)
+        fill = root.find("p:cSld/p:bg/p:bgPr/a:solidFill/a:srgbClr", NS)
+        if fill is not None:
+            background = _hex_color(fill.get("val"), background)
+
+        elements = []
+        cost = [0]
+
+        def to_px(rect):
+            x, y, cx, cy = rect
+            return x * scale, y * scale, cx * scale, cy * scale
+
+        def walk(tree, transform):
+            for node in tree:
+                tag = _local(node.tag)
+                if tag == "grpSp":
+                    walk(node, self._group_transform(node, transform))
+                elif tag == "pic":
+                    rect = self._xfrm(node)
+                    blip = node.find("p:blipFill/a:blip", NS)
+                    if rect is None or blip is None or blip.get(R_EMBED) not in rels:
+                        continue
+                    target = rels[blip.get(R_EMBED)][0]
+                    box = to_px(transform(rect))
+                    pixels = self._decode_picture(Image, target, box)
+                    if pixels:
+                        elements.append(("picture", box, pixels))
+                        cost[0] += len(pixels[2])
+                elif tag == "sp":
+                    text, font_pt, color, bold = self._shape_text(node)
+                    if not text:
+                        continue
+                    rect = self._xfrm(node)
+                    if rect is None:
+                        ph = self._placeholder(node)
+                        if ph:
+                            rect = (ph[1] is not None and frames.get(("idx", ph[1]))) or frames.get(("type", ph[0]))
+                            if rect is None and ph[0] in ("ctrTitle", "subTitle"):
+                                rect = frames.get(("type", "title" if ph[0] == "ctrTitle" else "body"))
+                    if rect is None:
+                        continue
+                    font_px = font_pt * EMU_PER_POINT * scale
+                    elements.append(("text", to_px(transform(rect)), text, font_px, color, bold))
+
+        tree = root.find("p:cSld/p:spTree", NS)
+        if tree is not None:
+            walk(tree, lambda rect: rect)
+        return DecodedPage(
+            index, self.width_emu * scale, self.height_emu * scale, background, elements, cost[0], {}
+        )
+
+    def _group_transform(self, group, outer):
+        xfrm = group.find("p:grpSpPr/a:xfrm", NS)
+        if xfrm is None:
+            return outer
+        off, ext = xfrm.find("a:off", NS), xfrm.find("a:ext", NS)
+        ch_off, ch_ext = xfrm.find("a:chOff", NS), xfrm.find("a:chExt", NS)
+        if None in (off, ext, ch_off, ch_ext) or not int(ch_ext.get("cx")) or not int(ch_ext.get("cy")):
+            return outer
+        sx = int(ext.get("cx")) / int(ch_ext.get("cx"))
+        sy = int(ext.get("cy")) / int(ch_ext.get("cy"))
+        ox, oy = int(off.get("x")), int(off.get("y"))
+        cx0, cy0 = int(ch_off.get("x")), int(ch_off.get("y"))
+
+        def transform(rect):
+            x, y, cx, cy = rect
+            return outer((ox + (x - cx0) * sx, oy + (y - cy0) * sy, cx * sx, cy * sy))
+        return transform
+
+    @staticmethod
+    def _shape_text(sp):
+        paragraphs = []
+        font_pt, color, bold = None, (0, 0, 0, 1), False
+        for paragraph in sp.iterfind("p:txBody/a:p", NS):
+            runs = []
+            for run in paragraph:
+                if _local(run.tag) in ("r", "fld"):
+                    t = run.find("a:t", NS)
+                    runs.append((t.text or "") if t is not None else "")
+                    props = run.find("a:rPr", NS)
+                    if props is not None and font_pt is None and props.get("sz"):
+                        font_pt = int(props.get("sz")) / 100
+                        bold = props.get("b") == "1"
+                        rgb = props.find("a:solidFill/a:srgbClr", NS)
+                        if rgb is not None:
+                            color = _hex_color(rgb.get("val"), color)
+                elif _local(run.tag) == "br":
+                    runs.append("\n")
+            paragraphs.append("".join(runs))
+        return "\n".join(paragraphs).strip(), font_pt or DEFAULT_FONT_PT, color, bold
+
+    def _decode_picture(self, Image, target, box):
+        if target not in self._names:
+            return None
+        try:
+            # Stored pictures are read straight from the mapped archive
+            with self._zip.open(target) as member:
+                image = Image.open(member)
+                width, height = max(1, int(box[2])), max(1, int(box[3]))
+                image.draft("RGBA", (width, height))
+                image = image.convert("RGBA").resize((width, height))
+        except (OSError, ValueError) as e:
+            # EMF/WMF and other formats Pillow can't draw are just skipped
+            print(f"Skipping picture {target}: {e}")
+            return None
+        return image.width, image.height, image.tobytes()
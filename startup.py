@@ -0,0 +1,136 @@
+"""Startup timing for the app, and a small tool to measure and report it.
+
+main.py imports this module first, so `timer` starts counting before
+Kivy is loaded. Each launch appends one record to startup_times.jsonl in
+the app's data directory.
+
+    python startup.py measure [--runs N]   launch the app N times cold and warm
+    python startup.py report [FILE]        summarise recorded launches
+"""
+import json
+import os
+import sys
+import time
+
+RECORDS_FILE = "startup_times.jsonl"
+RECORDS_KEPT = 200
+# Set by `measure`: quit once warm-up is done, and keep data in this dir
+EXIT_ENV = "GREGOR_STARTUP_EXIT"
+DATA_DIR_ENV = "GREGOR_DATA_DIR"
+# Opt-in features; main.py imports classroom.py and updates.py only when set
+LIBRARY_URL_ENV = "GREGOR_LIBRARY_URL"  # browse the classroom library served here
+SERVE_PORT_ENV = "GREGOR_SERVE_PORT"    # serve our library on this port
+UPDATE_URL_ENV = "GREGOR_UPDATE_URL"    # update the library from this server once warmed up
+
+# Order of the marks main.py takes; "first_frame" is time-to-interactive
+MARKS = ("imports", "build", "first_frame", "catalog", "index")
+# Seconds allowed on the reference low-end device (a budget Android phone
+# with 2 GB of RAM and a quad-core Cortex-A53); `report` flags overruns
+BUDGETS = {"first_frame": 2.0, "catalog": 2.5, "index": 8.0}
+
+
+class StartupTimer:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = {}
+        self.kind = None  # "cold" without cached indexes, else "warm"
+        self._written = False
+
+    def mark(self, name):
+        """Record seconds since start; only the first mark of a name counts."""
+        self.marks.setdefault(name, time.perf_counter() - self.start)
+
+    def finish(self, data_dir):
+        """Print the timings and append them to the records file, once."""
+        if self._written:
+            return
+        self._written = True
+        summary = ", ".join(f"{name} {self.marks[name]:.3f}s" for name in MARKS if name in self.marks)
+        print(f"Startup ({self.kind or 'unknown'}): {summary}")
+        if not data_dir:
+            return
+        record = {"time": time.time(), "kind": self.kind, "platform": sys.platform,
+                  "marks": {name: round(value, 4) for name, value in self.marks.items()}}
+        path = os.path.join(data_dir, RECORDS_FILE)
+        try:
+            os.makedirs(data_dir, exist_ok=True)
+            lines = []
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as fh:
+                    lines = fh.read().splitlines()[-(RECORDS_KEPT - 1):]
+            lines.append(json.dumps(record))
+            with open(path + ".tmp", "w", encoding="utf-8") as fh:
+                fh.write("\n".join(lines) + "\n")
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not save startup timings: {e}")
+
+
+timer = StartupTimer()
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def report(path):
+    with open(path, "r", encoding="utf-8") as fh:
+        records = [json.loads(line) for line in fh if line.strip()]
+    print(f"{len(records)} launches from {path}")
+    for kind in ("cold", "warm"):
+        runs = [r for r in records if r.get("kind") == kind]
+        if not runs:
+            continue
+        print(f"\n{kind} ({len(runs)} runs)      median     p95   budget")
+        for name in MARKS:
+            values = [r["marks"][name] for r in runs if name in r["marks"]]
+            if not values:
+                continue
+            median, p95 = _percentile(values, 0.5), _percentile(values, 0.95)
+            budget = BUDGETS.get(name)
+            verdict = "" if budget is None else f"  {budget:5.1f}s" + ("  OVER" if p95 > budget else "")
+            print(f"  {name:<16} {median:7.3f}s {p95:7.3f}s{verdict}")
+
+
+def measure(runs):
+    """Launch main.py `runs` times from scratch and `runs` times warm."""
+    import shutil
+    import subprocess
+    import tempfile
+
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    data_dir = tempfile.mkdtemp(prefix="gregor-startup-")
+    results = os.path.join(data_dir, RECORDS_FILE)
+    for kind in ("cold",) * runs + ("warm",) * runs:
+        if kind == "cold":
+            # Drop cached indexes and thumbnails but keep the records file
+            for name in os.listdir(data_dir):
+                if name != RECORDS_FILE:
+                    target = os.path.join(data_dir, name)
+                    if os.path.isdir(target):
+                        shutil.rmtree(target, ignore_errors=True)
+                    else:
+                        os.remove(target)
+        env = dict(os.environ, **{EXIT_ENV: "1", DATA_DIR_ENV: data_dir, "KIVY_NO_ARGS": "1"})
+        subprocess.run([sys.executable, os.path.join(app_dir, "main.py")], cwd=app_dir, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=300)
+    report(results)
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else "report"
+    if command == "measure":
+        runs = int(argv[argv.index("--runs") + 1]) if "--runs" in argv else 3
+        measure(runs)
+    elif command == "report":
+        if len(argv) > 2:
+            report(argv[2])
+        else:
+            print("usage: python startup.py report FILE")
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,102 @@
+"""Textures shared across widgets.
+
+Every pill button is drawn from one white nine-patch per corner radius
+(tinted by its Color), instead of tessellating its own RoundedRectangle.
+Rendered label text is kept by text and render options, so recycled
+list rows that show a name again reuse its texture instead of laying
+the text out and uploading it once more.
+"""
+import math
+from collections import OrderedDict
+
+from kivy.graphics.texture import Texture
+
+LABEL_CACHE_BUDGET = 4 * 1024 * 1024  # bytes of RGBA text textures
+
+_pills = {}  # radius in px -> Texture
+
+
+def _pill_pixels(radius):
+    """RGBA bytes of a (2r+2)-pixel square whose corners are anti-aliased arcs."""
+    size = 2 * radius + 2
+    pixels = bytearray(b"\xff" * (size * size * 4))
+    for y in range(size):
+        cy = y + 0.5
+        dy = radius - cy if cy < radius else cy - (size - radius) if cy > size - radius else 0
+        for x in range(size):
+            cx = x + 0.5
+            dx = radius - cx if cx < radius else cx - (size - radius) if cx > size - radius else 0
+            if dx or dy:
+                coverage = min(1.0, max(0.0, radius + 0.5 - math.hypot(dx, dy)))
+                pixels[(y * size + x) * 4 + 3] = int(coverage * 255)
+    return bytes(pixels)
+
+
+def pill_texture(radius):
+    """The shared nine-patch for pills with corner `radius` (in pixels).
+
+    Draw it with a BorderImage whose border is `radius` on every side.
+    """
+    radius = max(1, int(round(radius)))
+    texture = _pills.get(radius)
+    if texture is None:
+        pixels = _pill_pixels(radius)
+        texture = Texture.create(size=(2 * radius + 2, 2 * radius + 2), colorfmt="rgba")
+        texture.blit_buffer(pixels, colorfmt="rgba", bufferfmt="ubyte")
+        # Android drops GL textures when the app is paused; upload them again
+        texture.add_reload_observer(lambda tex, p=pixels: tex.blit_buffer(p, colorfmt="rgba", bufferfmt="ubyte"))
+        _pills[radius] = texture
+    return texture
+
+
+class LabelTextureCache:
+    """Rendered core labels by text and options, least recently used out first.
+
+    The cache keeps the core label itself, not just its texture, so the
+    texture's own reload observer can redraw the right text after the GL
+    context is lost.
+    """
+
+    def __init__(self, budget=LABEL_CACHE_BUDGET):
+        self.budget = budget
+        self._labels = OrderedDict()  # key -> (core label, bytes)
+        self._used = 0
+
+    @staticmethod
+    def key(core):
+        options = core.options
+        # options["text"] keeps the text the core label was created with
+        return (core.text, repr(core.usersize)) + tuple(
+            (name, repr(options[name])) for name in sorted(options) if name != "text"
+        )
+
+    def get(self, key):
+        entry = self._labels.get(key)
+        if entry is None:
+            return None
+        self._labels.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, core):
+        width, height = core.texture.size
+        cost = width * height * 4
+        if key in self._labels or cost > self.budget:
+            return
+        self._labels[key] = (core, cost)
+        self._used += cost
+        while self._used > self.budget:
+            _, (_, evicted) = self._labels.popitem(last=False)
+            self._used -= evicted
+
+    @property
+    def used(self):
+        return self._used
+
+    def trim(self, target):
+        """Drop the least recently used labels until at most `target` bytes are kept."""
+        while self._used > target and self._labels:
+            _, (_, evicted) = self._labels.popitem(last=False)
+            self._used -= evicted
+
+
+label_cache = LabelTextureCache()
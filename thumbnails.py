@@ -0,0 +1,315 @@
+import hashlib
+import io
+import mmap
+import os
+import posixpath
+import re
+import zipfile
+from collections import OrderedDict
+from threading import Lock
+from xml.etree import ElementTree
+
+from kivy.graphics.texture import Texture
+
+import lessonpack
+from jobs import THUMBNAIL
+
+THUMBNAIL_SIZE = (160, 120)
+DISK_BUDGET = 16 * 1024 * 1024    # bytes of JPEGs kept in the cache dir
+MEMORY_BUDGET = 6 * 1024 * 1024   # bytes of RGBA pixels kept as textures
+
+PPTX_THUMBNAILS = ("docProps/thumbnail.jpeg", "docProps/thumbnail.jpg", "docProps/thumbnail.png")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+RELS_IMAGE_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+
+PDF_JPEG_RE = re.compile(
+    rb"<<(?:(?!>>).)*?/Subtype\s*/Image(?:(?!>>).)*?/DCTDecode(?:(?!>>).)*?>>\s*stream\r?\n", re.S
+)
+PDF_JPEG_RE_ALT = re.compile(
+    rb"<<(?:(?!>>).)*?/DCTDecode(?:(?!>>).)*?/Subtype\s*/Image(?:(?!>>).)*?>>\s*stream\r?\n", re.S
+)
+
+
+def pptx_thumbnail_bytes(path):
+    """The deck's embedded preview, else the first image on slide 1, else any image."""
+    with lessonpack.open_zip(path) as archive:
+        names = set(archive.namelist())
+        for name in PPTX_THUMBNAILS:
+            if name in names:
+                return archive.read(name)
+
+        rels = "ppt/slides/_rels/slide1.xml.rels"
+        if rels in names:
+            for rel in ElementTree.fromstring(archive.read(rels)):
+                if rel.get("Type") != RELS_IMAGE_TYPE:
+                    continue
+                member = posixpath.normpath(posixpath.join("ppt/slides", rel.get("Target", "")))
+                if member in names and member.lower().endswith(IMAGE_EXTENSIONS):
+                    return archive.read(member)
+
+        # Text-only first slide: any picture from the deck beats no preview
+        media = sorted(n for n in names if n.startswith("ppt/media/") and n.lower().endswith(IMAGE_EXTENSIONS))
+        return archive.read(media[0]) if media else None
+
+
+def pdf_thumbnail_bytes(path):
+    """The first JPEG image embedded in the PDF.
+
+    Rasterising a PDF page needs a renderer we don't ship; the first
+    embedded picture is usually the logo or cover image of page one.
+    Loose files are memory-mapped, so only the pages scanned are read.
+    """
+    if path.startswith(lessonpack.PACK_SCHEME):
+        return _first_jpeg(lessonpack.read_bytes(path))  # a packed PDF is one blob
+    with open(path, "rb") as fh:
+        try:
+            data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return None
+        try:
+            return _first_jpeg(data)
+        finally:
+            data.close()
+
+
+def _first_jpeg(data):
+    match = PDF_JPEG_RE.search(data) or PDF_JPEG_RE_ALT.search(data)
+    if not match:
+        return None
+    start = match.end()
+    end = data.find(b"endstream", start)
+    return data[start:end] if end != -1 else None
+
+
+def thumbnail_source_bytes(path, kind):
+    try:
+        if kind == "pptx":
+            return pptx_thumbnail_bytes(path)
+        if kind == "pdf":
+            return pdf_thumbnail_bytes(path)
+    except (OSError, zipfile.BadZipFile, ElementTree.ParseError) as e:
+        print(f"Could not read thumbnail from {path}: {e}")
+    return None
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    """Decode and downscale image bytes into an RGB Pillow image."""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    # For JPEGs this makes the decoder itself downscale, so a large cover
+    # photo never gets decoded at full resolution
+    image.draft("RGB", (size[0] * 2, size[1] * 2))
+    image = image.convert("RGB")
+    image.thumbnail(size)
+    return image
+
+
+class ThumbnailLoader:
+    """Lazily produces small textures for lesson files.
+
+    Extraction, decoding and scaling run as THUMBNAIL jobs on the shared
+    JobPool; most recent requests are served first, so rows that just
+    scrolled into view win over rows that already scrolled past. Results
+    are kept as JPEGs in a size-bounded disk cache and as textures in a
+    bounded in-memory LRU.
+    """
+
+    def __init__(self, cache_dir, pool, disk_budget=DISK_BUDGET, memory_budget=MEMORY_BUDGET,
+                 size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.pool = pool
+        self.disk_budget = disk_budget
+        self.memory_budget = memory_budget
+        self.size = size
+        self._textures = OrderedDict()  # key -> (texture, cost)
+        self._memory_used = 0
+        self._disk = None  # cache file name -> size, oldest first; loaded lazily
+        self._disk_used = 0
+        self._lock = Lock()
+        self._disk_lock = Lock()
+        self._pending = {}  # key -> (job, [callbacks])
+
+    @staticmethod
+    def key_for(abs_path, size, mtime, kind):
+        return (abs_path, size, mtime, kind)
+
+    def request(self, key, callback, priority=THUMBNAIL):
+        """Call `callback(key, texture_or_None)` on the UI thread.
+
+        Returns the texture right away (and skips the callback) when it is
+        already in memory. A request at a higher priority than one already
+        pending (a row showing a preview the prefetcher asked for) moves
+        that job up.
+        """
+        cached = self._textures.get(key)
+        if cached is not None:
+            self._textures.move_to_end(key)
+            return cached[0]
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = (None, [callback])
+            else:
+                pending[1].append(callback)
+        if pending is not None:
+            if pending[0] is not None:
+                self.pool.promote(pending[0], priority, lifo=True)
+            return None
+        job = self.pool.submit(
+            self._produce, key,
+            priority=priority,
+            key=("thumbnail", key),
+            on_done=lambda pixels: self._deliver(key, pixels),
+            on_error=lambda e: self._failed(key, e),
+            lifo=True
+        )
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = (job, self._pending[key][1])
+        return None
+
+    def has(self, key):
+        """Whether `key` is in memory right now."""
+        return key in self._textures
+
+    def cancel(self, key, callback):
+        """Withdraw a request; the job itself is dropped once nobody waits on it."""
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None or callback not in pending[1]:
+                return
+            pending[1].remove(callback)
+            if pending[1]:
+                return
+            del self._pending[key]
+        if pending[0] is not None:
+            pending[0].cancel()
+
+    # Worker threads
+
+    def _cache_name(self, key):
+        abs_path, size, mtime, _ = key
+        digest = hashlib.sha1(f"{abs_path}|{size}|{mtime}".encode("utf-8")).hexdigest()
+        return digest + ".jpg"
+
+    def _produce(self, key):
+        """Return (width, height, rgb_bytes) or None if the file has no image."""
+        from PIL import Image
+
+        name = self._cache_name(key)
+        cache_path = os.path.join(self.cache_dir, name)
+        with self._disk_lock:
+            if self._disk is None:
+                self._load_disk_index()
+            cached = name in self._disk
+        if cached:
+            try:
+                with Image.open(cache_path) as image:
+                    image = image.convert("RGB")
+                with self._disk_lock:
+                    self._touch(name, cache_path)
+                return image.width, image.height, image.tobytes()
+            except OSError:
+                with self._disk_lock:
+                    self._forget(name)
+
+        data = thumbnail_source_bytes(key[0], key[3])
+        if not data:
+            return None
+        image = make_thumbnail(data, self.size)
+        with self._disk_lock:
+            self._store(name, cache_path, image)
+        return image.width, image.height, image.tobytes()
+
+    def _load_disk_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".jpg"):
+                    st = entry.stat()
+                    files.append((st.st_mtime, entry.name, st.st_size))
+        self._disk = OrderedDict((name, size) for _, name, size in sorted(files))
+        self._disk_used = sum(self._disk.values())
+
+    def _touch(self, name, cache_path):
+        # The file mtime doubles as the LRU timestamp across app restarts
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        if name in self._disk:
+            self._disk.move_to_end(name)
+
+    def _store(self, name, cache_path, image):
+        tmp_path = cache_path + ".tmp"
+        try:
+            image.save(tmp_path, "JPEG", quality=80)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Could not cache thumbnail: {e}")
+            return
+        size = os.path.getsize(cache_path)
+        self._forget(name)
+        self._disk[name] = size
+        self._disk_used += size
+        while self._disk_used > self.disk_budget and len(self._disk) > 1:
+            oldest = next(iter(self._disk))
+            self._forget(oldest)
+            try:
+                os.remove(os.path.join(self.cache_dir, oldest))
+            except OSError:
+                pass
+
+    def _forget(self, name):
+        size = self._disk.pop(name, None)
+        if size is not None:
+            self._disk_used -= size
+
+    # UI thread
+
+    def _deliver(self, key, pixels):
+        texture = None
+        if pixels is not None:
+            width, height, rgb = pixels
+            texture = Texture.create(size=(width, height), colorfmt="rgb")
+            texture.blit_buffer(rgb, colorfmt="rgb", bufferfmt="ubyte")
+            texture.flip_vertical()  # Pillow rows are top-down, GL is bottom-up
+            # GPUs generally store RGB textures padded to four bytes per pixel
+            self._remember(key, texture, width * height * 4)
+        with self._lock:
+            _, callbacks = self._pending.pop(key, (None, []))
+        for callback in callbacks:
+            callback(key, texture)
+
+    def _failed(self, key, error):
+        print(f"Thumbnail failed for {key[0]}: {error}")
+        self._deliver(key, None)
+
+    def _remember(self, key, texture, cost):
+        old = self._textures.pop(key, None)
+        if old is not None:
+            self._memory_used -= old[1]
+        self._textures[key] = (texture, cost)
+        self._memory_used += cost
+        while self._memory_used > self.memory_budget and len(self._textures) > 1:
+            _, (_, old_cost) = self._textures.popitem(last=False)
+            self._memory_used -= old_cost
+
+    @property
+    def memory_used(self):
+        """Bytes of textures held in memory."""
+        return self._memory_used
+
+    def trim_memory(self, target):
+        """Drop the least recently used textures until at most `target` bytes are
+        held; they are re-read from disk on demand."""
+        while self._memory_used > target and self._textures:
+            _, (_, cost) = self._textures.popitem(last=False)
+            self._memory_used -= cost
+
+    def clear_memory(self):
+        """Drop all in-memory textures; they are re-read from disk on demand."""
+        self._textures.clear()
+        self._memory_used = 0
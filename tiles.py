@@ -0,0 +1,144 @@
+"""Drawing pages into images, whole or one tile at a time.
+
+The viewer shows a page fitted to the screen from one decode. Zoomed in,
+a single texture of the page would be several times the screen and past
+the texture size limit of cheap GPUs, so the page is cut into TILE-pixel
+squares at zoom levels of 2, 4, ... times the fitted width, and only the
+tiles on screen are drawn and uploaded. Text is drawn at each level's
+own font size, so it stays sharp at any zoom; pictures come from one
+decode of the page at SOURCE_WIDTH.
+
+Kept free of Kivy like slides.py; renders.py flattens whole pages at
+build time with the same code.
+"""
+import functools
+import importlib.util
+import math
+import os
+
+from slides import MAX_DECODE_WIDTH
+
+TILE = 256  # px per tile side
+MAX_LEVEL = 2  # deepest zoom level: 2 ** MAX_LEVEL times the fitted width
+SOURCE_WIDTH = 2 * MAX_DECODE_WIDTH  # px a page's pictures are decoded at for tiles
+
+
+@functools.lru_cache(maxsize=None)
+def font(size_px, bold):
+    """Roboto, the font Kivy labels draw slide text with in the viewer."""
+    from PIL import ImageFont
+
+    fonts = os.path.join(importlib.util.find_spec("kivy").submodule_search_locations[0], "data", "fonts")
+    return ImageFont.truetype(os.path.join(fonts, "Roboto-Bold.ttf" if bold else "Roboto-Regular.ttf"), size_px)
+
+
+def color(rgba):
+    return tuple(round(channel * 255) for channel in rgba[:3])
+
+
+def wrap(draw, text, face, width):
+    """Lines of `text` broken at spaces to fit `width`, as a Kivy label with text_size does."""
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if line and draw.textlength(candidate, font=face) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def draw(page, scale=1, box=None, mode="RGB", pictures=None, lines=None):
+    """Draw a DecodedPage, pictures and text, into a new Pillow image.
+
+    The page is drawn `scale` times its decoded size and `box` (left,
+    top, width, height in those pixels) picks the part to draw, by
+    default all of it. `pictures` and `lines` are dicts that keep the
+    page's pictures as images and its wrapped text, for callers drawing
+    the page more than once; `lines` only for one scale.
+    """
+    from PIL import Image, ImageDraw
+
+    if box is None:
+        box = (0, 0, max(1, round(page.width * scale)), max(1, round(page.height * scale)))
+    left, top, width, height = box
+    background = color(page.background) + ((255,) if mode == "RGBA" else ())
+    image = Image.new(mode, (width, height), background)
+    canvas = ImageDraw.Draw(image)
+    pictures = {} if pictures is None else pictures
+    lines = {} if lines is None else lines
+    for number, element in enumerate(page.elements):
+        x, y, w, h = element[1]
+        x, y, w, h = x * scale - left, y * scale - top, w * scale, h * scale
+        if element[0] == "picture":
+            if x >= width or y >= height or x + w <= 0 or y + h <= 0:
+                continue
+            picture = pictures.get(number)
+            if picture is None:
+                picture_width, picture_height, rgba = element[2]
+                picture = pictures[number] = Image.frombytes("RGBA", (picture_width, picture_height), rgba)
+            if scale == 1:
+                image.paste(picture, (round(x), round(y)), picture)
+                continue
+            # Scale just the part of the picture inside the box
+            x0, y0 = max(0, math.floor(x)), max(0, math.floor(y))
+            x1, y1 = min(width, math.ceil(x + w)), min(height, math.ceil(y + h))
+            sx, sy = picture.width / w, picture.height / h
+            part = picture.resize((x1 - x0, y1 - y0), Image.BILINEAR, box=(
+                max(0, (x0 - x) * sx), max(0, (y0 - y) * sy),
+                min(picture.width, (x1 - x) * sx), min(picture.height, (y1 - y) * sy)))
+            image.paste(part, (x0, y0), part)
+            continue
+        if x >= width or y >= height:
+            continue
+        _, _, text, font_px, rgba, bold = element
+        face = font(max(6, round(font_px * scale)), bold)
+        if number not in lines:
+            lines[number] = wrap(canvas, text, face, w)
+        ascent, descent = face.getmetrics()
+        for line in lines[number]:
+            if y >= height:
+                break
+            if y + ascent + descent > 0:
+                canvas.text((x, y), line, font=face, fill=color(rgba))
+            y += ascent + descent
+    return image
+
+
+def level_size(fit, level):
+    """(width, height) in px of the page at zoom `level` for a view that fits it `fit` px."""
+    return fit[0] << level, fit[1] << level
+
+
+def zoom_level(scale):
+    """The level whose tiles are sharpest at `scale` times the fitted size; 0 is the fitted page itself."""
+    return max(0, min(MAX_LEVEL, round(math.log2(max(scale, 1)))))
+
+
+class TilePyramid:
+    """Tiles of one page, drawn from `page`, a DecodedPage of it decoded at SOURCE_WIDTH.
+
+    Tile (col, row) of `level` is the TILE-pixel square col tiles across
+    and row tiles down from the top-left corner of the page drawn at
+    level_size(fit, level); tiles on the right and bottom edges are
+    smaller.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.index = page.index
+        self._pictures = {}
+        self._lines = {}  # (fit, level) -> wrapped text of that size
+
+    def render(self, fit, level, col, row):
+        """One tile as (width, height, rgba bytes)."""
+        width, height = level_size(fit, level)
+        left, top = col * TILE, row * TILE
+        image = draw(self.page, width / self.page.width,
+                     (left, top, min(TILE, width - left), min(TILE, height - top)), "RGBA",
+                     self._pictures, self._lines.setdefault((fit, level), {}))
+        return image.width, image.height, image.tobytes()
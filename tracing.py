@@ -0,0 +1,145 @@
+"""Opt-in latency tracing, exportable as a Chrome trace (chrome://tracing,
+https://ui.perfetto.dev).
+
+Set GREGOR_TRACE=1 to record, or GREGOR_TRACE=/path/trace.json to also
+choose where the app writes the trace when it pauses or stops. Spans go
+to a fixed-size ring buffer, so a long session keeps only the latest
+events. When tracing is off, span() returns a shared no-op object and
+traced() costs one flag check per call.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+TRACE_ENV = "GREGOR_TRACE"
+BUFFER_EVENTS = 4096
+TRACE_FILE = "trace.json"
+
+enabled = bool(os.environ.get(TRACE_ENV))
+_events = deque(maxlen=BUFFER_EVENTS)  # (name, start, end, thread id, args)
+_threads = {}  # thread id -> name
+_origin = time.perf_counter()
+
+
+def _record(name, start, end, args):
+    ident = threading.get_ident()
+    if ident not in _threads:
+        _threads[ident] = threading.current_thread().name
+    _events.append((name, start, end, ident, args))
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.end()
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def end(self):
+        _record(self.name, self.start, time.perf_counter(), self.args)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+    def end(self):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """Time a block: `with tracing.span("nav.open"): ...`, or call .end() later."""
+    return _Span(name, args) if enabled else NO_SPAN
+
+
+def traced(name):
+    """Decorator form of span() for whole methods."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Span(name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def end_on_next_frame(pending):
+    """End `pending` once the window has drawn and flipped its next frame."""
+    if pending is NO_SPAN:
+        return
+    from kivy.core.window import Window
+
+    def flipped(*_):
+        Window.unbind(on_flip=flipped)
+        pending.end()
+    Window.bind(on_flip=flipped)
+
+
+def until_next_frame(name, **args):
+    """Span from now until the next frame is on screen."""
+    if enabled:
+        end_on_next_frame(_Span(name, args))
+
+
+def events():
+    """The buffered spans as Chrome trace events, oldest first."""
+    pid = os.getpid()
+    result = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": ident, "args": {"name": name}}
+              for ident, name in list(_threads.items())]
+    for name, start, end, ident, args in list(_events):
+        result.append({
+            "name": name,
+            "cat": name.split(".", 1)[0],
+            "ph": "X",
+            "ts": round((start - _origin) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": pid,
+            "tid": ident,
+            "args": args,
+        })
+    return result
+
+
+def export(path):
+    """Write the buffer as a Chrome trace JSON file; returns the path written."""
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        json.dump({"traceEvents": events(), "displayTimeUnit": "ms"}, fh, default=str)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def output_path(default_dir):
+    """Where the app should export: the GREGOR_TRACE path if one was given."""
+    value = os.environ.get(TRACE_ENV, "")
+    if value.lower().endswith(".json"):
+        return value
+    return os.path.join(default_dir or ".", TRACE_FILE)
@@ -0,0 +1,342 @@
+"""Delta updates of the lesson library from an update server.
+
+    python updates.py manifest [GregorELibrary] [manifest.json]   hash a library for publishing
+    python updates.py serve [GregorELibrary] [PORT]               serve a library to update from
+    python updates.py fetch URL [GregorELibrary]                  update a library from a server
+
+A server publishes manifest.json, with every file's size and SHA-256,
+and each file under files/<path>. The client hashes what is installed
+(hashes are cached by size and mtime, so unchanged files aren't read
+again) and downloads only added or changed files. Downloads go into a
+staging folder beside the library, in chunks that an interrupted update
+resumes with HTTP range requests, and each is checked against its hash.
+Only then is a journal written and the files moved into place; a journal
+left behind by an interruption is finished before the library is next
+read. Files the manifest no longer lists are removed.
+
+Updates apply to a library folder. The lesson pack built into the APK
+is read-only, so a pack-backed catalog is left alone.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from catalog import LIBRARY_DIR
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+FILES_PREFIX = "files/"
+CHUNK_SIZE = 256 * 1024
+TIMEOUT = 30  # seconds without data before a download gives up
+SHA256_RE = re.compile(r"[0-9a-f]{64}")
+
+
+class UpdateError(Exception):
+    pass
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def library_files(root):
+    """Relative "/"-separated path -> os.stat_result of every file under `root`."""
+    files = {}
+    for folder, dirs, names in os.walk(root):
+        dirs.sort()
+        for name in names:
+            full_path = os.path.join(folder, name)
+            files[os.path.relpath(full_path, root).replace(os.sep, "/")] = os.stat(full_path)
+    return files
+
+
+def build_manifest(root):
+    return {
+        "version": MANIFEST_VERSION,
+        "files": {rel: {"size": st.st_size, "sha256": file_hash(os.path.join(root, *rel.split("/")))}
+                  for rel, st in sorted(library_files(root).items())},
+    }
+
+
+class Updater:
+    """Brings the library folder `root` in line with the server at `base_url`.
+
+    `hash_cache` is a JSON file remembering installed files' hashes;
+    `stop()` makes a running update return at the next chunk, keeping
+    what it downloaded so far for the next attempt.
+    """
+
+    def __init__(self, root, base_url, hash_cache=None):
+        self.root = root
+        self.base_url = base_url.rstrip("/") + "/"
+        self.hash_cache = hash_cache or root.rstrip("/\\") + ".hashes.json"
+        self.staging = root.rstrip("/\\") + ".update"
+        self.journal = os.path.join(self.staging, "journal.json")
+        self.downloaded = 0  # bytes fetched by this run
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self):
+        """Update the library; returns the relative paths that were added, changed or removed."""
+        changed = self.finish_pending()
+        manifest = self.fetch_manifest()
+        installed = self.installed_hashes()
+        wanted = manifest["files"]
+        fetch = {rel: info for rel, info in wanted.items() if installed.get(rel) != info["sha256"]}
+        remove = sorted(rel for rel in installed if rel not in wanted)
+        if not fetch and not remove:
+            return changed
+
+        os.makedirs(self.staging, exist_ok=True)
+        # Files with the same content are fetched once
+        for sha256, (rel, info) in {info["sha256"]: (rel, info) for rel, info in fetch.items()}.items():
+            self._download(rel, info)
+            if self._stopped:
+                return changed
+        self._write_json(self.journal, {
+            "replace": [[info["sha256"], rel] for rel, info in sorted(fetch.items())],
+            "remove": remove,
+        })
+        return changed + self.finish_pending()
+
+    # Installed state
+
+    def installed_hashes(self):
+        """Relative path -> SHA-256 of every installed file, re-hashing only files that changed."""
+        try:
+            with open(self.hash_cache, "r", encoding="utf-8") as fh:
+                cache = json.load(fh)
+        except (OSError, ValueError):
+            cache = {}
+        hashes, fresh = {}, {}
+        for rel, st in library_files(self.root).items():
+            known = cache.get(rel)
+            if known and known[0] == st.st_size and known[1] == st.st_mtime:
+                hashes[rel] = known[2]
+            else:
+                hashes[rel] = file_hash(os.path.join(self.root, *rel.split("/")))
+            fresh[rel] = [st.st_size, st.st_mtime, hashes[rel]]
+        if fresh != cache:
+            self._write_json(self.hash_cache, fresh)
+        return hashes
+
+    # Downloading
+
+    def fetch_manifest(self):
+        try:
+            with urllib.request.urlopen(self.base_url + MANIFEST_NAME, timeout=TIMEOUT) as response:
+                manifest = json.loads(response.read())
+        except (OSError, ValueError) as e:
+            raise UpdateError(f"Could not fetch the update manifest: {e}")
+        if not isinstance(manifest, dict):
+            raise UpdateError("The update manifest is not an object")
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise UpdateError(f"Unsupported manifest version {manifest.get('version')}")
+        files = manifest.get("files")
+        if not isinstance(files, dict):
+            raise UpdateError("The update manifest has no file list")
+        for rel, info in files.items():
+            parts = rel.split("/")
+            if rel.startswith("/") or ".." in parts or "" in parts or "\\" in rel:
+                raise UpdateError(f"Refusing manifest path {rel!r}")
+            # The hash names the file while it is staged, so it must be one
+            if not (isinstance(info, dict) and isinstance(info.get("sha256"), str)
+                    and SHA256_RE.fullmatch(info["sha256"])
+                    and type(info.get("size")) is int and info["size"] >= 0):
+                raise UpdateError(f"Bad manifest entry for {rel!r}")
+        return manifest
+
+    def _download(self, rel, info):
+        """Fetch one file into staging/<sha256>, resuming a partial download."""
+        target = os.path.join(self.staging, info["sha256"])
+        if os.path.exists(target):
+            return  # fetched and checked by an earlier, interrupted run
+        part = target + ".part"
+        have = os.path.getsize(part) if os.path.exists(part) else 0
+        if have > info["size"]:
+            have = 0
+        url = self.base_url + FILES_PREFIX + urllib.parse.quote(rel)
+        request = urllib.request.Request(url, headers={"Range": f"bytes={have}-"} if have else {})
+        try:
+            with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+                # A server ignoring the range sends the whole file again
+                mode = "ab" if have and response.status == 206 else "wb"
+                with open(part, mode) as fh:
+                    while not self._stopped:
+                        chunk = response.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        fh.write(chunk)
+                        self.downloaded += len(chunk)
+        except urllib.error.HTTPError as e:
+            if e.code != 416 or have != info["size"]:  # 416: nothing left to fetch
+                raise UpdateError(f"Could not download {rel}: {e}")
+        except OSError as e:
+            raise UpdateError(f"Could not download {rel}: {e}")
+        if self._stopped:
+            return
+        if os.path.getsize(part) != info["size"] or file_hash(part) != info["sha256"]:
+            os.remove(part)
+            raise UpdateError(f"Download of {rel} is corrupt")
+        os.replace(part, target)
+
+    # Applying
+
+    def finish_pending(self):
+        """Move staged files into place as the journal says; returns the paths touched.
+
+        Every step can be repeated, so an update interrupted here is
+        finished by the next call.
+        """
+        try:
+            with open(self.journal, "r", encoding="utf-8") as fh:
+                journal = json.load(fh)
+        except (OSError, ValueError):
+            return []
+        replace = journal["replace"]
+        for number, (sha256, rel) in enumerate(replace):
+            staged = os.path.join(self.staging, sha256)
+            if not os.path.exists(staged):
+                continue  # moved before the interruption
+            target = os.path.join(self.root, *rel.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if any(other == sha256 for other, _ in replace[number + 1:]):
+                # More files share this content; copy, keep the staged one
+                shutil.copyfile(staged, target + ".tmp")
+                os.replace(target + ".tmp", target)
+            else:
+                os.replace(staged, target)
+        for rel in journal["remove"]:
+            target = os.path.join(self.root, *rel.split("/"))
+            if os.path.exists(target):
+                os.remove(target)
+            self._remove_empty_dirs(os.path.dirname(target))
+        shutil.rmtree(self.staging, ignore_errors=True)
+        return [rel for _, rel in replace] + journal["remove"]
+
+    def _remove_empty_dirs(self, folder):
+        root = os.path.abspath(self.root)
+        folder = os.path.abspath(folder)
+        while folder != root and folder.startswith(root) and os.path.isdir(folder) and not os.listdir(folder):
+            os.rmdir(folder)
+            folder = os.path.dirname(folder)
+
+    @staticmethod
+    def _write_json(path, data):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+
+# Local stand-in for the update server
+
+class UpdateRequestHandler(BaseHTTPRequestHandler):
+    """Serves `server.manifest` and the files of `server.root`, honouring single byte ranges."""
+
+    def do_HEAD(self):
+        self._send(head=True)
+
+    def do_GET(self):
+        self._send(head=False)
+
+    def _send(self, head):
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip("/")
+        if path == MANIFEST_NAME:
+            data = json.dumps(self.server.manifest).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(data)
+            return
+        rel = path[len(FILES_PREFIX):] if path.startswith(FILES_PREFIX) else None
+        if rel not in self.server.manifest["files"]:
+            self.send_error(404)
+            return
+        full_path = os.path.join(self.server.root, *rel.split("/"))
+        size = os.path.getsize(full_path)
+        start, end = 0, size - 1
+        ranged = self.headers.get("Range", "")
+        if ranged.startswith("bytes="):
+            first, _, last = ranged[len("bytes="):].partition("-")
+            try:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            except ValueError:
+                start = -1
+            if not 0 <= start < size or end < start:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if head:
+            return
+        with open(full_path, "rb") as fh:
+            fh.seek(start)
+            left = end - start + 1
+            while left > 0:
+                chunk = fh.read(min(CHUNK_SIZE, left))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                left -= len(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(root, port=0, host="127.0.0.1"):
+    """An update server for the library at `root`; port 0 picks a free one."""
+    server = ThreadingHTTPServer((host, port), UpdateRequestHandler)
+    server.root = root
+    server.manifest = build_manifest(root)
+    return server
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    args = sys.argv[2:]
+    if command == "manifest":
+        manifest = build_manifest(args[0] if args else LIBRARY_DIR)
+        with open(args[1] if len(args) > 1 else MANIFEST_NAME, "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, indent=1)
+        print(f"{len(manifest['files'])} files")
+    elif command == "serve":
+        server = make_server(args[0] if args else LIBRARY_DIR, int(args[1]) if len(args) > 1 else 8765)
+        print(f"Serving {server.root} on http://{server.server_address[0]}:{server.server_address[1]}/")
+        server.serve_forever()
+    elif command == "fetch" and args:
+        updater = Updater(args[1] if len(args) > 1 else LIBRARY_DIR, args[0])
+        try:
+            changed = updater.run()
+        except UpdateError as e:
+            print(e)
+            sys.exit(1)
+        print(f"{len(changed)} files updated, {updater.downloaded} bytes downloaded")
+    else:
+        print(__doc__)
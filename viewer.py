@@ -0,0 +1,524 @@
+import itertools
+import math
+from collections import OrderedDict
+from queue import PriorityQueue
+from threading import Lock, Thread
+
+from kivy.clock import Clock
+from kivy.core.window import Window
+from kivy.graphics import Color, Rectangle
+from kivy.graphics.texture import Texture
+from kivy.graphics.transformation import Matrix
+from kivy.metrics import dp
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.label import Label
+from kivy.uix.modalview import ModalView
+from kivy.uix.relativelayout import RelativeLayout
+from kivy.uix.scatter import Scatter
+from kivy.uix.stencilview import StencilView
+from kivy.uix.widget import Widget
+
+import tracing
+from memory import accountant
+from slides import MAX_DECODE_WIDTH
+from tiles import MAX_LEVEL, SOURCE_WIDTH, TILE, TilePyramid, level_size, zoom_level
+from widgets import style_pill_button
+
+PREFETCH_AHEAD = 2
+PREFETCH_BEHIND = 1
+CACHE_SLIDES = 5
+CACHE_BYTES = 24 * 1024 * 1024
+MAX_ZOOM = 2 ** MAX_LEVEL
+WHEEL_ZOOM = 1.25  # per notch of a mouse wheel
+TILE_BUDGET = 24 * 1024 * 1024  # bytes of tile textures, whatever the zoom
+TILE_BYTES = TILE * TILE * 4
+
+
+class SlideView(RelativeLayout):
+    """Draws one DecodedPage, letterboxed to fit the widget."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.slide = None
+        self.page_box = None  # (x, y, width, height) of the page drawn, in this widget
+        # Appended after RelativeLayout's own PushMatrix/Translate, which
+        # must stay in canvas.before
+        with self.canvas.before:
+            self._bg_color = Color(1, 1, 1, 0)
+            self._bg_rect = Rectangle(size=(0, 0))
+        self.bind(size=lambda *args: self._render())
+
+    def show(self, slide):
+        self.slide = slide
+        self._render()
+
+    def release(self):
+        """Drop the widgets and GPU textures of the page on screen; `show` or `_render` redraws it."""
+        self.clear_widgets()
+        if self.slide is not None:
+            self.slide.textures.clear()
+
+    def _render(self):
+        self.clear_widgets()
+        slide = self.slide
+        if slide is None or not self.width or not self.height:
+            return
+        fit = min(self.width / slide.width, self.height / slide.height)
+        left = (self.width - slide.width * fit) / 2
+        top = (self.height + slide.height * fit) / 2
+        self.page_box = (left, top - slide.height * fit, slide.width * fit, slide.height * fit)
+
+        def place(rect):
+            x, y, w, h = rect
+            return (left + x * fit, top - (y + h) * fit), (w * fit, h * fit)
+
+        self._bg_color.rgba = slide.background
+        self._bg_rect.pos = (left, top - slide.height * fit)
+        self._bg_rect.size = (slide.width * fit, slide.height * fit)
+
+        for number, element in enumerate(slide.elements):
+            pos, size = place(element[1])
+            if element[0] == "picture":
+                texture = slide.textures.get(number)
+                if texture is None:
+                    width, height, rgba = element[2]
+                    texture = Texture.create(size=(width, height), colorfmt="rgba")
+                    texture.blit_buffer(rgba, colorfmt="rgba", bufferfmt="ubyte")
+                    texture.flip_vertical()
+                    slide.textures[number] = texture
+                picture = Widget(pos=pos, size=size)
+                with picture.canvas:
+                    Color(1, 1, 1, 1)
+                    Rectangle(texture=texture, pos=pos, size=size)
+                self.add_widget(picture)
+            else:
+                _, _, text, font_px, color, bold = element
+                self.add_widget(Label(
+                    text=text,
+                    pos=pos,
+                    size=size,
+                    size_hint=(None, None),
+                    text_size=size,
+                    font_size=max(font_px * fit, 6),
+                    color=color,
+                    bold=bold,
+                    halign='left',
+                    valign='top'
+                ))
+
+
+class TileLayer(Widget):
+    """Sharp tiles of the zoomed-in part of the page, drawn over the SlideView.
+
+    Only tiles on screen are asked for, nearest the middle first, through
+    `request(key)`; the caller hands them back to `add`. Their textures
+    are kept in a least recently used cache of TILE_BUDGET bytes, and no
+    more tiles than that are ever shown at once, so texture memory stays
+    the same however far the user zooms in.
+    """
+
+    def __init__(self, zoom_view, request, **kwargs):
+        super().__init__(**kwargs)
+        self.zoom_view = zoom_view
+        self.request = request
+        self.wanted = frozenset()  # keys of the tiles on screen
+        self._textures = OrderedDict()  # (page index, fit, level, col, row) -> Texture
+        self._bytes = 0
+        self.update = Clock.create_trigger(self._update)
+
+    @property
+    def memory_used(self):
+        return self._bytes
+
+    def trim(self, target):
+        """Drop tiles that aren't on screen, least recently used first, until at most `target` bytes are held."""
+        for key in list(self._textures):
+            if self._bytes <= target:
+                break
+            if key not in self.wanted:
+                del self._textures[key]
+                self._bytes -= TILE_BYTES
+
+    def clear(self):
+        self.canvas.clear()
+        self._textures.clear()
+        self._bytes = 0
+
+    def add(self, key, pixels):
+        if key not in self.wanted or key in self._textures:
+            return  # panned or zoomed away while it was drawn
+        width, height, rgba = pixels
+        texture = Texture.create(size=(width, height), colorfmt="rgba")
+        texture.blit_buffer(rgba, colorfmt="rgba", bufferfmt="ubyte")
+        texture.flip_vertical()
+        self._textures[key] = texture
+        self._bytes += TILE_BYTES
+        self.trim(TILE_BUDGET)
+        self.update()
+
+    def _update(self, *args):
+        self.canvas.clear()
+        view = self.zoom_view
+        slide, box = view.slide_view.slide, view.slide_view.page_box
+        level = zoom_level(view.scatter.scale)
+        if slide is None or box is None or not level:
+            self.wanted = frozenset()
+            return
+        left, bottom, width, height = box
+        fit = (round(width), round(height))
+        full_width, full_height = level_size(fit, level)
+        unit = width / full_width  # of this widget's coordinates per tile pixel
+        # The part of the page on screen, in pixels from its top-left corner
+        x0, y0 = view.scatter.to_local(view.x, view.y)
+        x1, y1 = view.scatter.to_local(view.right, view.top)
+        top = bottom + height
+        px0, px1 = max(0, (x0 - left) / unit), min(full_width, (x1 - left) / unit)
+        py0, py1 = max(0, (top - y1) / unit), min(full_height, (top - y0) / unit)
+        middle = ((px0 + px1) / 2, (py0 + py1) / 2)
+        keys = sorted(
+            ((slide.index, fit, level, col, row)
+             for col in range(int(px0 // TILE), math.ceil(px1 / TILE))
+             for row in range(int(py0 // TILE), math.ceil(py1 / TILE))),
+            key=lambda k: math.hypot((k[3] + 0.5) * TILE - middle[0], (k[4] + 0.5) * TILE - middle[1])
+        )[:TILE_BUDGET // TILE_BYTES]
+        self.wanted = frozenset(keys)
+        with self.canvas:
+            Color(1, 1, 1, 1)
+            for key in keys:
+                texture = self._textures.get(key)
+                if texture is None:
+                    self.request(key)  # the blurry SlideView shows through meanwhile
+                    continue
+                self._textures.move_to_end(key)
+                col, row = key[3], key[4]
+                tile_width, tile_height = texture.size
+                Rectangle(texture=texture, pos=(left + col * TILE * unit, top - (row * TILE + tile_height) * unit),
+                          size=(tile_width * unit, tile_height * unit))
+
+
+class ZoomView(StencilView):
+    """The page on screen, zoomable up to MAX_ZOOM by pinching, double-tapping
+    or the mouse wheel, and pannable while zoomed in.
+
+    Zooming scales the fitted SlideView on the GPU, so the page follows
+    the fingers at once; a TileLayer then draws what is on screen sharp.
+    Being a StencilView it also keeps zoomed or off-slide pictures from
+    drawing over the viewer controls.
+    """
+
+    def __init__(self, request_tile, **kwargs):
+        super().__init__(**kwargs)
+        self.scatter = Scatter(do_rotation=False, auto_bring_to_front=False, scale_min=1, scale_max=MAX_ZOOM)
+        self.slide_view = SlideView(size_hint=(None, None))
+        self.tiles = TileLayer(self, request_tile)
+        self.scatter.add_widget(self.slide_view)
+        self.scatter.add_widget(self.tiles)
+        self.add_widget(self.scatter)
+        self.bind(pos=self.fit, size=self.fit)
+        self.scatter.bind(transform=self._moved)
+
+    @property
+    def zoomed(self):
+        return self.scatter.scale > 1.01
+
+    def fit(self, *args):
+        """Show the whole page again."""
+        self.scatter.size = self.slide_view.size = self.size
+        self.scatter.transform = Matrix().translate(self.x, self.y, 0)
+
+    def zoom_by(self, factor, anchor):
+        scale = min(MAX_ZOOM, max(1, self.scatter.scale * factor))
+        ratio = scale / self.scatter.scale
+        self.scatter.apply_transform(Matrix().scale(ratio, ratio, 1), anchor=anchor)
+
+    def _moved(self, scatter, transform):
+        # Keep the page filling the view rather than panning off it
+        (x, y), (width, height) = scatter.bbox
+        dx = self.x - x if x > self.x else self.right - (x + width) if x + width < self.right else 0
+        dy = self.y - y if y > self.y else self.top - (y + height) if y + height < self.top else 0
+        if dx or dy:
+            scatter.apply_transform(Matrix().translate(dx, dy, 0))  # calls this again, with nothing left to do
+            return
+        self.tiles.update()
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            return False
+        if touch.is_mouse_scrolling:
+            if touch.button in ("scrollup", "scrolldown"):
+                self.zoom_by(WHEEL_ZOOM if touch.button == "scrolldown" else 1 / WHEEL_ZOOM, touch.pos)
+            return True
+        if touch.is_double_tap:
+            if self.zoomed:
+                self.fit()
+            else:
+                self.zoom_by(2, touch.pos)
+            return True
+        return super().on_touch_down(touch)
+
+
+class DocumentViewer(ModalView):
+    """Full-screen in-app viewer for a SlideDeck or a pdf.PdfDocument.
+
+    Only the page on screen and a small window around it are ever parsed;
+    decoding runs on a worker thread and decoded pages (with their
+    textures) are kept in a small LRU, so memory stays flat however long
+    the document is. Zoomed in, the same worker draws the tiles on screen
+    from one larger decode of the page. `page`, a DecodedPage of `index` saved earlier, is
+    shown without decoding anything, even before the document is open:
+    with `document` None it is shown until set_document() hands it over.
+    """
+
+    def __init__(self, document, title, index=0, page=None, **kwargs):
+        super().__init__(size_hint=(1, 1), auto_dismiss=False, **kwargs)
+        self._first_page_span = tracing.span("viewer.first_page", title=title)
+        self.deck = document
+        self.index = 0
+        self.decode_width = min(Window.width, MAX_DECODE_WIDTH)
+        self._cache = OrderedDict()  # page index -> DecodedPage
+        self._cache_bytes = 0
+        self._lock = Lock()
+        self._queued = set()
+        self._jobs = PriorityQueue()
+        self._order = itertools.count()
+        self._closed = False
+        self._pyramid = None  # TilePyramid of the page last zoomed into; worker only
+        self._touch_start = None
+        self._fingers = 0
+
+        layout = BoxLayout(orientation='vertical', padding=dp(10), spacing=dp(10))
+        self.title_label = Label(text=title, size_hint=(1, None), height=dp(30), color=(1, 1, 1, 1))
+        layout.add_widget(self.title_label)
+
+        self.zoom_view = ZoomView(self._request_tile)
+        self.slide_view = self.zoom_view.slide_view
+        layout.add_widget(self.zoom_view)
+        self.status_label = Label(text="Loading page...", color=(1, 1, 1, 1), size_hint=(1, None), height=dp(24))
+        layout.add_widget(self.status_label)
+
+        controls = BoxLayout(orientation='horizontal', size_hint=(1, None), height=dp(50), spacing=dp(10))
+        prev_button = Button(text="◀ Prev")
+        style_pill_button(prev_button, (0.5, 0.5, 0.5, 1), (1, 1, 1, 1))
+        prev_button.bind(on_release=lambda btn: self.go(self.index - 1))
+        self.page_label = Label(color=(1, 1, 1, 1))
+        next_button = Button(text="Next ▶")
+        style_pill_button(next_button, (0.5, 0.5, 0.5, 1), (1, 1, 1, 1))
+        next_button.bind(on_release=lambda btn: self.go(self.index + 1))
+        close_button = Button(text="❌ Close")
+        style_pill_button(close_button, (0.8, 0.2, 0.2, 1), (1, 1, 1, 1))
+        close_button.bind(on_release=lambda btn: self.dismiss())
+        for widget in (prev_button, self.page_label, next_button, close_button):
+            controls.add_widget(widget)
+        layout.add_widget(controls)
+        self.add_widget(layout)
+
+        accountant.register("viewer.pages", lambda: self._cache_bytes, self._trim_pages, rank=50)
+        accountant.register("viewer.zoom", self._zoom_used, self._trim_zoom, rank=60)
+        if page is not None and page.index == index:
+            self._store(page)
+        self._worker = Thread(target=self._run, daemon=True)
+        if document is None:
+            self.index = index
+            self.page_label.text = f"{index + 1} / ..."
+            if not self._show_current():
+                self.status_label.text = "Opening lesson..."
+            return
+        self._worker.start()
+        self.go(index)
+
+    def set_document(self, document):
+        """The document of a viewer opened without one; pages flip from now on."""
+        if self._closed:
+            document.close()
+            return
+        self.deck = document
+        self._worker.start()
+        self.go(self.index)
+
+    def on_dismiss(self):
+        accountant.unregister("viewer.pages")
+        accountant.unregister("viewer.zoom")
+        self._closed = True
+        self._jobs.put((-1, next(self._order), None))  # wake the worker so it exits
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+        self.zoom_view.tiles.clear()
+        self._pyramid = None
+
+    def current_page(self):
+        """The decoded page on screen, or None while it is still loading."""
+        with self._lock:
+            return self._cache.get(self.index)
+
+    def release(self):
+        """Keep only the page on screen, without its textures, e.g. while the app is paused."""
+        self.slide_view.release()
+        self.zoom_view.tiles.clear()
+        self._pyramid = None
+        with self._lock:
+            for index in [i for i in self._cache if i != self.index]:
+                self._cache_bytes -= self._cache.pop(index).cost
+
+    def _trim_pages(self, target):
+        """Drop the decoded pages furthest from the one on screen until at most `target` bytes are held."""
+        with self._lock:
+            for index in sorted(self._cache, key=lambda i: -abs(i - self.index)):
+                if self._cache_bytes <= target or index == self.index:
+                    break
+                self._cache_bytes -= self._cache.pop(index).cost
+
+    def _zoom_used(self):
+        pyramid = self._pyramid
+        return self.zoom_view.tiles.memory_used + (pyramid.page.cost if pyramid is not None else 0)
+
+    def _trim_zoom(self, target):
+        """Drop tiles off screen, then the larger decode they are drawn from, to hold at most `target` bytes."""
+        pyramid = self._pyramid
+        source = pyramid.page.cost if pyramid is not None else 0
+        self.zoom_view.tiles.trim(max(0, target - source))
+        if self.zoom_view.tiles.memory_used + source > target:
+            self._pyramid = None  # decoded again when a tile is next wanted
+
+    def resume(self):
+        self.slide_view._render()
+        self.go(self.index)  # decodes the neighbours again
+
+    def go(self, index):
+        if self.deck is None:
+            return  # still opening; only the restored page can be shown
+        if not len(self.deck):
+            self.status_label.text = "This document has no pages"
+            return
+        index = max(0, min(index, len(self.deck) - 1))
+        if index != self.index:
+            self.zoom_view.fit()
+        self.index = index
+        self.page_label.text = f"{self.index + 1} / {len(self.deck)}"
+        if not self._show_current():
+            self.status_label.text = "Loading page..."
+            self._enqueue(self.index, 0)
+        for distance in range(1, PREFETCH_AHEAD + 1):
+            self._enqueue(self.index + distance, distance)
+        for distance in range(1, PREFETCH_BEHIND + 1):
+            self._enqueue(self.index - distance, distance + PREFETCH_AHEAD)
+
+    def _show_current(self):
+        """Show the page at self.index if it is decoded already; False if not."""
+        with self._lock:
+            slide = self._cache.get(self.index)
+            if slide is not None:
+                self._cache.move_to_end(self.index)
+        if slide is None:
+            return False
+        self.status_label.text = ""
+        self.slide_view.show(slide)
+        self.zoom_view.tiles.update()
+        tracing.end_on_next_frame(self._first_page_span)
+        self._first_page_span = tracing.NO_SPAN
+        return True
+
+    def _enqueue(self, index, priority):
+        if not 0 <= index < len(self.deck):
+            return
+        with self._lock:
+            if index in self._cache or index in self._queued:
+                return
+            self._queued.add(index)
+        self._jobs.put((priority, next(self._order), index))
+
+    def _request_tile(self, key):
+        with self._lock:
+            if key in self._queued:
+                return
+            self._queued.add(key)
+        self._jobs.put((0, next(self._order), key))
+
+    def _in_window(self, index):
+        return self.index - PREFETCH_BEHIND <= index <= self.index + PREFETCH_AHEAD
+
+    def _run(self):
+        while True:
+            _, _, index = self._jobs.get()
+            if self._closed:
+                self.deck.close()
+                return
+            if isinstance(index, tuple):
+                self._render_tile(index)
+                # Only now, so a tile isn't asked for again while it is drawn
+                with self._lock:
+                    self._queued.discard(index)
+                continue
+            with self._lock:
+                self._queued.discard(index)
+            if not self._in_window(index):
+                continue  # the user has flipped past it
+            try:
+                with tracing.span("viewer.decode", page=index + 1):
+                    slide = self.deck.load_page(index, self.decode_width)
+            except Exception as e:
+                print(f"Could not decode page {index + 1} of {self.deck.path}: {e}")
+                Clock.schedule_once(lambda dt, i=index: self._failed(i))
+                continue
+            self._store(slide)
+            Clock.schedule_once(lambda dt, s=slide: self._loaded(s))
+
+    def _render_tile(self, key):
+        if key not in self.zoom_view.tiles.wanted:
+            return  # panned or zoomed away from it
+        index, fit, level, col, row = key
+        try:
+            pyramid = self._pyramid
+            if pyramid is None or pyramid.index != index:
+                with tracing.span("viewer.zoom_decode", page=index + 1):
+                    page = self.deck.load_page(index, SOURCE_WIDTH, max_width=SOURCE_WIDTH)
+                pyramid = self._pyramid = TilePyramid(page)
+            with tracing.span("viewer.tile", page=index + 1, level=level):
+                pixels = pyramid.render(fit, level, col, row)
+        except Exception as e:
+            print(f"Could not draw page {index + 1} of {self.deck.path} zoomed in: {e}")
+            return
+        Clock.schedule_once(lambda dt: self.zoom_view.tiles.add(key, pixels))
+
+    def _store(self, slide):
+        with self._lock:
+            self._cache[slide.index] = slide
+            self._cache_bytes += slide.cost
+            while len(self._cache) > 1 and (len(self._cache) > CACHE_SLIDES or self._cache_bytes > CACHE_BYTES):
+                # Evict whatever is furthest from the slide on screen
+                victim = max(self._cache, key=lambda i: abs(i - self.index))
+                self._cache_bytes -= self._cache.pop(victim).cost
+
+    def _loaded(self, slide):
+        if slide.index == self.index and not self._closed:
+            self.status_label.text = ""
+            with tracing.span("viewer.show", page=slide.index + 1):
+                self.slide_view.show(slide)
+                self.zoom_view.tiles.update()
+            tracing.end_on_next_frame(self._first_page_span)
+            self._first_page_span = tracing.NO_SPAN
+
+    def _failed(self, index):
+        if index == self.index:
+            self.status_label.text = f"Page {index + 1} could not be displayed"
+
+    def on_touch_down(self, touch):
+        if self.zoom_view.collide_point(*touch.pos) and not touch.is_mouse_scrolling:
+            touch.ud["viewer.finger"] = True
+            self._fingers += 1
+            # A second finger makes it a pinch, not a swipe
+            self._touch_start = touch.x if self._fingers == 1 else None
+        return super().on_touch_down(touch)
+
+    def on_touch_up(self, touch):
+        if touch.ud.pop("viewer.finger", False):
+            self._fingers -= 1
+        # Horizontal swipe on the slide flips pages, unless it pans a zoomed-in one
+        if self._touch_start is not None:
+            dx = touch.x - self._touch_start
+            self._touch_start = None
+            if abs(dx) > dp(60) and not self.zoom_view.zoomed:
+                self.go(self.index + (1 if dx < 0 else -1))
+                return True
+        return super().on_touch_up(touch)
@@ -0,0 +1,321 @@
+"""Live watching of the library folder.
+
+Teachers drop lessons into the week folders while the app runs. The
+watcher reports what changed so the catalog rescans just those folders
+and the search index re-reads just those files.
+
+On Linux and Android the kernel reports changes through inotify, one
+watch per folder, at no cost while nothing happens. Elsewhere, or when
+inotify is unavailable, the tree is polled: folder mtimes every few
+seconds (a file added, removed or renamed changes its folder's mtime)
+and every file's size and mtime now and then, for files rewritten in
+place.
+
+Events are debounced, so a file still being copied is reported once it
+has been quiet for a moment, and coalesced into one batch of paths.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+DEBOUNCE = 1.0     # seconds without events before a batch is reported
+MAX_DELAY = 10.0   # report a batch this long after its first event, even if events keep coming
+STOP_CHECK = 0.5   # longest wait for events before checking whether to stop
+POLL_INTERVAL = 3.0
+FULL_POLL_EVERY = 10  # polls between checks of every file, not just folders
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT = struct.Struct("iIII")  # watch descriptor, mask, cookie, name length
+READ_SIZE = 64 * 1024
+
+
+def _join(rel, name):
+    return f"{rel}/{name}" if rel else name
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:
+        return None
+    return libc if hasattr(libc, "inotify_init1") else None
+
+
+class InotifyWatch:
+    """Kernel change events for every folder under `root`."""
+
+    name = "inotify"
+
+    def __init__(self, root):
+        self.root = root
+        self._libc = _libc()
+        if self._libc is None:
+            raise OSError("inotify is not available")
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._folders = {}  # watch descriptor -> relative folder
+        self._wake_read, self._wake_write = os.pipe()
+        try:
+            self._watch_tree("")
+        except OSError:
+            self.close()
+            raise
+
+    def _watch_tree(self, rel):
+        for folder, dirs, names in os.walk(os.path.join(self.root, *rel.split("/")) if rel else self.root):
+            folder_rel = os.path.relpath(folder, self.root).replace(os.sep, "/")
+            folder_rel = "" if folder_rel == "." else folder_rel
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), WATCH_MASK)
+            if wd < 0:
+                # ENOSPC: out of watches (fs.inotify.max_user_watches); the caller falls back to polling
+                raise OSError(ctypes.get_errno(), f"Cannot watch {folder}")
+            self._folders[wd] = folder_rel
+
+    def _unwatch_tree(self, rel):
+        prefix = rel + "/"
+        for wd, folder in list(self._folders.items()):
+            if folder == rel or folder.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._folders[wd]
+
+    def read(self, timeout):
+        """Paths that changed, waiting up to `timeout` seconds for the first; None means
+        events were lost and anything may have changed."""
+        ready, _, _ = select.select([self._fd, self._wake_read], [], [], timeout)
+        if self._fd not in ready:
+            return []
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        paths = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self._folders.pop(wd, None)
+                continue
+            folder = self._folders.get(wd)
+            if folder is None or mask & IN_DELETE_SELF:
+                continue
+            path = _join(folder, os.fsdecode(name)) if name else folder
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may have landed in it before the watch did; the
+                    # catalog scans the whole new folder anyway
+                    try:
+                        self._watch_tree(path)
+                    except OSError as e:
+                        print(f"Cannot watch {path}: {e}")
+                elif mask & IN_MOVED_FROM:
+                    self._unwatch_tree(path)
+            paths.append(path)
+        return paths
+
+    def wake(self):
+        """Make a pending read() return now."""
+        os.write(self._wake_write, b"\0")
+
+    def close(self):
+        if self._fd >= 0:
+            for fd in (self._fd, self._wake_read, self._wake_write):
+                os.close(fd)
+            self._fd = -1
+
+
+class PollingWatch:
+    """Changes found by comparing stats with the previous poll, every `interval` seconds."""
+
+    name = "polling"
+
+    def __init__(self, root, interval=POLL_INTERVAL, full_every=FULL_POLL_EVERY):
+        self.root = root
+        self.interval = interval
+        self.full_every = full_every
+        self._folders = {}  # relative folder -> mtime
+        self._files = {}    # relative path -> (size, mtime)
+        self._settling = set()  # files in folders that just changed, maybe still being copied
+        self._polls = 0
+        self._next = time.monotonic() + interval
+        self._woken = threading.Event()
+        self._record_tree("")
+
+    def _abs(self, rel):
+        return os.path.join(self.root, *rel.split("/")) if rel else self.root
+
+    def _record_tree(self, rel):
+        """Remember every folder and file under `rel`; returns the files' paths."""
+        found = []
+        for folder, dirs, names in os.walk(self._abs(rel)):
+            folder_rel = os.path.relpath(folder, self.root).replace(os.sep, "/")
+            folder_rel = "" if folder_rel == "." else folder_rel
+            try:
+                self._folders[folder_rel] = os.stat(folder).st_mtime
+            except OSError:
+                continue
+            for name in names:
+                path = _join(folder_rel, name)
+                try:
+                    st = os.stat(os.path.join(folder, name))
+                except OSError:
+                    continue
+                self._files[path] = (st.st_size, st.st_mtime)
+                found.append(path)
+        return found
+
+    def _forget_tree(self, rel):
+        prefix = rel + "/" if rel else ""
+        for folder in [f for f in self._folders if f == rel or f.startswith(prefix)]:
+            del self._folders[folder]
+        for path in [p for p in self._files if p.startswith(prefix)]:
+            del self._files[path]
+
+    def read(self, timeout):
+        wait = self._next - time.monotonic()
+        if self._woken.wait(max(0.0, min(wait, timeout))) or wait > timeout:
+            return []
+        self._next = time.monotonic() + self.interval
+        self._polls += 1
+        if self._polls % self.full_every == 0:
+            return self._poll_files()
+        return self._poll_folders()
+
+    def _poll_folders(self):
+        changed = []
+        for path in list(self._settling):
+            try:
+                st = os.stat(self._abs(path))
+                stat = (st.st_size, st.st_mtime)
+            except OSError:
+                stat = None
+            if stat == self._files.get(path):
+                self._settling.discard(path)
+                continue
+            if stat is None:
+                self._files.pop(path, None)
+                self._settling.discard(path)
+            else:
+                self._files[path] = stat
+            changed.append(path)
+        for rel, mtime in list(self._folders.items()):
+            if rel not in self._folders:
+                continue  # forgotten with its parent during this poll
+            try:
+                now = os.stat(self._abs(rel)).st_mtime
+            except OSError:
+                self._forget_tree(rel)
+                changed.append(rel)
+                continue
+            if now != mtime:
+                self._forget_tree(rel)
+                self._settling.update(self._record_tree(rel))
+                changed.append(rel)
+        return changed
+
+    def _poll_files(self):
+        before = self._files
+        self._folders, self._files = {}, {}
+        self._settling.clear()
+        self._record_tree("")
+        return sorted(path for path in before.keys() | self._files.keys() if before.get(path) != self._files.get(path))
+
+    def wake(self):
+        self._woken.set()
+
+    def close(self):
+        pass
+
+
+class LibraryWatcher:
+    """Calls `on_change(paths)` on its own thread with batches of changed library paths.
+
+    Paths are relative, "/"-separated files and folders that were added,
+    changed or removed; None means events were lost and the whole tree
+    should be checked.
+    """
+
+    def __init__(self, root, on_change, debounce=DEBOUNCE, max_delay=MAX_DELAY, poll_interval=POLL_INTERVAL):
+        self.root = root
+        self.on_change = on_change
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.watch = None
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """Start watching; the initial walk of the tree happens on the watcher's
+        own thread, so this returns at once however big the library."""
+        self._thread = threading.Thread(target=self._run, name="library-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def _open(self):
+        try:
+            return InotifyWatch(self.root)
+        except OSError as e:
+            print(f"Watching the library by polling: {e}")
+            return PollingWatch(self.root, self.poll_interval)
+
+    def stop(self):
+        self._stopped = True
+        if self.watch is not None:
+            self.watch.wake()
+        if self._thread is not None:
+            self._thread.join()
+        if self.watch is not None:
+            self.watch.close()
+
+    def _run(self):
+        self.watch = self._open()
+        if self._stopped:
+            return  # stopped during the walk; stop() closes the watch
+        # A poller sees a copy in progress once per interval, so quiet means a whole interval without change
+        debounce = max(self.debounce, getattr(self.watch, "interval", 0) * 1.5)
+        pending = set()
+        lost = False
+        first = last = None
+        while not self._stopped:
+            timeout = STOP_CHECK
+            if first is not None:
+                timeout = min(timeout, max(0.0, min(last + debounce, first + self.max_delay) - time.monotonic()))
+            paths = self.watch.read(timeout)
+            now = time.monotonic()
+            if paths is None:
+                lost = True
+            if paths or paths is None:
+                first = first or now
+                last = now
+                pending.update(paths or ())
+            if first is None or (now - last < debounce and now - first < self.max_delay):
+                continue
+            batch = None if lost else sorted(pending)
+            pending.clear()
+            lost = False
+            first = last = None
+            try:
+                self.on_change(batch)
+            except Exception as e:
+                print(f"Could not apply library changes: {e}")
@@ -0,0 +1,162 @@
+from kivy.core.text import Label as CoreLabel
+from kivy.graphics import BorderImage, Color, Rectangle
+from kivy.metrics import dp
+from kivy.properties import ListProperty, ObjectProperty
+from kivy.uix.button import Button
+from kivy.uix.label import Label
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+
+from responsive import metrics
+from textures import label_cache, pill_texture
+
+
+def style_pill_button(btn, bg_color, text_color, radius=dp(20)):
+    """Give a Button the rounded "pill" look used throughout the app."""
+    btn.background_color = (0, 0, 0, 0)
+    btn.color = text_color
+    btn.background_normal = ''
+    btn.background_down = ''
+
+    texture = pill_texture(radius)
+    border = (texture.width - 2) // 2
+    with btn.canvas.before:
+        # Kept so reused buttons can be recoloured without new instructions
+        btn.rect_color = Color(*bg_color)
+        btn.rect = BorderImage(texture=texture, border=(border,) * 4, auto_scale='both_lower',
+                               size=btn.size, pos=btn.pos)
+    btn.bind(size=_update_btn_rect, pos=_update_btn_rect)
+
+
+def _update_btn_rect(instance, *args):
+    instance.rect.pos = instance.pos
+    instance.rect.size = instance.size
+
+
+class PillRow(Button):
+    """Pill button used as the row view of a VirtualList.
+
+    RecycleView sets `text`, `pill_color`, `nav_action` etc. from each data
+    dict as rows scroll into view, so one instance serves many items.
+    Rows with a `thumb_key` draw a thumbnail on their left once
+    `thumbnail_loader` has produced it.
+    """
+
+    pill_color = ListProperty([0.8, 0.8, 0.8, 1])
+    nav_action = ObjectProperty(None, allownone=True)
+    thumb_key = ObjectProperty(None, allownone=True)
+
+    # Shared ThumbnailLoader, set up by MainMenu
+    thumbnail_loader = None
+
+    def __init__(self, **kwargs):
+        self._requested_key = None
+        super().__init__(**kwargs)
+        style_pill_button(self, self.pill_color, (1, 1, 1, 1))
+        with self.canvas.after:
+            self.thumb_color = Color(1, 1, 1, 0)
+            self.thumb_rect = Rectangle(size=(0, 0))
+        self.bind(size=self._place_thumb, pos=self._place_thumb)
+
+    def on_thumb_key(self, instance, key):
+        self._set_thumb(None)
+        loader = PillRow.thumbnail_loader
+        if loader is not None and self._requested_key is not None:
+            # Recycled for another item: the old preview is no longer wanted
+            loader.cancel(self._requested_key, self._on_thumb_loaded)
+        self._requested_key = key
+        if key is not None and loader is not None:
+            texture = loader.request(key, self._on_thumb_loaded)
+            if texture is not None:
+                self._set_thumb(texture)
+
+    def _on_thumb_loaded(self, key, texture):
+        if key == self._requested_key:
+            self._requested_key = None
+        # The row may have been recycled for another item in the meantime
+        if key == self.thumb_key:
+            self._set_thumb(texture)
+
+    def _set_thumb(self, texture):
+        if not hasattr(self, 'thumb_rect'):
+            return
+        self.thumb_rect.texture = texture
+        self.thumb_color.a = 1 if texture is not None else 0
+        self.padding = [self._thumb_size()[0] + dp(12), 0, 0, 0] if texture is not None else [0, 0, 0, 0]
+        self._place_thumb()
+
+    def _thumb_size(self):
+        texture = self.thumb_rect.texture
+        if texture is None:
+            return 0, 0
+        height = self.height - dp(8)
+        return height * texture.width / max(texture.height, 1), height
+
+    def _place_thumb(self, *args):
+        width, height = self._thumb_size()
+        self.thumb_rect.size = (width, height)
+        self.thumb_rect.pos = (self.x + dp(12), self.y + dp(4))
+
+    def on_pill_color(self, instance, value):
+        if hasattr(self, 'rect_color'):
+            self.rect_color.rgba = value
+
+    def on_release(self):
+        if self.nav_action is not None:
+            self.nav_action()
+
+    def texture_update(self, *largs):
+        # Rows are recycled while scrolling and between levels, so the same
+        # names come back again and again; reuse their rendered text
+        core = self._label
+        if not core.text or core.__class__ is not CoreLabel:
+            return super().texture_update(*largs)
+        key = label_cache.key(core)
+        cached = label_cache.get(key)
+        if cached is None:
+            super().texture_update(*largs)
+            if self.texture is None or self.texture is not core.texture or min(self.texture.size) <= 1:
+                return
+            label_cache.put(key, core)
+            # The cache owns that core label and its texture now
+            self._label = CoreLabel(**{name: getattr(self, name) for name in Label._font_properties})
+            return
+        self.texture = cached.texture
+        self.texture_size = list(cached.texture.size)
+        self.is_shortened = cached.is_shortened
+
+
+class VirtualList(RecycleView):
+    """Scrolling list of pill rows that only creates widgets for visible rows.
+
+    Set `data` to a list of dicts with at least `text` and `nav_action`;
+    their `font_size` is kept at `font_base` scaled to the window.
+    """
+
+    def __init__(self, row_height=dp(50), spacing=dp(15), font_base=14, **kwargs):
+        super().__init__(**kwargs)
+        layout = RecycleBoxLayout(
+            orientation='vertical',
+            default_size=(None, row_height),
+            default_size_hint=(1, None),
+            size_hint_y=None,
+            spacing=spacing
+        )
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+        # Only takes effect once the layout manager is attached
+        self.viewclass = PillRow
+        self.row_height = row_height
+        self.row_spacing = spacing
+        self.font_base = font_base
+        metrics.listen(self._rescale_rows)
+
+    def _rescale_rows(self):
+        font_size = metrics.font(self.font_base)
+        for row in self.data:
+            row['font_size'] = font_size
+        self.refresh_from_data()
+
+    def content_height(self, count):
+        """Height needed to show `count` rows without scrolling."""
+        return max(0, count * self.row_height + (count - 1) * self.row_spacing)